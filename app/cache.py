@@ -0,0 +1,230 @@
+"""
+Cache de resultados dos serviços com TTL, despejo LRU e invalidação por escrita
+"""
+import copy
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.config import CACHE_TTL, CACHE_MAX_ITENS
+from app.versoes import incrementar_versoes
+
+class CacheResultados:
+    """Cache em memória limitado por tamanho (LRU) e por tempo de vida (TTL)"""
+
+    def __init__(self, ttl: int = CACHE_TTL, max_itens: int = CACHE_MAX_ITENS):
+        self.ttl = ttl
+        self.max_itens = max_itens
+        self._itens: "OrderedDict[tuple, tuple]" = OrderedDict()  # chave -> (expira_em, tabelas, valor)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirados = 0
+        self.despejados = 0
+        self.invalidados = 0
+
+    def obter(self, chave: tuple, padrao: Any = None) -> Any:
+        """Retorna o valor em cache ou padrao se ausente/expirado"""
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                self.misses += 1
+                return padrao
+            
+            expira_em, _, valor = item
+            if expira_em < time.monotonic():
+                del self._itens[chave]
+                self.expirados += 1
+                self.misses += 1
+                return padrao
+            
+            self._itens.move_to_end(chave)
+            self.hits += 1
+            return valor
+
+    def guardar(self, chave: tuple, valor: Any, tabelas: Iterable[str]):
+        """Armazena um valor associado às tabelas das quais ele depende"""
+        with self._lock:
+            self._itens[chave] = (time.monotonic() + self.ttl, frozenset(tabelas), valor)
+            self._itens.move_to_end(chave)
+            
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+                self.despejados += 1
+
+    def invalidar(self, tabelas: Optional[Iterable[str]] = None) -> int:
+        """
+        Remove as entradas que dependem de alguma das tabelas informadas
+        
+        Args:
+            tabelas: Tabelas alteradas; None remove todas as entradas
+            
+        Returns:
+            int: Quantidade de entradas removidas
+        """
+        with self._lock:
+            if tabelas is None:
+                removidas = list(self._itens)
+            else:
+                alteradas = set(tabelas)
+                removidas = [
+                    chave for chave, (_, dependencias, _) in self._itens.items()
+                    if dependencias & alteradas
+                ]
+            
+            for chave in removidas:
+                del self._itens[chave]
+            self.invalidados += len(removidas)
+            return len(removidas)
+
+    def estatisticas(self) -> Dict[str, Any]:
+        """Contadores de uso do cache"""
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                "itens": len(self._itens),
+                "max_itens": self.max_itens,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "taxa_acerto": round(self.hits / consultas, 3) if consultas else 0.0,
+                "expirados": self.expirados,
+                "despejados": self.despejados,
+                "invalidados": self.invalidados
+            }
+
+cache_servicos = CacheResultados()
+
+# Marcador de ausência no cache (None é um resultado válido)
+_AUSENTE = object()
+
+def _congelar(valor: Any) -> Any:
+    """Converte argumentos em valores hasheáveis para compor a chave"""
+    if isinstance(valor, (list, tuple)):
+        return tuple(_congelar(v) for v in valor)
+    if isinstance(valor, (set, frozenset)):
+        return tuple(sorted((_congelar(v) for v in valor), key=repr))
+    if isinstance(valor, dict):
+        return tuple(sorted(((k, _congelar(v)) for k, v in valor.items()), key=repr))
+    return valor
+
+def _chave(func: Callable, assinatura: inspect.Signature, args: tuple, kwargs: dict) -> tuple:
+    """
+    Chave do resultado: nome da função e argumentos normalizados
+    
+    Os argumentos são associados aos nomes dos parâmetros, com os valores
+    padrão aplicados, de modo que f(db, 10), f(db, limit=10) e f(db) (com
+    limit=10 por padrão) compartilhem a mesma entrada. O primeiro parâmetro
+    (a sessão do banco) não entra na chave.
+    """
+    argumentos = assinatura.bind(None, *args, **kwargs)
+    argumentos.apply_defaults()
+    nomes = list(argumentos.arguments)[1:]
+    return (func.__qualname__, tuple((nome, _congelar(argumentos.arguments[nome])) for nome in nomes))
+
+def cache_resultado(*tabelas: str) -> Callable:
+    """
+    Decorador que guarda o resultado de um serviço em cache_servicos
+    
+    A chave é composta pelo nome da função e pelos argumentos normalizados
+    (ver _chave). Cada chamada recebe uma cópia do resultado: alterações
+    feitas por quem chamou não chegam à entrada em cache. Serviços
+    assíncronos (async def) são aguardados da mesma forma.
+    
+    Args:
+        *tabelas: Tabelas cujas escritas invalidam o resultado
+    """
+    def decorador(func: Callable) -> Callable:
+        assinatura = inspect.signature(func)
+        
+        @wraps(func)
+        def wrapper(db, *args, **kwargs):
+            chave = _chave(func, assinatura, args, kwargs)
+            valor = cache_servicos.obter(chave, _AUSENTE)
+            if valor is _AUSENTE:
+                valor = func(db, *args, **kwargs)
+                cache_servicos.guardar(chave, copy.deepcopy(valor), tabelas)
+                return valor
+            return copy.deepcopy(valor)
+        
+        @wraps(func)
+        async def wrapper_assincrono(db, *args, **kwargs):
+            chave = _chave(func, assinatura, args, kwargs)
+            valor = cache_servicos.obter(chave, _AUSENTE)
+            if valor is _AUSENTE:
+                valor = await func(db, *args, **kwargs)
+                cache_servicos.guardar(chave, copy.deepcopy(valor), tabelas)
+                return valor
+            return copy.deepcopy(valor)
+        
+        if inspect.iscoroutinefunction(func):
+            wrapper = wrapper_assincrono
+        wrapper.sem_cache = func
+        return wrapper
+    return decorador
+
+# ====== INVALIDAÇÃO POR ESCRITA ======
+
+def _tabelas_alteradas(session: Session) -> Set[str]:
+    return session.info.setdefault("tabelas_alteradas", set())
+
+def anotar_escrita(session: Session, *tabelas: str):
+    """Anota escritas que os eventos do ORM não enxergam, notificadas no próximo commit"""
+    _tabelas_alteradas(session).update(tabelas)
+
+@event.listens_for(Session, "after_flush")
+def _registrar_flush(session, flush_context):
+    """Anota as tabelas escritas pelo flush da unidade de trabalho"""
+    tabelas = _tabelas_alteradas(session)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        tabela = getattr(obj, "__tablename__", None)
+        if tabela:
+            tabelas.add(tabela)
+
+@event.listens_for(Session, "do_orm_execute")
+def _registrar_execucao(orm_execute_state):
+    """Anota as tabelas escritas por INSERT/UPDATE/DELETE em lote"""
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None:
+            _tabelas_alteradas(orm_execute_state.session).add(mapper.local_table.name)
+
+@event.listens_for(Session, "before_commit")
+def _versionar_antes_do_commit(session):
+    """Grava, na própria transação, a nova versão das tabelas alteradas (app.versoes)"""
+    session.flush()
+    tabelas = session.info.get("tabelas_alteradas")
+    if tabelas:
+        incrementar_versoes(session, tabelas)
+
+@event.listens_for(Session, "after_commit")
+def _invalidar_apos_commit(session):
+    """Invalida o cache com as tabelas efetivamente gravadas"""
+    tabelas = session.info.pop("tabelas_alteradas", None)
+    if tabelas:
+        registrar_escrita(tabelas)
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_apos_rollback(session):
+    session.info.pop("tabelas_alteradas", None)
+
+# Funções chamadas com o conjunto de tabelas a cada escrita confirmada
+_ouvintes_escrita: List[Callable[[Set[str]], None]] = []
+
+def ao_escrever(func: Callable[[Set[str]], None]) -> Callable[[Set[str]], None]:
+    """Registra uma função a ser notificada das escritas confirmadas"""
+    _ouvintes_escrita.append(func)
+    return func
+
+def registrar_escrita(tabelas: Iterable[str]):
+    """Notifica uma escrita confirmada nas tabelas informadas"""
+    tabelas = set(tabelas)
+    cache_servicos.invalidar(tabelas)
+    for ouvinte in _ouvintes_escrita:
+        ouvinte(tabelas)
@@ -0,0 +1,46 @@
+"""
+Configurações do SGV lidas do ambiente (ou do arquivo config.env)
+"""
+import os
+from dotenv import load_dotenv
+
+# Variáveis já definidas no ambiente têm precedência sobre o arquivo
+load_dotenv("config.env")
+
+# Banco de dados: URL principal e, opcionalmente, uma réplica para leitura
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/sgv.db")
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL") or None
+
+# Pool de conexões (por engine)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))  # segundos
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # segundos
+
+# Pragmas aplicados a cada conexão SQLite
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # bytes
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # negativo = KiB
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))  # milissegundos
+
+# Cache de resultados dos serviços
+CACHE_TTL = int(os.getenv("CACHE_TTL", "300"))  # segundos
+CACHE_MAX_ITENS = int(os.getenv("CACHE_MAX_ITENS", "256"))
+
+# Mapa: abaixo deste zoom as viaturas são devolvidas agrupadas em clusters
+GEO_ZOOM_AGRUPAMENTO = int(os.getenv("GEO_ZOOM_AGRUPAMENTO", "13"))
+
+# Tiles de batalhões e bases mantidos em memória
+TILES_MAX_ITENS = int(os.getenv("TILES_MAX_ITENS", "2048"))
+TILES_MAX_CAMADAS = int(os.getenv("TILES_MAX_CAMADAS", "8"))  # zooms simplificados
+
+# Ingestão de posições: intervalo entre gravações, veículos que antecipam a
+# gravação e mensagens pendentes por cliente do mapa antes de pedir recarga
+POSICOES_INTERVALO = float(os.getenv("POSICOES_INTERVALO", "0.5"))  # segundos
+POSICOES_LOTE = int(os.getenv("POSICOES_LOTE", "5000"))
+POSICOES_FILA_CLIENTE = int(os.getenv("POSICOES_FILA_CLIENTE", "100"))
+
+# Indicadores derivados dos eventos: janela de manutenções contadas em
+# manutencoes_6m e intervalo entre as aplicações da janela
+MANUTENCOES_JANELA_DIAS = int(os.getenv("MANUTENCOES_JANELA_DIAS", "182"))
+INDICADORES_INTERVALO = float(os.getenv("INDICADORES_INTERVALO", "3600"))  # segundos
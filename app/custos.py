@@ -0,0 +1,153 @@
+"""
+Custo de manutenção acumulado por veículo e mês
+
+custo_manutencao_mensal guarda, para cada (veiculo_id, ano_mes) com
+manutenções, o custo e a quantidade do mês e os valores acumulados desde a
+primeira manutenção do veículo. O custo de qualquer janela de meses é a
+diferença entre dois acumulados, cada um lido por uma busca na chave
+primária, sem somar o histórico de manutenções.
+
+A tabela é mantida pelo flush: gravar, alterar ou remover Manutencao refaz
+as linhas apenas dos veículos afetados. reconstruir_custos refaz a tabela
+inteira numa única passada (usada no primeiro startup e após cargas em lote).
+"""
+from datetime import datetime
+from typing import Iterable, Optional, Set
+
+from sqlalchemy import String, cast, delete, event, func, inspect, insert, select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import ColumnElement
+
+from app.cache import anotar_escrita
+from app.models import Veiculo, Manutencao, CustoManutencaoMensal, SistemaMeta
+
+# Veículos recalculados por instrução
+LOTE_VEICULOS = 500
+
+# Chave em SistemaMeta que indica que a tabela já foi construída
+CHAVE_CONSTRUIDA = "custo_manutencao_mensal"
+
+_COLUNAS = ("veiculo_id", "ano_mes", "custo", "quantidade", "custo_acumulado", "quantidade_acumulada")
+
+def mes_atual() -> str:
+    """Competência corrente (YYYY-MM)"""
+    return datetime.now().strftime("%Y-%m")
+
+def deslocar_mes(ano_mes: str, meses: int) -> str:
+    """Competência deslocada de um número de meses (negativo para trás)"""
+    ano, mes = map(int, ano_mes.split("-"))
+    indice = ano * 12 + (mes - 1) + meses
+    return f"{indice // 12:04d}-{indice % 12 + 1:02d}"
+
+def _agregacao():
+    """SELECT com custo mensal e acumulado por veículo, na ordem das colunas da tabela"""
+    # 'YYYY-MM' do início da data, igual no SQLite e no PostgreSQL
+    ano_mes = func.substr(cast(Manutencao.data, String), 1, 7)
+    custo = func.coalesce(func.sum(Manutencao.custo), 0.0)
+    quantidade = func.count(Manutencao.id)
+    ordem = {"partition_by": Manutencao.veiculo_id, "order_by": ano_mes}
+    return (
+        select(
+            Manutencao.veiculo_id, ano_mes, custo, quantidade,
+            func.sum(custo).over(**ordem), func.sum(quantidade).over(**ordem)
+        )
+        .group_by(Manutencao.veiculo_id, ano_mes)
+    )
+
+def recalcular_veiculos(db: Session, veiculo_ids: Iterable[int]) -> int:
+    """
+    Refaz as linhas dos veículos informados a partir de manutencao
+    
+    Returns:
+        int: Quantidade de linhas gravadas
+    """
+    ids = sorted(veiculo_ids)
+    gravadas = 0
+    for i in range(0, len(ids), LOTE_VEICULOS):
+        lote = ids[i:i + LOTE_VEICULOS]
+        db.execute(delete(CustoManutencaoMensal).where(CustoManutencaoMensal.veiculo_id.in_(lote)))
+        gravadas += db.execute(
+            insert(CustoManutencaoMensal).from_select(
+                _COLUNAS, _agregacao().where(Manutencao.veiculo_id.in_(lote))
+            )
+        ).rowcount
+    anotar_escrita(db, CustoManutencaoMensal.__tablename__)
+    return gravadas
+
+def reconstruir_custos(db: Session) -> int:
+    """
+    Refaz a tabela de custos acumulados inteira a partir de manutencao
+    
+    Returns:
+        int: Quantidade de linhas gravadas
+    """
+    db.execute(delete(CustoManutencaoMensal))
+    gravadas = db.execute(insert(CustoManutencaoMensal).from_select(_COLUNAS, _agregacao())).rowcount
+    anotar_escrita(db, CustoManutencaoMensal.__tablename__)
+    db.merge(SistemaMeta(chave=CHAVE_CONSTRUIDA, valor="1"))
+    db.commit()
+    return gravadas
+
+def sincronizar_custos(db: Session) -> int:
+    """Constrói a tabela de custos se ela ainda não foi construída neste banco"""
+    if db.get(SistemaMeta, CHAVE_CONSTRUIDA) is not None:
+        return 0
+    return reconstruir_custos(db)
+
+# ====== CONSULTAS ======
+
+def acumulado_ate(
+    ano_mes: str,
+    coluna: ColumnElement = CustoManutencaoMensal.custo_acumulado,
+    inclusive: bool = True
+) -> ColumnElement:
+    """
+    Valor acumulado do veículo (correlacionado a Veiculo) até a competência
+    
+    Lê a última linha do veículo até ano_mes pela chave primária; sem linhas,
+    o acumulado é zero.
+    """
+    limite = CustoManutencaoMensal.ano_mes <= ano_mes if inclusive else CustoManutencaoMensal.ano_mes < ano_mes
+    ultima = (
+        select(coluna)
+        .where(CustoManutencaoMensal.veiculo_id == Veiculo.id, limite)
+        .order_by(CustoManutencaoMensal.ano_mes.desc())
+        .limit(1)
+        .correlate(Veiculo)
+        .scalar_subquery()
+    )
+    return func.coalesce(ultima, 0)
+
+def custo_janela(meses: int, ate: Optional[str] = None) -> ColumnElement:
+    """Custo de manutenção do veículo nos últimos `meses` meses até a competência"""
+    ate = ate or mes_atual()
+    inicio = deslocar_mes(ate, -(meses - 1))
+    return acumulado_ate(ate) - acumulado_ate(inicio, inclusive=False)
+
+# ====== EVENTOS DO ORM ======
+
+@event.listens_for(Session, "after_flush")
+def _registrar_manutencoes(session, flush_context):
+    """Anota os veículos cujas manutenções foram gravadas, alteradas ou removidas"""
+    pendentes: Optional[Set[int]] = None
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Manutencao):
+            if pendentes is None:
+                pendentes = session.info.setdefault("custos_pendentes", set())
+            pendentes.add(obj.veiculo_id)
+            # Manutenção transferida de veículo: o anterior também muda
+            pendentes.update(inspect(obj).attrs.veiculo_id.history.deleted or ())
+    if pendentes:
+        pendentes.discard(None)
+
+@event.listens_for(Session, "after_flush_postexec")
+def _atualizar_custos(session, flush_context):
+    """Refaz os custos acumulados dos veículos anotados"""
+    pendentes = session.info.pop("custos_pendentes", None)
+    if pendentes:
+        with session.no_autoflush:
+            recalcular_veiculos(session, pendentes)
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_pendentes(session):
+    session.info.pop("custos_pendentes", None)
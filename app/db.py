@@ -1,25 +1,129 @@
 """
-Configuração do banco de dados SQLite
+Configuração do banco de dados
+
+O engine é montado a partir de DATABASE_URL (SQLite por padrão). Em SQLite,
+as conexões recebem os pragmas de WAL, sincronização, mmap, cache e espera
+por lock; os GETs usam um engine separado, somente leitura, para que
+leitores concorrentes não disputem conexões com as escritas.
+
+Os endpoints de leitura de alto volume (dashboard e viaturas no mapa) usam
+ainda um engine assíncrono (aiosqlite, ou asyncpg com PostgreSQL) sobre a
+mesma URL de leitura; os caminhos síncronos continuam disponíveis para os
+demais endpoints e para scripts como o seed.
 """
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL, Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import os
 
+from app.migracoes import aplicar_migracoes
+from app.config import (
+    DATABASE_URL, DATABASE_READ_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE, SQLITE_SYNCHRONOUS, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE, SQLITE_BUSY_TIMEOUT
+)
+
 # Criar diretório data se não existir
 os.makedirs("data", exist_ok=True)
 
-# URL do banco SQLite
-SQLALCHEMY_DATABASE_URL = "sqlite:///./data/sgv.db"
+# URL do banco (config.env / ambiente)
+SQLALCHEMY_DATABASE_URL = DATABASE_URL
 
-# Engine do SQLAlchemy
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, 
-    connect_args={"check_same_thread": False}
-)
+def _em_memoria(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+def _configurar_sqlite(engine: Engine, somente_leitura: bool):
+    """Aplica os pragmas a cada nova conexão SQLite"""
+    arquivo = not _em_memoria(engine.url)
+    
+    @event.listens_for(engine, "connect")
+    def _pragmas(conexao_dbapi, registro):
+        cursor = conexao_dbapi.cursor()
+        if arquivo and not somente_leitura:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+        if somente_leitura:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+def _opcoes_engine(url: URL, somente_leitura: bool) -> dict:
+    """Pool e opções de conexão do banco configurado"""
+    opcoes = {"pool_pre_ping": True}
+    
+    if url.get_backend_name() == "sqlite":
+        opcoes["connect_args"] = {"check_same_thread": False}
+    elif somente_leitura and url.get_backend_name() == "postgresql":
+        opcoes["execution_options"] = {"postgresql_readonly": True}
+    
+    # Banco em memória usa um pool de conexão única, sem dimensionamento
+    if not _em_memoria(url):
+        opcoes.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE
+        )
+    return opcoes
+
+def criar_engine(url: str, somente_leitura: bool = False) -> Engine:
+    """
+    Cria um engine com o pool e as opções do banco configurado
+    
+    Args:
+        url: URL do SQLAlchemy
+        somente_leitura: Recusar escritas nas conexões (query_only no SQLite,
+            transações read-only no PostgreSQL)
+    """
+    url = make_url(url)
+    engine = create_engine(url, **_opcoes_engine(url, somente_leitura))
+    if url.get_backend_name() == "sqlite":
+        _configurar_sqlite(engine, somente_leitura)
+    return engine
+
+# Driver assíncrono de cada banco
+DRIVERS_ASSINCRONOS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+def criar_engine_assincrono(url: str, somente_leitura: bool = False) -> AsyncEngine:
+    """Cria um engine assíncrono (mesmas opções de criar_engine) para a URL"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in DRIVERS_ASSINCRONOS:
+        raise ValueError(f"Banco sem driver assíncrono: {backend}")
+    
+    url = url.set(drivername=f"{backend}+{DRIVERS_ASSINCRONOS[backend]}")
+    opcoes = _opcoes_engine(url, somente_leitura)
+    if backend == "sqlite" and not _em_memoria(url):
+        # O aiosqlite usa NullPool por padrão: uma conexão nova por sessão
+        opcoes["poolclass"] = AsyncAdaptedQueuePool
+    engine = create_async_engine(url, **opcoes)
+    if backend == "sqlite":
+        _configurar_sqlite(engine.sync_engine, somente_leitura)
+    return engine
+
+# Engine do SQLAlchemy (escritas) e engine somente leitura (GETs); um banco
+# em memória existe só na sua conexão, então é compartilhado
+engine = criar_engine(SQLALCHEMY_DATABASE_URL)
+if DATABASE_READ_URL or not _em_memoria(engine.url):
+    engine_leitura = criar_engine(DATABASE_READ_URL or SQLALCHEMY_DATABASE_URL, somente_leitura=True)
+else:
+    engine_leitura = engine
 
-# Session maker
+# Session makers
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLeitura = sessionmaker(autocommit=False, autoflush=False, bind=engine_leitura)
+
+# Leituras assíncronas
+engine_leitura_assincrono = criar_engine_assincrono(
+    DATABASE_READ_URL or SQLALCHEMY_DATABASE_URL, somente_leitura=True
+)
+SessionLeituraAssincrona = async_sessionmaker(
+    engine_leitura_assincrono, autoflush=False, expire_on_commit=False
+)
 
 # Base para modelos
 Base = declarative_base()
@@ -32,6 +136,22 @@ def get_db():
     finally:
         db.close()
 
+def get_db_leitura():
+    """Dependency para obter sessão somente leitura (endpoints GET)"""
+    db = SessionLeitura()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_db_leitura_assincrona():
+    """Dependency para obter sessão assíncrona somente leitura (endpoints async)"""
+    async with SessionLeituraAssincrona() as db:
+        yield db
+
 def create_tables():
-    """Criar todas as tabelas"""
+    """Criar tabelas novas e aplicar as migrações pendentes a bancos existentes"""
+    from app import models  # noqa: F401 - registra as tabelas em Base.metadata
+    
     Base.metadata.create_all(bind=engine)
+    aplicar_migracoes(engine, Base.metadata)
@@ -0,0 +1,153 @@
+"""
+Exportação da frota e das manutenções em CSV ou NDJSON, em streaming
+
+As linhas são lidas do banco em lotes (yield_per; cursor do lado do
+servidor no PostgreSQL) e serializadas em blocos de bytes à medida que
+chegam, opcionalmente comprimidos com gzip. Nenhuma lista de linhas é
+montada: a memória usada não depende do tamanho da exportação.
+
+Os filtros são os mesmos do mapa (app.filtros). A nota e a faixa de
+ocupação vêm das colunas persistidas, recalculadas em lote a cada gravação
+(services.recalcular_notas). Os arquivos CSV têm as colunas aceitas pela
+importação (app.importacao_csv).
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.filtros import consulta_veiculos
+from app.models import Veiculo, Organizacao, Manutencao
+
+TIPOS_EXPORTACAO = ("veiculos", "manutencoes")
+FORMATOS_EXPORTACAO = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+# Linhas lidas por vez do cursor e tamanho aproximado de cada bloco enviado
+EXPORTACAO_LINHAS_POR_LOTE = 1000
+EXPORTACAO_BYTES_POR_BLOCO = 64 * 1024
+
+COLUNAS_EXPORTACAO = {
+    "veiculos": (
+        Veiculo.id, Veiculo.prefixo, Veiculo.placa, Veiculo.categoria, Veiculo.organizacao_id,
+        Organizacao.nome.label("organizacao"), Veiculo.municipio, Veiculo.bairro, Veiculo.area_atuacao,
+        Veiculo.ativo, Veiculo.odometro_km, Veiculo.horas_mes, Veiculo.manutencoes_6m, Veiculo.valor_fipe,
+        Veiculo.latitude, Veiculo.longitude, Veiculo.nota_ocupacao, Veiculo.faixa_ocupacao
+    ),
+    "manutencoes": (
+        Manutencao.id, Manutencao.veiculo_id, Veiculo.prefixo, Veiculo.placa, Manutencao.data,
+        Manutencao.tipo, Manutencao.custo, Manutencao.descricao
+    ),
+}
+
+def _linhas(
+    db: Session,
+    tipo: str,
+    filtros: Dict[str, Any],
+    inicio: Optional[date] = None,
+    fim: Optional[date] = None
+) -> Tuple[Tuple[str, ...], Iterable]:
+    """Nomes das colunas e linhas filtradas, lidas em lotes do cursor"""
+    colunas = COLUNAS_EXPORTACAO[tipo]
+    consulta, parametros = consulta_veiculos(db, filtros, *colunas)
+    
+    if tipo == "manutencoes":
+        consulta = consulta.join(Manutencao, Manutencao.veiculo_id == Veiculo.id)
+        if inicio is not None:
+            consulta = consulta.where(Manutencao.data >= inicio)
+        if fim is not None:
+            consulta = consulta.where(Manutencao.data < fim + timedelta(days=1))
+        consulta = consulta.order_by(Veiculo.id, Manutencao.data, Manutencao.id)
+    else:
+        consulta = consulta.order_by(Veiculo.id)
+    
+    linhas = db.execute(consulta.execution_options(yield_per=EXPORTACAO_LINHAS_POR_LOTE), parametros)
+    return tuple(coluna.key for coluna in colunas), linhas
+
+def _valor(valor: Any) -> Any:
+    """Valor serializável: datas em ISO 8601"""
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    return valor
+
+def _texto_csv(valor: Any) -> Any:
+    """Valor de célula CSV: vazio para nulo e booleanos como true/false (como no NDJSON)"""
+    if valor is None:
+        return ""
+    if isinstance(valor, bool):
+        return "true" if valor else "false"
+    return _valor(valor)
+
+def _blocos_csv(nomes: Tuple[str, ...], linhas: Iterable) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, lineterminator="\n")
+    # BOM: o Excel reconhece o arquivo como UTF-8 (a importação o ignora)
+    buffer.write("\ufeff")
+    escritor.writerow(nomes)
+    for linha in linhas:
+        escritor.writerow([_texto_csv(valor) for valor in linha])
+        if buffer.tell() >= EXPORTACAO_BYTES_POR_BLOCO:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+def _blocos_ndjson(nomes: Tuple[str, ...], linhas: Iterable) -> Iterator[bytes]:
+    bloco = []
+    tamanho = 0
+    for linha in linhas:
+        trecho = json.dumps(
+            dict(zip(nomes, map(_valor, linha))), ensure_ascii=False, separators=(",", ":")
+        ) + "\n"
+        bloco.append(trecho)
+        tamanho += len(trecho)
+        if tamanho >= EXPORTACAO_BYTES_POR_BLOCO:
+            yield "".join(bloco).encode("utf-8")
+            bloco = []
+            tamanho = 0
+    yield "".join(bloco).encode("utf-8")
+
+def comprimir_gzip(blocos: Iterable[bytes]) -> Iterator[bytes]:
+    """Comprime um fluxo de blocos em gzip à medida que eles são produzidos"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for bloco in blocos:
+        comprimido = compressor.compress(bloco)
+        if comprimido:
+            yield comprimido
+    yield compressor.flush()
+
+def stream_exportacao(
+    db: Session,
+    tipo: str,
+    formato: str = "csv",
+    filtros: Optional[Dict[str, Any]] = None,
+    inicio: Optional[date] = None,
+    fim: Optional[date] = None,
+    gzip: bool = False
+) -> Iterator[bytes]:
+    """
+    Exporta veículos ou manutenções dos veículos filtrados, em blocos
+    
+    Args:
+        db: Sessão do banco (mantida aberta enquanto o fluxo é consumido)
+        tipo: veiculos ou manutencoes
+        formato: csv ou ndjson
+        filtros: Filtros do mapa (ver app.filtros.CAMPOS_FILTRO)
+        inicio: Apenas manutenções a partir desta data
+        fim: Apenas manutenções até esta data, inclusive
+        gzip: Comprimir o fluxo
+    
+    Raises:
+        ValueError: tipo ou formato desconhecido
+    """
+    if tipo not in TIPOS_EXPORTACAO:
+        raise ValueError(f"Tipo inválido: {tipo} (use {', '.join(TIPOS_EXPORTACAO)})")
+    if formato not in FORMATOS_EXPORTACAO:
+        raise ValueError(f"Formato inválido: {formato} (use {', '.join(FORMATOS_EXPORTACAO)})")
+    
+    nomes, linhas = _linhas(db, tipo, filtros or {}, inicio, fim)
+    blocos = _blocos_csv(nomes, linhas) if formato == "csv" else _blocos_ndjson(nomes, linhas)
+    return comprimir_gzip(blocos) if gzip else blocos
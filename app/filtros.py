@@ -0,0 +1,217 @@
+"""
+Motor de filtros de veículos compartilhado pela listagem e pelo mapa
+"""
+import re
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import select, bindparam, or_, exists
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from app.models import Veiculo, Organizacao, GeoBatalhoes
+from app.organizacoes import IndiceOrganizacoes, obter_indice
+from app.geo import intervalos_bbox
+
+# Filtros aceitos pelos endpoints de veículos e viaturas
+CAMPOS_FILTRO = (
+    "comando", "unidade", "batalhao", "viatura", "municipio", "bairro", "ativo", "faixa", "bbox", "fora_area",
+    "desde"
+)
+
+# Filtros por nome de organização: (tipo, inclui descendentes)
+FILTROS_ORGANIZACAO = {
+    "comando": ("Comando", True),
+    "unidade": ("Unidade", True),
+    "batalhao": ("Batalhao", False)
+}
+
+_MINUSCULAS_ASCII = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+@lru_cache(maxsize=256)
+def _padrao_ilike(termo: str) -> "re.Pattern":
+    """Converte '%termo%' em regex com a mesma semântica do ilike no SQLite"""
+    partes = []
+    for caractere in termo.translate(_MINUSCULAS_ASCII):
+        if caractere == "%":
+            partes.append(".*")
+        elif caractere == "_":
+            partes.append(".")
+        else:
+            partes.append(re.escape(caractere))
+    return re.compile(".*" + "".join(partes) + ".*", re.DOTALL)
+
+def resolver_organizacoes(
+    db: Optional[Session],
+    tipo: str,
+    termo: str,
+    descendentes: bool,
+    indice: Optional[IndiceOrganizacoes] = None
+) -> Optional[Tuple[int, ...]]:
+    """
+    Resolve um filtro por nome de organização usando o índice em memória
+    
+    Args:
+        db: Sessão do banco (usada apenas se o índice precisar ser carregado)
+        tipo: Comando, Unidade ou Batalhao
+        termo: Parte do nome, comparada como ilike '%termo%'
+        descendentes: Incluir as organizações abaixo das encontradas
+        indice: Índice já carregado (leituras assíncronas, sem sessão síncrona)
+        
+    Returns:
+        Tuple[int, ...]: ids ordenados, ou None se nenhuma organização casar
+    """
+    if indice is None:
+        indice = obter_indice(db)
+    chave = (tipo, termo, descendentes)
+    
+    ids = indice.resolucoes.get(chave)
+    if ids is None:
+        padrao = _padrao_ilike(termo)
+        encontrados = [
+            org_id for org_id, (nome, tipo_org, _) in indice.por_id.items()
+            if tipo_org == tipo and padrao.fullmatch(nome.translate(_MINUSCULAS_ASCII))
+        ]
+        if descendentes:
+            encontrados = indice.descendentes_de(encontrados)
+        if len(indice.resolucoes) >= 1024:
+            indice.resolucoes.clear()
+        ids = indice.resolucoes[chave] = tuple(sorted(encontrados))
+    
+    return ids or None
+
+def preparar_filtros(
+    db: Optional[Session],
+    filtros: Dict[str, Any],
+    indice: Optional[IndiceOrganizacoes] = None
+) -> Tuple[Tuple[str, ...], Dict[str, Any]]:
+    """
+    Traduz os filtros recebidos em (filtros ativos, parâmetros da consulta)
+    
+    Filtros de organização sem nenhuma correspondência são ignorados,
+    como sempre foi o comportamento da API.
+    """
+    ativos = []
+    parametros = {}
+    
+    for campo in CAMPOS_FILTRO:
+        valor = filtros.get(campo)
+        if valor is None or valor == "":
+            continue
+        
+        if campo in FILTROS_ORGANIZACAO:
+            tipo, descendentes = FILTROS_ORGANIZACAO[campo]
+            valor = resolver_organizacoes(db, tipo, valor, descendentes, indice)
+            if valor is None:
+                continue
+        elif campo in ("viatura", "municipio", "bairro"):
+            valor = f"%{valor}%"
+        elif campo == "bbox":
+            # valor já validado: (min_lon, min_lat, max_lon, max_lat)
+            intervalos = intervalos_bbox(*valor)
+            for i, (inicio, fim) in enumerate(intervalos):
+                parametros[f"bbox_inicio_{i}"] = inicio
+                parametros[f"bbox_fim_{i}"] = fim
+            parametros.update(zip(("bbox_min_lon", "bbox_min_lat", "bbox_max_lon", "bbox_max_lat"), valor))
+            ativos.append(f"bbox/{len(intervalos)}")
+            continue
+        elif campo == "fora_area":
+            # A consulta usa geo_batalhao_id, mantido pelas gravações dos polígonos
+            ativos.append("fora_area" if valor else "dentro_area")
+            continue
+        
+        ativos.append(campo)
+        parametros[campo] = valor
+    
+    return tuple(ativos), parametros
+
+def _criterio(campo: str):
+    """Cláusula WHERE parametrizada de cada filtro"""
+    if campo in FILTROS_ORGANIZACAO:
+        return Veiculo.organizacao_id.in_(bindparam(campo, expanding=True))
+    if campo == "viatura":
+        return Veiculo.prefixo.ilike(bindparam(campo)) | Veiculo.placa.ilike(bindparam(campo))
+    if campo == "municipio":
+        return Veiculo.municipio.ilike(bindparam(campo))
+    if campo == "bairro":
+        return Veiculo.bairro.ilike(bindparam(campo))
+    if campo == "ativo":
+        return Veiculo.ativo == bindparam(campo)
+    if campo == "faixa":
+        return Veiculo.faixa_ocupacao == bindparam(campo)
+    if campo == "desde":
+        return Veiculo.versao > bindparam(campo)
+    if campo.startswith("bbox/"):
+        # Intervalos de células pelo índice de geo_celula, refinados pela posição exata
+        celulas = or_(*(
+            Veiculo.geo_celula.between(bindparam(f"bbox_inicio_{i}"), bindparam(f"bbox_fim_{i}"))
+            for i in range(int(campo.split("/")[1]))
+        ))
+        return (
+            celulas
+            & Veiculo.longitude.between(bindparam("bbox_min_lon"), bindparam("bbox_max_lon"))
+            & Veiculo.latitude.between(bindparam("bbox_min_lat"), bindparam("bbox_max_lat"))
+        )
+    if campo in ("fora_area", "dentro_area"):
+        return _criterio_area(fora=campo == "fora_area")
+    raise ValueError(f"Filtro desconhecido: {campo}")
+
+def _criterio_area(fora: bool):
+    """
+    Veículos fora (ou dentro) da área do próprio batalhão
+    
+    Considera apenas veículos com posição cujo batalhão tem área cadastrada
+    (GeoBatalhoes.batalhao_nome igual ao nome da organização).
+    """
+    area = aliased(GeoBatalhoes)
+    tem_area = exists().where(GeoBatalhoes.batalhao_nome == Organizacao.nome)
+    na_propria_area = exists().where(
+        area.id == Veiculo.geo_batalhao_id,
+        area.batalhao_nome == Organizacao.nome
+    )
+    return (
+        Veiculo.latitude.isnot(None) & Veiculo.longitude.isnot(None) & tem_area
+        & (~na_propria_area if fora else na_propria_area)
+    )
+
+# Consultas montadas, por (projeção, filtros ativos)
+_consultas: Dict[Tuple, Select] = {}
+_lock = threading.Lock()
+
+def consulta_veiculos(
+    db: Optional[Session],
+    filtros: Dict[str, Any],
+    *colunas,
+    indice: Optional[IndiceOrganizacoes] = None
+) -> Tuple[Select, Dict[str, Any]]:
+    """
+    Monta (ou reaproveita) a consulta de veículos filtrada
+    
+    A mesma combinação de projeção e filtros ativos devolve sempre o mesmo
+    objeto Select, com os valores em parâmetros, de modo que o SQLAlchemy
+    reaproveita também a compilação do SQL.
+    
+    Args:
+        db: Sessão do banco (None se o índice de organizações for informado)
+        filtros: Valores dos filtros (ver CAMPOS_FILTRO); None é ignorado
+        *colunas: Entidades/colunas selecionadas; padrão é Veiculo
+        indice: Índice de organizações já carregado
+        
+    Returns:
+        Tuple[Select, Dict[str, Any]]: consulta e parâmetros para db.execute
+    """
+    colunas = colunas or (Veiculo,)
+    ativos, parametros = preparar_filtros(db, filtros, indice)
+    chave = (tuple((str(c), getattr(c, "name", None)) for c in colunas), ativos)
+    
+    consulta = _consultas.get(chave)
+    if consulta is None:
+        consulta = select(*colunas).select_from(Veiculo).join(Organizacao)
+        for campo in ativos:
+            consulta = consulta.where(_criterio(campo))
+        with _lock:
+            consulta = _consultas.setdefault(chave, consulta)
+    
+    return consulta, parametros
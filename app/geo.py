@@ -0,0 +1,402 @@
+"""
+Índices espaciais dos veículos
+
+Grade hierárquica (quadtree com código de Morton): cada veículo guarda em
+geo_celula o código da célula da grade que contém sua posição, no nível
+mais fino (NIVEL_GRADE). As células de um nível qualquer correspondem a
+intervalos contíguos de códigos do nível mais fino, de modo que uma área
+retangular pode ser consultada com poucos BETWEEN sobre o índice de
+geo_celula.
+
+Áreas dos batalhões: cada veículo guarda em geo_batalhao_id o polígono de
+GeoBatalhoes que contém sua posição, localizado por uma árvore de caixas
+em memória seguida do teste exato de ponto no polígono. Quando os polígonos
+mudam, a própria transação que os grava recalcula os veículos dentro das
+caixas envolventes alteradas (versões anterior e nova de cada polígono).
+"""
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, event, inspect, or_, select, update, bindparam
+from sqlalchemy.orm import Session
+
+from app.cache import ao_escrever
+from app.models import Veiculo, GeoBatalhoes
+from app.sincronizacao import versao_sessao
+
+# Nível mais fino da grade: 2^16 colunas de longitude e 2^16 linhas de latitude
+NIVEL_GRADE = 16
+
+# Máximo de células usadas para cobrir uma bbox antes de subir de nível
+MAX_CELULAS_BBOX = 64
+
+# Pseudo-tabela anotada pelas gravações de posição em lote (app.posicoes);
+# invalida apenas o que depende da posição dos veículos
+TABELA_POSICOES = "veiculo_posicao"
+
+def _espalhar_bits(valor: int) -> int:
+    """Intercala zeros entre os 16 bits de valor (x -> x0x0x0...)"""
+    valor &= 0xFFFF
+    valor = (valor | (valor << 8)) & 0x00FF00FF
+    valor = (valor | (valor << 4)) & 0x0F0F0F0F
+    valor = (valor | (valor << 2)) & 0x33333333
+    valor = (valor | (valor << 1)) & 0x55555555
+    return valor
+
+def _coluna_linha(lat: float, lon: float, nivel: int) -> Tuple[int, int]:
+    """Coluna (x) e linha (y) da célula de um ponto no nível informado"""
+    lado = 1 << nivel
+    x = int((lon + 180.0) / 360.0 * lado)
+    y = int((lat + 90.0) / 180.0 * lado)
+    return min(max(x, 0), lado - 1), min(max(y, 0), lado - 1)
+
+def codigo_morton(x: int, y: int) -> int:
+    """Código de Morton (Z-order) da célula (x, y)"""
+    return _espalhar_bits(x) | (_espalhar_bits(y) << 1)
+
+def celula_grade(lat: Optional[float], lon: Optional[float]) -> Optional[int]:
+    """Código da célula de nível NIVEL_GRADE que contém o ponto, ou None sem posição"""
+    if lat is None or lon is None:
+        return None
+    return codigo_morton(*_coluna_linha(lat, lon, NIVEL_GRADE))
+
+def intervalos_bbox(
+    min_lon: float, min_lat: float, max_lon: float, max_lat: float
+) -> List[Tuple[int, int]]:
+    """
+    Cobre uma bbox com intervalos de códigos de célula do nível mais fino
+    
+    Escolhe o nível mais fino em que a bbox ocupa no máximo MAX_CELULAS_BBOX
+    células, converte cada célula no intervalo de códigos correspondente e
+    junta os intervalos contíguos.
+    
+    Returns:
+        List[Tuple[int, int]]: intervalos (inicio, fim) inclusivos e ordenados
+    """
+    nivel = NIVEL_GRADE
+    while True:
+        x0, y0 = _coluna_linha(min_lat, min_lon, nivel)
+        x1, y1 = _coluna_linha(max_lat, max_lon, nivel)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= MAX_CELULAS_BBOX or nivel == 0:
+            break
+        nivel -= 1
+    
+    deslocamento = 2 * (NIVEL_GRADE - nivel)
+    codigos = sorted(
+        codigo_morton(x, y)
+        for x in range(x0, x1 + 1)
+        for y in range(y0, y1 + 1)
+    )
+    
+    intervalos: List[Tuple[int, int]] = []
+    for codigo in codigos:
+        inicio = codigo << deslocamento
+        fim = ((codigo + 1) << deslocamento) - 1
+        if intervalos and intervalos[-1][1] + 1 == inicio:
+            intervalos[-1] = (intervalos[-1][0], fim)
+        else:
+            intervalos.append((inicio, fim))
+    return intervalos
+
+def nivel_agrupamento(zoom: int) -> int:
+    """
+    Nível da grade usado para agrupar pontos num zoom do mapa
+    
+    Um tile de 256px no zoom z cobre 1/2^z da longitude; três níveis
+    abaixo, cada célula ocupa cerca de 32px na tela.
+    """
+    return max(0, min(NIVEL_GRADE, zoom + 3))
+
+def parse_bbox(bbox: str) -> Tuple[float, float, float, float]:
+    """
+    Interpreta 'minLon,minLat,maxLon,maxLat'
+    
+    Raises:
+        ValueError: formato ou limites inválidos
+    """
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise ValueError("bbox deve ser minLon,minLat,maxLon,maxLat")
+    
+    if not (-180 <= min_lon <= max_lon <= 180 and -90 <= min_lat <= max_lat <= 90):
+        raise ValueError("bbox fora dos limites ou com mínimo maior que máximo")
+    return min_lon, min_lat, max_lon, max_lat
+
+# ====== ÁREAS DOS BATALHÕES ======
+
+Caixa = Tuple[float, float, float, float]
+
+# Áreas por folha da árvore de caixas
+AREAS_POR_FOLHA = 8
+
+def _poligonos_geometria(geometria: Dict) -> List[List[List[Tuple[float, float]]]]:
+    """Polígonos (anéis de pontos lon/lat) de um Polygon ou MultiPolygon"""
+    if geometria.get("type") == "Polygon":
+        poligonos = [geometria["coordinates"]]
+    elif geometria.get("type") == "MultiPolygon":
+        poligonos = geometria["coordinates"]
+    else:
+        return []
+    return [[[(p[0], p[1]) for p in anel] for anel in poligono] for poligono in poligonos]
+
+def _contem(poligono: List[List[Tuple[float, float]]], lon: float, lat: float) -> bool:
+    """Ponto no polígono (par-ímpar sobre todos os anéis, o que desconta os buracos)"""
+    dentro = False
+    for anel in poligono:
+        xj, yj = anel[-1]
+        for xi, yi in anel:
+            if (yi > lat) != (yj > lat) and lon < (xj - xi) * (lat - yi) / (yj - yi) + xi:
+                dentro = not dentro
+            xj, yj = xi, yi
+    return dentro
+
+def _area(poligono: List[List[Tuple[float, float]]]) -> float:
+    """Área plana do polígono (anel externo menos buracos), usada para desempate"""
+    def area_anel(anel):
+        return abs(sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(anel, anel[1:] + anel[:1]))) / 2
+    return area_anel(poligono[0]) - sum(area_anel(anel) for anel in poligono[1:])
+
+def caixa_geojson(geojson: Optional[Dict]) -> Optional[Caixa]:
+    """Caixa envolvente (min_lon, min_lat, max_lon, max_lat) de uma feature de área, ou None"""
+    pontos = [
+        ponto
+        for poligono in _poligonos_geometria((geojson or {}).get("geometry") or {})
+        for ponto in poligono[0]
+    ]
+    if not pontos:
+        return None
+    xs = [p[0] for p in pontos]
+    ys = [p[1] for p in pontos]
+    return min(xs), min(ys), max(xs), max(ys)
+
+def _uniao(caixas: Iterable[Caixa]) -> Caixa:
+    caixas = list(caixas)
+    return (
+        min(c[0] for c in caixas), min(c[1] for c in caixas),
+        max(c[2] for c in caixas), max(c[3] for c in caixas)
+    )
+
+class IndiceAreas:
+    """Polígonos das áreas dos batalhões numa árvore de caixas envolventes"""
+    
+    def __init__(self, linhas: Iterable[Tuple[int, Dict]]):
+        """
+        Args:
+            linhas: Tuplas (id, geojson) de GeoBatalhoes
+        """
+        # (caixa, área, id, polígono) de cada polígono, com MultiPolygon desmembrado
+        itens = []
+        for area_id, geojson in linhas:
+            for poligono in _poligonos_geometria(geojson.get("geometry") or {}):
+                if poligono and len(poligono[0]) >= 3:
+                    xs = [p[0] for p in poligono[0]]
+                    ys = [p[1] for p in poligono[0]]
+                    itens.append(((min(xs), min(ys), max(xs), max(ys)), _area(poligono), area_id, poligono))
+        
+        self.total = len(itens)
+        self.raiz = self._montar(itens) if itens else None
+    
+    def _montar(self, itens: List) -> Tuple[Caixa, List, List]:
+        """Nó (caixa, filhos, itens): divide pelo eixo mais longo até AREAS_POR_FOLHA itens"""
+        caixa = _uniao(item[0] for item in itens)
+        if len(itens) <= AREAS_POR_FOLHA:
+            return caixa, [], itens
+        
+        eixo = 0 if caixa[2] - caixa[0] >= caixa[3] - caixa[1] else 1
+        itens = sorted(itens, key=lambda item: item[0][eixo] + item[0][eixo + 2])
+        meio = len(itens) // 2
+        return caixa, [self._montar(itens[:meio]), self._montar(itens[meio:])], []
+    
+    def localizar(self, lat: Optional[float], lon: Optional[float]) -> Optional[int]:
+        """
+        Área que contém o ponto, ou None
+        
+        Se houver áreas sobrepostas, vale a de menor área (a mais específica).
+        """
+        if lat is None or lon is None or self.raiz is None:
+            return None
+        
+        melhor = None
+        pilha = [self.raiz]
+        while pilha:
+            caixa, filhos, itens = pilha.pop()
+            if not (caixa[0] <= lon <= caixa[2] and caixa[1] <= lat <= caixa[3]):
+                continue
+            pilha.extend(filhos)
+            for (x0, y0, x1, y1), area, area_id, poligono in itens:
+                if (
+                    x0 <= lon <= x1 and y0 <= lat <= y1
+                    and (melhor is None or (area, area_id) < melhor[:2])
+                    and _contem(poligono, lon, lat)
+                ):
+                    melhor = (area, area_id)
+        return melhor[1] if melhor else None
+
+_indice_areas: Optional[IndiceAreas] = None
+_areas_pendentes = True
+_lock_areas = threading.Lock()
+
+def obter_indice_areas(db: Session) -> IndiceAreas:
+    """Retorna o índice de áreas, carregando-o com uma única consulta se necessário"""
+    global _indice_areas
+    indice = _indice_areas
+    if indice is None:
+        with _lock_areas:
+            if _indice_areas is None:
+                with db.no_autoflush:
+                    linhas = db.execute(select(GeoBatalhoes.id, GeoBatalhoes.geojson)).all()
+                _indice_areas = IndiceAreas(linhas)
+            indice = _indice_areas
+    return indice
+
+@ao_escrever
+def _invalidar_areas(tabelas):
+    """Descarta o índice quando as áreas mudam"""
+    global _indice_areas
+    if "geo_batalhoes" in tabelas:
+        with _lock_areas:
+            _indice_areas = None
+
+def _na_caixa(caixa: Caixa):
+    """Critério dos veículos dentro da caixa (células da grade e posição exata)"""
+    min_lon, min_lat, max_lon, max_lat = caixa
+    return and_(
+        or_(*(Veiculo.geo_celula.between(inicio, fim) for inicio, fim in intervalos_bbox(*caixa))),
+        Veiculo.longitude.between(min_lon, max_lon),
+        Veiculo.latitude.between(min_lat, max_lat)
+    )
+
+def atualizar_areas(db: Session, caixas: Optional[Iterable[Optional[Caixa]]] = None, lote: int = 1000) -> int:
+    """
+    Recalcula a área dos veículos dentro das caixas informadas, sem commit
+    
+    Um veículo só muda de área se está dentro de um polígono alterado, antes
+    ou depois da alteração, por isso bastam as caixas das duas versões. Os
+    polígonos são lidos na transação da sessão (incluindo os ainda não
+    confirmados) e só os veículos cuja área mudou são gravados, em lotes.
+    
+    Args:
+        db: Sessão de escrita
+        caixas: Caixas (min_lon, min_lat, max_lon, max_lat); None recalcula a frota inteira
+        
+    Returns:
+        int: Quantidade de veículos atualizados
+    """
+    consulta = select(Veiculo.id, Veiculo.latitude, Veiculo.longitude, Veiculo.geo_batalhao_id)
+    if caixas is None:
+        consultas = [consulta]
+    else:
+        consultas = [consulta.where(_na_caixa(caixa)) for caixa in set(caixas) if caixa]
+    if not consultas:
+        return 0
+    
+    with db.no_autoflush:
+        indice = IndiceAreas(db.execute(select(GeoBatalhoes.id, GeoBatalhoes.geojson)).all())
+        alterados = {}
+        for consulta in consultas:
+            for veiculo_id, latitude, longitude, atual in db.execute(consulta):
+                area_id = indice.localizar(latitude, longitude)
+                if area_id != atual:
+                    alterados[veiculo_id] = area_id
+        if not alterados:
+            return 0
+        
+        versao = versao_sessao(db)
+        linhas = [
+            {"id": veiculo_id, "geo_batalhao_id": area_id, "versao": versao}
+            for veiculo_id, area_id in alterados.items()
+        ]
+        for i in range(0, len(linhas), lote):
+            db.execute(update(Veiculo), linhas[i:i + lote])
+    return len(linhas)
+
+def sincronizar_areas(db: Session) -> int:
+    """
+    Recalcula a área de toda a frota uma vez por processo (chamada na inicialização)
+    
+    Cobre polígonos gravados por fora da aplicação; as gravações da aplicação
+    recalculam as áreas na própria transação.
+    
+    Returns:
+        int: Quantidade de veículos atualizados
+    """
+    global _areas_pendentes
+    if not _areas_pendentes:
+        return 0
+    
+    atualizados = atualizar_areas(db)
+    db.commit()
+    # Só depois do commit: uma falha acima mantém o recálculo pendente
+    with _lock_areas:
+        _areas_pendentes = False
+    return atualizados
+
+# ====== MANUTENÇÃO DAS COLUNAS geo_celula E geo_batalhao_id ======
+
+@event.listens_for(Session, "before_flush")
+def _atualizar_celulas_alteradas(session, flush_context, instances):
+    """Recalcula célula e área dos veículos novos ou com posição alterada"""
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Veiculo):
+            continue
+        estado = inspect(obj)
+        if (
+            obj in session.new
+            or estado.attrs.latitude.history.has_changes()
+            or estado.attrs.longitude.history.has_changes()
+        ):
+            obj.geo_celula = celula_grade(obj.latitude, obj.longitude)
+            obj.geo_batalhao_id = obter_indice_areas(session).localizar(obj.latitude, obj.longitude)
+
+def _caixas_pendentes(session: Session) -> List[Optional[Caixa]]:
+    return session.info.setdefault("areas_alteradas", [])
+
+@event.listens_for(Session, "after_flush")
+def _registrar_areas(session, flush_context):
+    """Anota as caixas (anterior e nova) dos polígonos de área gravados, alterados ou removidos"""
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, GeoBatalhoes):
+            caixas = _caixas_pendentes(session)
+            caixas.append(caixa_geojson(obj.geojson))
+            caixas.extend(caixa_geojson(g) for g in inspect(obj).attrs.geojson.history.deleted or ())
+
+@event.listens_for(Session, "after_flush_postexec")
+def _atualizar_areas_pendentes(session, flush_context):
+    """Recalcula a área dos veículos dentro das caixas anotadas"""
+    caixas = session.info.pop("areas_alteradas", None)
+    if caixas:
+        atualizar_areas(session, caixas)
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_areas_pendentes(session):
+    session.info.pop("areas_alteradas", None)
+
+def sincronizar_celulas(db: Session, lote: int = 1000) -> int:
+    """
+    Preenche geo_celula dos veículos com posição e sem célula calculada
+    
+    Returns:
+        int: Quantidade de veículos atualizados
+    """
+    pendentes = db.execute(
+        select(Veiculo.id, Veiculo.latitude, Veiculo.longitude).where(
+            Veiculo.geo_celula.is_(None),
+            Veiculo.latitude.isnot(None),
+            Veiculo.longitude.isnot(None)
+        )
+    ).all()
+    
+    atualizacao = (
+        update(Veiculo.__table__)
+        .where(Veiculo.__table__.c.id == bindparam("vid"))
+        .values(geo_celula=bindparam("celula"))
+    )
+    for i in range(0, len(pendentes), lote):
+        db.execute(atualizacao, [
+            {"vid": v.id, "celula": celula_grade(v.latitude, v.longitude)}
+            for v in pendentes[i:i + lote]
+        ])
+    
+    db.commit()
+    return len(pendentes)
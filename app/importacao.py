@@ -0,0 +1,358 @@
+"""
+Importação de arquivos GeoJSON (batalhões, bases e viaturas)
+
+O arquivo é lido em blocos e as features são decodificadas uma a uma,
+sem carregar a FeatureCollection inteira em memória. As features válidas
+são gravadas em lotes (executemany), com um commit por lote; as inválidas
+são rejeitadas individualmente e relatadas com o seu índice no arquivo.
+"""
+import codecs
+import json
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select, insert, update, delete, tuple_
+from sqlalchemy.orm import Session
+
+from app.geo import atualizar_areas, caixa_geojson, celula_grade, obter_indice_areas
+from app.models import Veiculo, GeoBatalhoes, GeoBases, GeoViaturas
+from app.sincronizacao import versao_sessao
+
+TIPOS_IMPORTACAO = ("batalhoes", "bases", "viaturas")
+
+# Features gravadas por transação
+IMPORTACAO_LOTE = 500
+
+# Erros individuais devolvidos na resposta (os demais são apenas contados)
+MAX_ERROS_RELATADOS = 100
+
+TAMANHO_BLOCO = 64 * 1024
+
+# ====== LEITURA INCREMENTAL ======
+
+class _Fluxo:
+    """Texto JSON lido sob demanda de um arquivo binário UTF-8"""
+    
+    def __init__(self, arquivo: BinaryIO, tamanho_bloco: int):
+        self.arquivo = arquivo
+        self.tamanho_bloco = tamanho_bloco
+        self.decodificador = codecs.getincrementaldecoder("utf-8-sig")()
+        self.decodificador_json = json.JSONDecoder()
+        self.texto = ""
+        self.pos = 0
+        self.fim = False
+    
+    def _ler(self, tamanho: int):
+        """Acrescenta ao texto mais um bloco do arquivo, descartando o já consumido"""
+        if self.pos:
+            self.texto = self.texto[self.pos:]
+            self.pos = 0
+        dados = self.arquivo.read(tamanho)
+        if dados:
+            self.texto += self.decodificador.decode(dados)
+        else:
+            self.texto += self.decodificador.decode(b"", final=True)
+            self.fim = True
+    
+    def proximo(self) -> str:
+        """Próximo caractere significativo (sem consumi-lo); '' no fim do arquivo"""
+        while True:
+            while self.pos < len(self.texto) and self.texto[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.texto) or self.fim:
+                return self.texto[self.pos:self.pos + 1]
+            self._ler(self.tamanho_bloco)
+    
+    def consumir(self, esperados: str) -> str:
+        """Consome um dos caracteres esperados"""
+        caractere = self.proximo()
+        if not caractere or caractere not in esperados:
+            raise ValueError(f"JSON inválido: esperado um de {esperados!r}, encontrado {caractere or 'fim do arquivo'!r}")
+        self.pos += 1
+        return caractere
+    
+    def valor(self) -> Any:
+        """Decodifica o próximo valor JSON completo, lendo mais blocos se preciso"""
+        self.proximo()
+        tamanho = self.tamanho_bloco
+        while True:
+            try:
+                valor, fim = self.decodificador_json.raw_decode(self.texto, self.pos)
+                # Um número no fim do texto pode continuar no próximo bloco
+                if fim < len(self.texto) or self.fim:
+                    self.pos = fim
+                    return valor
+            except json.JSONDecodeError as e:
+                if self.fim:
+                    raise ValueError(f"JSON inválido: {e.msg}")
+            # Valor incompleto: ler blocos cada vez maiores até completá-lo
+            self._ler(tamanho)
+            tamanho *= 2
+
+def ler_features(arquivo: BinaryIO, tamanho_bloco: int = TAMANHO_BLOCO) -> Iterator[Any]:
+    """
+    Percorre as features de uma FeatureCollection sem carregar o arquivo inteiro
+    
+    Os demais membros do objeto raiz (type, crs, name...) são lidos
+    normalmente; apenas o vetor "features" é percorrido elemento a elemento.
+    
+    Raises:
+        ValueError: JSON malformado ou raiz que não é FeatureCollection
+    """
+    fluxo = _Fluxo(arquivo, tamanho_bloco)
+    tipo = None
+    tem_features = False
+    
+    fluxo.consumir("{")
+    if fluxo.proximo() == "}":
+        fluxo.consumir("}")
+    else:
+        while True:
+            chave = fluxo.valor()
+            if not isinstance(chave, str):
+                raise ValueError("JSON inválido: chave do objeto raiz deve ser texto")
+            fluxo.consumir(":")
+            
+            if chave == "features":
+                if tipo is not None and tipo != "FeatureCollection":
+                    break
+                tem_features = True
+                fluxo.consumir("[")
+                if fluxo.proximo() == "]":
+                    fluxo.consumir("]")
+                else:
+                    while True:
+                        yield fluxo.valor()
+                        if fluxo.consumir(",]") == "]":
+                            break
+            else:
+                valor = fluxo.valor()
+                if chave == "type":
+                    tipo = valor
+            
+            if fluxo.consumir(",}") == "}":
+                break
+    
+    if tipo != "FeatureCollection" or not tem_features:
+        raise ValueError("GeoJSON deve ser FeatureCollection")
+
+# ====== VALIDAÇÃO ======
+
+# Tipos numéricos aceitos em coordenadas (bool fica de fora)
+_NUMEROS = {int, float}
+
+def _validar_posicao(posicao: Any):
+    if type(posicao) is not list or len(posicao) < 2 or not {type(posicao[0]), type(posicao[1])} <= _NUMEROS:
+        raise ValueError("posição deve ser [longitude, latitude]")
+    lon, lat = posicao[0], posicao[1]
+    if not (-180 <= lon <= 180 and -90 <= lat <= 90):
+        raise ValueError(f"coordenada fora dos limites: [{lon}, {lat}]")
+
+def _validar_poligono(aneis: Any):
+    if not isinstance(aneis, list) or not aneis:
+        raise ValueError("polígono deve ter ao menos um anel")
+    for anel in aneis:
+        if not isinstance(anel, list) or len(anel) < 4:
+            raise ValueError("anel de polígono deve ter ao menos 4 posições")
+        
+        # Verificação do anel inteiro de uma vez; posição a posição só para achar o erro
+        try:
+            lons = [p[0] for p in anel if type(p) is list]
+            lats = [p[1] for p in anel if type(p) is list]
+            valido = (
+                len(lons) == len(anel) and set(map(type, lons)) | set(map(type, lats)) <= _NUMEROS
+                and -180 <= min(lons) and max(lons) <= 180 and -90 <= min(lats) and max(lats) <= 90
+            )
+        except (IndexError, TypeError):
+            valido = False
+        if not valido:
+            for posicao in anel:
+                _validar_posicao(posicao)
+        
+        if anel[0][:2] != anel[-1][:2]:
+            raise ValueError("anel de polígono deve ser fechado")
+
+def validar_geometria(geometria: Any, tipos: Tuple[str, ...]):
+    """
+    Valida uma geometria GeoJSON dos tipos aceitos
+    
+    Raises:
+        ValueError: geometria ausente, de outro tipo ou malformada
+    """
+    if not isinstance(geometria, dict):
+        raise ValueError("feature sem geometria")
+    tipo = geometria.get("type")
+    if tipo not in tipos:
+        raise ValueError(f"geometria {tipo} não aceita (esperado {', '.join(tipos)})")
+    
+    coordenadas = geometria.get("coordinates")
+    if tipo == "Point":
+        _validar_posicao(coordenadas)
+    elif tipo == "Polygon":
+        _validar_poligono(coordenadas)
+    elif tipo == "MultiPolygon":
+        if not isinstance(coordenadas, list) or not coordenadas:
+            raise ValueError("MultiPolygon deve ter ao menos um polígono")
+        for poligono in coordenadas:
+            _validar_poligono(poligono)
+
+def _texto(propriedades: Dict, tamanho: int, *chaves: str) -> str:
+    """Primeira propriedade de texto não vazia entre as chaves"""
+    for chave in chaves:
+        valor = propriedades.get(chave)
+        if isinstance(valor, str) and valor.strip():
+            if len(valor) > tamanho:
+                raise ValueError(f"{chave} excede {tamanho} caracteres")
+            return valor.strip()
+    raise ValueError(f"propriedade obrigatória ausente: {chaves[0]}")
+
+class _ReferenciasVeiculos:
+    """Localiza veículos por id, prefixo ou placa, carregando-os uma única vez"""
+    
+    def __init__(self, db: Session):
+        self.ids = set()
+        self.por_codigo: Dict[str, int] = {}
+        for veiculo_id, prefixo, placa in db.execute(select(Veiculo.id, Veiculo.prefixo, Veiculo.placa)):
+            self.ids.add(veiculo_id)
+            self.por_codigo[prefixo.upper()] = veiculo_id
+            self.por_codigo[placa.upper()] = veiculo_id
+    
+    def localizar(self, propriedades: Dict) -> int:
+        veiculo_id = propriedades.get("veiculo_id")
+        if veiculo_id is not None:
+            if veiculo_id not in self.ids:
+                raise ValueError(f"veículo {veiculo_id} não encontrado")
+            return veiculo_id
+        for chave in ("prefixo", "placa"):
+            codigo = propriedades.get(chave)
+            if isinstance(codigo, str) and codigo.upper() in self.por_codigo:
+                return self.por_codigo[codigo.upper()]
+        raise ValueError("viatura sem veiculo_id, prefixo ou placa de um veículo cadastrado")
+
+def _preparar(tipo: str, feature: Any, veiculos: Optional[_ReferenciasVeiculos]) -> Dict:
+    """Valida uma feature e devolve a linha a gravar"""
+    if not isinstance(feature, dict) or feature.get("type") != "Feature":
+        raise ValueError("elemento não é uma Feature")
+    propriedades = feature.get("properties") or {}
+    if not isinstance(propriedades, dict):
+        raise ValueError("properties deve ser um objeto")
+    
+    geometria = feature.get("geometry")
+    if tipo == "batalhoes":
+        validar_geometria(geometria, ("Polygon", "MultiPolygon"))
+    else:
+        validar_geometria(geometria, ("Point",))
+    geojson = {"type": "Feature", "geometry": geometria, "properties": propriedades}
+    
+    if tipo == "viaturas":
+        return {"veiculo_id": veiculos.localizar(propriedades), "geojson": geojson}
+    return {
+        "municipio": _texto(propriedades, 50, "municipio"),
+        "batalhao_nome": _texto(propriedades, 100, "batalhao_nome", "nome"),
+        "geojson": geojson
+    }
+
+# ====== GRAVAÇÃO ======
+
+def _gravar_lote(db: Session, tipo: str, linhas: List[Dict]):
+    """
+    Grava um lote numa transação, substituindo os registros de mesma chave
+    
+    Batalhões e bases são identificados por (municipio, batalhao_nome);
+    viaturas, pelo veículo, cuja posição (e célula e área) também é atualizada.
+    Batalhões recalculam a área dos veículos dentro das caixas dos polígonos
+    substituídos e dos novos.
+    """
+    if tipo == "viaturas":
+        # A última feature de cada veículo no lote prevalece
+        linhas = list({linha["veiculo_id"]: linha for linha in linhas}.values())
+        versao = versao_sessao(db)
+        db.execute(delete(GeoViaturas).where(
+            GeoViaturas.veiculo_id.in_([linha["veiculo_id"] for linha in linhas])
+        ))
+        db.execute(insert(GeoViaturas), [{**linha, "versao": versao} for linha in linhas])
+        
+        areas = obter_indice_areas(db)
+        posicoes = []
+        for linha in linhas:
+            lon, lat = linha["geojson"]["geometry"]["coordinates"][:2]
+            posicoes.append({
+                "id": linha["veiculo_id"], "latitude": lat, "longitude": lon,
+                "geo_celula": celula_grade(lat, lon),
+                "geo_batalhao_id": areas.localizar(lat, lon),
+                "versao": versao
+            })
+        db.execute(update(Veiculo), posicoes)
+    else:
+        modelo = GeoBatalhoes if tipo == "batalhoes" else GeoBases
+        substituidos = tuple_(modelo.municipio, modelo.batalhao_nome).in_(
+            list({(linha["municipio"], linha["batalhao_nome"]) for linha in linhas})
+        )
+        if tipo == "batalhoes":
+            caixas = [caixa_geojson(linha["geojson"]) for linha in linhas]
+            caixas += [caixa_geojson(g) for g in db.execute(select(modelo.geojson).where(substituidos)).scalars()]
+        db.execute(delete(modelo).where(substituidos))
+        db.execute(insert(modelo), linhas)
+        if tipo == "batalhoes":
+            atualizar_areas(db, caixas)
+    
+    db.commit()
+
+def importar_geojson(
+    db: Session,
+    tipo: str,
+    arquivo: BinaryIO,
+    lote: int = IMPORTACAO_LOTE
+) -> Dict[str, Any]:
+    """
+    Importa uma FeatureCollection de batalhões, bases ou viaturas
+    
+    Args:
+        db: Sessão do banco
+        tipo: batalhoes, bases ou viaturas
+        arquivo: Arquivo binário, lido em blocos
+        lote: Features gravadas por transação
+    
+    Returns:
+        Dict: features lidas, importadas, rejeitadas e erros (índice e motivo)
+    
+    Raises:
+        ValueError: tipo desconhecido ou arquivo que não é uma FeatureCollection
+            válida (os lotes anteriores ao erro permanecem gravados)
+    """
+    if tipo not in TIPOS_IMPORTACAO:
+        raise ValueError(f"Tipo inválido: {tipo} (use {', '.join(TIPOS_IMPORTACAO)})")
+    
+    veiculos = _ReferenciasVeiculos(db) if tipo == "viaturas" else None
+    linhas: List[Dict] = []
+    erros: List[Dict[str, Any]] = []
+    lidas = importadas = rejeitadas = 0
+    
+    try:
+        for indice, feature in enumerate(ler_features(arquivo)):
+            lidas += 1
+            try:
+                linhas.append(_preparar(tipo, feature, veiculos))
+            except ValueError as e:
+                rejeitadas += 1
+                if len(erros) < MAX_ERROS_RELATADOS:
+                    erros.append({"indice": indice, "erro": str(e)})
+                continue
+            
+            if len(linhas) >= lote:
+                _gravar_lote(db, tipo, linhas)
+                importadas += len(linhas)
+                linhas = []
+    except ValueError as e:
+        db.rollback()
+        raise ValueError(f"{e} (feature {lidas}; {importadas} já importadas)")
+    
+    if linhas:
+        _gravar_lote(db, tipo, linhas)
+        importadas += len(linhas)
+    
+    return {
+        "features": lidas,
+        "importadas": importadas,
+        "rejeitadas": rejeitadas,
+        "erros": erros
+    }
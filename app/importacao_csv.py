@@ -0,0 +1,354 @@
+"""
+Importação de planilhas CSV de veículos, manutenções e uso de horas
+
+O arquivo é lido como fluxo, linha a linha, e cada linha é validada pelo
+schema *Create do tipo importado. As linhas válidas são gravadas em lotes
+(executemany), com um commit por lote; as inválidas são rejeitadas
+individualmente e relatadas com o número da linha no arquivo.
+
+Cada tipo substitui os registros de mesma chave:
+- veiculos: prefixo ou placa (veículo existente é atualizado, os demais são inseridos);
+- manutencoes: veículo, data e tipo;
+- uso_horas: veículo e competência.
+
+Manutenções e uso identificam o veículo pela coluna veiculo_id, prefixo ou
+placa. As colunas horas_mes e manutencoes_6m de veículos são ignoradas:
+são derivadas dos eventos (app.indicadores).
+
+As gravações em lote não passam pelo flush do ORM. A versão e a nota dos
+veículos gravados são atualizadas no próprio lote; indicadores, série mensal
+de uso e custos acumulados dos veículos afetados são recalculados uma única
+vez, ao fim da importação.
+
+Uso pela linha de comando:
+    python -m app.importacao_csv manutencoes manutencoes.csv
+"""
+import argparse
+import csv
+import io
+import json
+import re
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Set, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import bindparam, select, insert, update
+from sqlalchemy.orm import Session
+
+from app import custos, indicadores, uso_mensal
+from app.cache import anotar_escrita
+from app.geo import celula_grade, obter_indice_areas
+from app.importacao import MAX_ERROS_RELATADOS, _ReferenciasVeiculos
+from app.models import Veiculo, Organizacao, Manutencao, UsoHoras
+from app.schemas import VeiculoCreate, ManutencaoCreate, UsoHorasCreate
+from app.services import recalcular_notas
+from app.sincronizacao import versao_sessao
+
+TIPOS_CSV = ("veiculos", "manutencoes", "uso_horas")
+
+# Linhas gravadas por transação (linhas de CSV são bem menores que features GeoJSON)
+IMPORTACAO_CSV_LOTE = 5000
+
+# Colunas de VeiculoCreate mantidas por app.indicadores
+CAMPOS_DERIVADOS = {"horas_mes", "manutencoes_6m"}
+
+# Colunas a mais numa linha (csv.DictReader)
+_EXCEDENTE = "_excedente"
+
+# Datas sem horário, em ISO (AAAA-MM-DD) ou no formato brasileiro (DD/MM/AAAA)
+_DATA_ISO = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_DATA_BR = re.compile(r"^(\d{2})/(\d{2})/(\d{4})$")
+
+# ====== LEITURA ======
+
+def ler_linhas(arquivo: BinaryIO) -> Iterator[Tuple[int, Dict[str, Optional[str]]]]:
+    """
+    Percorre as linhas de dados de um CSV UTF-8 sem carregar o arquivo inteiro
+    
+    O separador (vírgula ou ponto e vírgula) é deduzido do cabeçalho, cujos
+    nomes de coluna são comparados sem diferenciar maiúsculas.
+    
+    Yields:
+        Tuple: número da linha no arquivo e valores por coluna
+    
+    Raises:
+        ValueError: arquivo vazio ou que não é UTF-8
+    """
+    texto = io.TextIOWrapper(arquivo, encoding="utf-8-sig", newline="")
+    try:
+        cabecalho = texto.readline()
+        if not cabecalho.strip():
+            raise ValueError("arquivo sem cabeçalho")
+        separador = ";" if cabecalho.count(";") > cabecalho.count(",") else ","
+        colunas = [coluna.strip().lower() for coluna in next(csv.reader([cabecalho], delimiter=separador))]
+        
+        leitor = csv.DictReader(texto, fieldnames=colunas, delimiter=separador, restkey=_EXCEDENTE)
+        for valores in leitor:
+            # line_num não conta o cabeçalho, lido à parte
+            yield leitor.line_num + 1, valores
+    except UnicodeDecodeError:
+        raise ValueError("arquivo deve estar em UTF-8")
+    finally:
+        # Devolve o arquivo aberto a quem o abriu
+        texto.detach()
+
+# ====== VALIDAÇÃO ======
+
+def _valores(linha: Dict[str, Optional[str]]) -> Dict[str, str]:
+    """Valores preenchidos da linha; colunas vazias ficam com o padrão do schema"""
+    if _EXCEDENTE in linha or None in linha.values():
+        raise ValueError("quantidade de colunas diferente do cabeçalho")
+    return {coluna: valor.strip() for coluna, valor in linha.items() if valor.strip()}
+
+def _data(valor: str) -> str:
+    """Data de manutenção em ISO, com horário (meia-noite) quando ausente"""
+    brasileira = _DATA_BR.match(valor)
+    if brasileira:
+        dia, mes, ano = brasileira.groups()
+        valor = f"{ano}-{mes}-{dia}"
+    return f"{valor}T00:00:00" if _DATA_ISO.match(valor) else valor
+
+def _mensagem(erro: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(parte) for parte in detalhe['loc'])}: {detalhe['msg']}"
+        for detalhe in erro.errors()
+    )
+
+def _veiculo_referenciado(valores: Dict[str, str], veiculos: _ReferenciasVeiculos) -> int:
+    if "veiculo_id" in valores:
+        if not valores["veiculo_id"].isdigit():
+            raise ValueError(f"veiculo_id inválido: {valores['veiculo_id']}")
+        return veiculos.localizar({"veiculo_id": int(valores["veiculo_id"])})
+    return veiculos.localizar(valores)
+
+def _preparar(tipo: str, linha: Dict[str, Optional[str]], referencias: Any) -> Dict:
+    """Valida uma linha e devolve o registro a gravar"""
+    valores = _valores(linha)
+    try:
+        if tipo == "veiculos":
+            registro = VeiculoCreate(**valores).model_dump(exclude_unset=True, exclude=CAMPOS_DERIVADOS)
+            if registro["organizacao_id"] not in referencias.organizacoes:
+                raise ValueError(f"organização {registro['organizacao_id']} não encontrada")
+            return registro
+        
+        valores["veiculo_id"] = _veiculo_referenciado(valores, referencias)
+        if tipo == "manutencoes":
+            if "data" in valores:
+                valores["data"] = _data(valores["data"])
+            return ManutencaoCreate(**valores).model_dump()
+        return UsoHorasCreate(**valores).model_dump()
+    except ValidationError as e:
+        raise ValueError(_mensagem(e))
+
+# ====== GRAVAÇÃO ======
+
+class _ChavesVeiculos:
+    """Veículos existentes por prefixo e placa, carregados uma única vez"""
+    
+    def __init__(self, db: Session):
+        self.organizacoes = set(db.execute(select(Organizacao.id)).scalars())
+        self.por_prefixo: Dict[str, int] = {}
+        self.por_placa: Dict[str, int] = {}
+        self.grupos: Dict[int, Tuple[int, str]] = {}
+        for veiculo_id, prefixo, placa, organizacao_id, categoria in db.execute(
+            select(Veiculo.id, Veiculo.prefixo, Veiculo.placa, Veiculo.organizacao_id, Veiculo.categoria)
+        ):
+            self.registrar(veiculo_id, prefixo, placa, organizacao_id, categoria)
+    
+    def registrar(self, veiculo_id: int, prefixo: str, placa: str, organizacao_id: int, categoria: str):
+        self.por_prefixo[prefixo.upper()] = veiculo_id
+        self.por_placa[placa.upper()] = veiculo_id
+        self.grupos[veiculo_id] = (organizacao_id, categoria)
+
+class _Importacao:
+    """Estado de uma importação: contagens, erros e registros afetados"""
+    
+    def __init__(self, db: Session, tipo: str):
+        self.db = db
+        self.tipo = tipo
+        if tipo == "veiculos":
+            self.referencias = _ChavesVeiculos(db)
+        else:
+            self.referencias = _ReferenciasVeiculos(db)
+        self.lidas = self.inseridas = self.atualizadas = self.rejeitadas = 0
+        self.erros: List[Dict[str, Any]] = []
+        # Para o recálculo dos dados derivados ao fim
+        self.veiculos: Set[int] = set()
+        self.usos: Set[Tuple[str, int]] = set()
+        self.grupos_veiculos: Set[Tuple[int, int, str]] = set()
+    
+    def rejeitar(self, numero: int, erro: str):
+        self.rejeitadas += 1
+        if len(self.erros) < MAX_ERROS_RELATADOS:
+            self.erros.append({"linha": numero, "erro": erro})
+    
+    def gravar(self, lote: List[Tuple[int, Dict]]):
+        """Grava um lote numa transação"""
+        if self.tipo == "veiculos":
+            self._gravar_veiculos(lote)
+        elif self.tipo == "manutencoes":
+            self._substituir(lote, Manutencao, ("veiculo_id", "data", "tipo"))
+        else:
+            self._substituir(lote, UsoHoras, ("veiculo_id", "ano_mes"))
+            self.usos.update((registro["ano_mes"], registro["veiculo_id"]) for _, registro in lote)
+        self.db.commit()
+    
+    def _substituir(self, lote: List[Tuple[int, Dict]], modelo, chave: Tuple[str, ...]):
+        """Remove os registros de mesma chave e insere os do lote (a última linha de cada chave prevalece)"""
+        registros = list({tuple(registro[c] for c in chave): registro for _, registro in lote}.values())
+        # Um DELETE por chave (executemany): cada um é uma busca no índice
+        # (veiculo_id, ...), enquanto um único IN de tuplas percorreria a tabela
+        tabela = modelo.__table__
+        removidos = self.db.execute(
+            tabela.delete().where(*(tabela.c[c] == bindparam(f"chave_{c}") for c in chave)),
+            [{f"chave_{c}": registro[c] for c in chave} for registro in registros]
+        ).rowcount
+        anotar_escrita(self.db, tabela.name)
+        self.db.execute(insert(modelo), registros)
+        self.atualizadas += removidos
+        self.inseridas += len(registros) - removidos
+        self.veiculos.update(registro["veiculo_id"] for registro in registros)
+    
+    def _gravar_veiculos(self, lote: List[Tuple[int, Dict]]):
+        """Atualiza os veículos já cadastrados (por prefixo ou placa) e insere os demais"""
+        chaves = self.referencias
+        versao = versao_sessao(self.db)
+        areas = obter_indice_areas(self.db)
+        novos: Dict[str, Dict] = {}
+        novos_por_placa: Dict[str, str] = {}
+        alterados: Dict[int, Dict] = {}
+        
+        for numero, registro in lote:
+            prefixo, placa = registro["prefixo"].upper(), registro["placa"].upper()
+            pelo_prefixo, pela_placa = chaves.por_prefixo.get(prefixo), chaves.por_placa.get(placa)
+            if pelo_prefixo is not None and pela_placa is not None and pelo_prefixo != pela_placa:
+                self.rejeitar(numero, f"placa {registro['placa']} pertence a outro veículo")
+                continue
+            veiculo_id = pelo_prefixo if pelo_prefixo is not None else pela_placa
+            if veiculo_id is None and novos_por_placa.get(placa, prefixo) != prefixo:
+                self.rejeitar(numero, f"placa {registro['placa']} repetida no arquivo com outro prefixo")
+                continue
+            
+            registro["versao"] = versao
+            if "latitude" in registro or "longitude" in registro:
+                lat, lon = registro.get("latitude"), registro.get("longitude")
+                registro["geo_celula"] = celula_grade(lat, lon)
+                registro["geo_batalhao_id"] = areas.localizar(lat, lon)
+            
+            if veiculo_id is None:
+                novos[prefixo] = registro
+                novos_por_placa[placa] = prefixo
+            else:
+                alterados.setdefault(veiculo_id, {"id": veiculo_id}).update(registro)
+        
+        if alterados:
+            for veiculo_id, registro in alterados.items():
+                anterior = chaves.grupos[veiculo_id]
+                atual = (registro.get("organizacao_id", anterior[0]), registro.get("categoria", anterior[1]))
+                if atual != anterior:
+                    self.grupos_veiculos.update({(veiculo_id, *anterior), (veiculo_id, *atual)})
+                chaves.registrar(veiculo_id, registro["prefixo"], registro["placa"], *atual)
+            self.db.execute(update(Veiculo), list(alterados.values()))
+        
+        if novos:
+            registros = list(novos.values())
+            ids = self.db.execute(
+                insert(Veiculo).returning(Veiculo.id, sort_by_parameter_order=True), registros
+            ).scalars().all()
+            for veiculo_id, registro in zip(ids, registros):
+                chaves.registrar(
+                    veiculo_id, registro["prefixo"], registro["placa"],
+                    registro["organizacao_id"], registro["categoria"]
+                )
+        
+        recalcular_notas(self.db, Veiculo.versao == versao)
+        self.inseridas += len(novos)
+        self.atualizadas += len(alterados)
+    
+    def atualizar_derivados(self):
+        """Recalcula, numa transação, os dados derivados dos registros gravados"""
+        if self.veiculos:
+            indicadores.atualizar_veiculos(self.db, self.veiculos)
+            if self.tipo == "manutencoes":
+                custos.recalcular_veiculos(self.db, self.veiculos)
+        grupos = uso_mensal.grupos_dos_usos(self.db, self.usos)
+        grupos |= uso_mensal.grupos_dos_veiculos(self.db, self.grupos_veiculos)
+        if grupos:
+            uso_mensal.recalcular_grupos(self.db, grupos)
+        self.db.commit()
+
+def importar_csv(
+    db: Session,
+    tipo: str,
+    arquivo: BinaryIO,
+    lote: int = IMPORTACAO_CSV_LOTE
+) -> Dict[str, Any]:
+    """
+    Importa um CSV de veículos, manutenções ou uso de horas
+    
+    Args:
+        db: Sessão do banco
+        tipo: veiculos, manutencoes ou uso_horas
+        arquivo: Arquivo binário, lido como fluxo
+        lote: Linhas gravadas por transação
+    
+    Returns:
+        Dict: linhas lidas, importadas (inseridas e atualizadas), rejeitadas
+            e erros (linha e motivo)
+    
+    Raises:
+        ValueError: tipo desconhecido ou arquivo ilegível (os lotes anteriores
+            ao erro permanecem gravados)
+    """
+    if tipo not in TIPOS_CSV:
+        raise ValueError(f"Tipo inválido: {tipo} (use {', '.join(TIPOS_CSV)})")
+    
+    importacao = _Importacao(db, tipo)
+    registros: List[Tuple[int, Dict]] = []
+    
+    try:
+        for numero, linha in ler_linhas(arquivo):
+            importacao.lidas += 1
+            try:
+                registros.append((numero, _preparar(tipo, linha, importacao.referencias)))
+            except ValueError as e:
+                importacao.rejeitar(numero, str(e))
+                continue
+            
+            if len(registros) >= lote:
+                importacao.gravar(registros)
+                registros = []
+        
+        if registros:
+            importacao.gravar(registros)
+    except ValueError as e:
+        raise ValueError(f"{e} (linha {importacao.lidas + 1}; {importacao.inseridas + importacao.atualizadas} já importadas)")
+    finally:
+        # Também após um erro: os lotes anteriores já foram confirmados
+        db.rollback()
+        importacao.atualizar_derivados()
+    
+    return {
+        "linhas": importacao.lidas,
+        "importadas": importacao.inseridas + importacao.atualizadas,
+        "inseridas": importacao.inseridas,
+        "atualizadas": importacao.atualizadas,
+        "rejeitadas": importacao.rejeitadas,
+        "erros": sorted(importacao.erros, key=lambda erro: erro["linha"])
+    }
+
+if __name__ == "__main__":
+    from app.db import SessionLocal
+    
+    parser = argparse.ArgumentParser(description="Importa um arquivo CSV para o banco")
+    parser.add_argument("tipo", choices=TIPOS_CSV)
+    parser.add_argument("arquivo", help="Caminho do arquivo CSV (UTF-8)")
+    parser.add_argument("--lote", type=int, default=IMPORTACAO_CSV_LOTE, help="Linhas gravadas por transação")
+    args = parser.parse_args()
+    
+    db = SessionLocal()
+    try:
+        with open(args.arquivo, "rb") as arquivo:
+            resultado = importar_csv(db, args.tipo, arquivo, args.lote)
+    finally:
+        db.close()
+    print(json.dumps(resultado, ensure_ascii=False, indent=2))
@@ -0,0 +1,215 @@
+"""
+Indicadores do veículo derivados dos eventos: manutencoes_6m e horas_mes
+
+manutencoes_6m conta as manutenções dos últimos MANUTENCOES_JANELA_DIAS dias
+e horas_mes soma as horas da competência (YYYY-MM) mais recente registrada
+até o mês corrente. Os dois campos deixam de ser gravados à parte e passam a
+ser mantidos a partir de Manutencao e UsoHoras:
+
+- o flush que grava, altera ou remove eventos recalcula apenas os veículos
+  afetados, por subconsultas nos índices (veiculo_id, data) e
+  (veiculo_id, ano_mes);
+- a passagem do tempo é aplicada por sincronizar_indicadores, que recalcula
+  apenas os veículos com eventos entre a janela da execução anterior e a atual;
+- reconstruir_indicadores refaz a frota inteira num único UPDATE
+  (python -m app.indicadores).
+
+Veículos cujos indicadores mudaram recebem nova versão de linha e têm a nota
+de ocupação recalculada na mesma transação.
+"""
+import threading
+from datetime import datetime, timedelta
+from typing import Iterable, Optional, Set, Tuple
+
+from sqlalchemy import event, func, inspect, select, union, update
+from sqlalchemy.orm import Session, aliased
+
+from app.config import MANUTENCOES_JANELA_DIAS, INDICADORES_INTERVALO
+from app.db import SessionLocal
+from app.models import Veiculo, Manutencao, UsoHoras, SistemaMeta
+from app.services import recalcular_notas
+from app.sincronizacao import versao_sessao
+
+# Veículos recalculados por instrução
+LOTE_VEICULOS = 500
+
+# Colunas do veículo gravadas por atualizar_indicadores
+CAMPOS_ATUALIZADOS = ("manutencoes_6m", "horas_mes", "nota_ocupacao", "faixa_ocupacao", "versao")
+
+# Chave em SistemaMeta com o instante da última aplicação da janela
+CHAVE_JANELA = "janela_indicadores"
+
+def referencias(agora: datetime) -> Tuple[datetime, str]:
+    """Início da janela de manutenções e competência corrente"""
+    return agora - timedelta(days=MANUTENCOES_JANELA_DIAS), agora.strftime("%Y-%m")
+
+def _valores(agora: datetime) -> dict:
+    """Subconsultas correlacionadas que calculam os indicadores de cada veículo"""
+    inicio, competencia = referencias(agora)
+    manutencoes = (
+        select(func.count(Manutencao.id))
+        .where(Manutencao.veiculo_id == Veiculo.id, Manutencao.data >= inicio)
+        .scalar_subquery()
+    )
+    competencias = aliased(UsoHoras)
+    ultima_competencia = (
+        select(func.max(competencias.ano_mes))
+        .where(competencias.veiculo_id == Veiculo.id, competencias.ano_mes <= competencia)
+        .correlate(Veiculo)
+        .scalar_subquery()
+    )
+    horas = (
+        select(func.coalesce(func.sum(UsoHoras.horas), 0))
+        .where(UsoHoras.veiculo_id == Veiculo.id, UsoHoras.ano_mes == ultima_competencia)
+        .scalar_subquery()
+    )
+    return {"manutencoes_6m": manutencoes, "horas_mes": horas}
+
+def atualizar_indicadores(db: Session, *criterios, agora: Optional[datetime] = None) -> int:
+    """
+    Recalcula manutencoes_6m e horas_mes a partir dos eventos
+    
+    Só são gravados os veículos cujos valores mudaram; a nota deles é
+    recalculada em seguida.
+    
+    Args:
+        db: Sessão do banco
+        *criterios: Filtros opcionais sobre Veiculo; sem filtros, toda a frota
+        agora: Instante de referência da janela (padrão: agora)
+    
+    Returns:
+        int: Quantidade de veículos atualizados
+    """
+    valores = _valores(agora or datetime.now())
+    versao = versao_sessao(db)
+    resultado = db.execute(
+        update(Veiculo)
+        .where(
+            *criterios,
+            Veiculo.manutencoes_6m.is_distinct_from(valores["manutencoes_6m"])
+            | Veiculo.horas_mes.is_distinct_from(valores["horas_mes"])
+        )
+        .values(**valores, versao=versao)
+        .execution_options(synchronize_session=False)
+    )
+    if resultado.rowcount:
+        recalcular_notas(db, *criterios, Veiculo.versao == versao)
+    return resultado.rowcount
+
+def atualizar_veiculos(db: Session, veiculo_ids: Iterable[int], agora: Optional[datetime] = None) -> int:
+    """Recalcula os indicadores dos veículos informados, em lotes"""
+    ids = sorted(veiculo_ids)
+    agora = agora or datetime.now()
+    atualizados = 0
+    for i in range(0, len(ids), LOTE_VEICULOS):
+        atualizados += atualizar_indicadores(db, Veiculo.id.in_(ids[i:i + LOTE_VEICULOS]), agora=agora)
+    return atualizados
+
+def reconstruir_indicadores(db: Session, agora: Optional[datetime] = None) -> int:
+    """
+    Recalcula os indicadores de toda a frota e reinicia a janela
+    
+    Returns:
+        int: Quantidade de veículos atualizados
+    """
+    agora = agora or datetime.now()
+    atualizados = atualizar_indicadores(db, agora=agora)
+    db.merge(SistemaMeta(chave=CHAVE_JANELA, valor=agora.isoformat()))
+    db.commit()
+    return atualizados
+
+def sincronizar_indicadores(db: Session, agora: Optional[datetime] = None) -> int:
+    """
+    Aplica a passagem do tempo desde a última sincronização
+    
+    Recalcula apenas os veículos com manutenções que saíram da janela ou com
+    competências que passaram a ser o mês corrente; sem sincronização
+    anterior, reconstrói a frota inteira.
+    
+    Returns:
+        int: Quantidade de veículos atualizados
+    """
+    agora = agora or datetime.now()
+    meta = db.get(SistemaMeta, CHAVE_JANELA)
+    if meta is None:
+        return reconstruir_indicadores(db, agora)
+    
+    inicio_anterior, competencia_anterior = referencias(datetime.fromisoformat(meta.valor))
+    inicio, competencia = referencias(agora)
+    afetados = union(
+        select(Manutencao.veiculo_id).where(Manutencao.data >= inicio_anterior, Manutencao.data < inicio),
+        select(UsoHoras.veiculo_id).where(UsoHoras.ano_mes > competencia_anterior, UsoHoras.ano_mes <= competencia)
+    )
+    atualizados = atualizar_indicadores(db, Veiculo.id.in_(afetados), agora=agora)
+    meta.valor = agora.isoformat()
+    db.commit()
+    return atualizados
+
+# ====== EVENTOS DO ORM ======
+
+def _veiculos_pendentes(session: Session) -> Set[int]:
+    return session.info.setdefault("indicadores_pendentes", set())
+
+@event.listens_for(Session, "after_flush")
+def _registrar_eventos(session, flush_context):
+    """Anota os veículos cujos eventos foram gravados, alterados ou removidos"""
+    pendentes = _veiculos_pendentes(session)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Manutencao, UsoHoras)):
+            pendentes.add(obj.veiculo_id)
+            # Evento transferido de veículo: o anterior também muda
+            pendentes.update(inspect(obj).attrs.veiculo_id.history.deleted or ())
+    pendentes.discard(None)
+
+@event.listens_for(Session, "after_flush_postexec")
+def _atualizar_indicadores_pendentes(session, flush_context):
+    """Recalcula os indicadores dos veículos anotados, em lotes"""
+    pendentes = session.info.pop("indicadores_pendentes", None)
+    if not pendentes:
+        return
+    
+    with session.no_autoflush:
+        atualizar_veiculos(session, pendentes)
+    
+    # Veículos já carregados na sessão voltam a ler os valores gravados
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Veiculo) and obj.id in pendentes:
+            session.expire(obj, CAMPOS_ATUALIZADOS)
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_pendentes(session):
+    session.info.pop("indicadores_pendentes", None)
+
+# ====== SINCRONIZAÇÃO PERIÓDICA ======
+
+_parar = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+def _executar():
+    while not _parar.wait(INDICADORES_INTERVALO):
+        try:
+            with SessionLocal() as db:
+                sincronizar_indicadores(db)
+        except Exception as e:
+            print(f"❌ Erro ao sincronizar indicadores: {e}")
+
+def iniciar():
+    """Inicia a thread que aplica a janela a cada INDICADORES_INTERVALO segundos"""
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    _parar.clear()
+    _thread = threading.Thread(target=_executar, name="indicadores", daemon=True)
+    _thread.start()
+
+def parar():
+    """Encerra a thread de sincronização periódica"""
+    global _thread
+    _parar.set()
+    if _thread is not None:
+        _thread.join()
+        _thread = None
+
+if __name__ == "__main__":
+    with SessionLocal() as _db:
+        print(f"✅ Indicadores recalculados: {reconstruir_indicadores(_db)} veículos")
@@ -1,31 +1,63 @@
 """
 FastAPI application principal do SGV
 """
-from fastapi import FastAPI, Depends, HTTPException, Query, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, Query, UploadFile, File, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from typing import Optional, List
-import json
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date
+from typing import Callable, Iterable, Optional, List
 
-from app.db import get_db, create_tables
+from app.db import (
+    get_db, get_db_leitura, get_db_leitura_assincrona, create_tables, SessionLocal, engine_leitura_assincrono
+)
+from app.cache import cache_servicos
+from app.config import GEO_ZOOM_AGRUPAMENTO
+from app import versoes
+from app.geo import parse_bbox, sincronizar_celulas, sincronizar_areas
+from app.tiles import TABELAS_TILES, obter_tile, tile_valido
+from app.importacao import TIPOS_IMPORTACAO, importar_geojson
+from app.importacao_csv import TIPOS_CSV, importar_csv
+from app.exportacao import TIPOS_EXPORTACAO, FORMATOS_EXPORTACAO, stream_exportacao
+from app.posicoes import buffer_posicoes
+from app import indicadores
+from app.uso_mensal import sincronizar_uso_mensal
+from app.custos import sincronizar_custos
 from app.models import Veiculo, Organizacao, Manutencao, UsoHoras, GeoBatalhoes, GeoBases, GeoViaturas
 from app.schemas import (
     Veiculo as VeiculoSchema, VeiculoDetalhado, Organizacao as OrganizacaoSchema,
     NotaOcupacao, KPIs, VidaUtilCategoria, FipeCategoria, TopVeiculo, 
-    Recomendacao, GeoJSONFeatureCollection
+    Recomendacao, GeoJSONFeatureCollection, DashboardResumo, PaginaVeiculos, ResumoAreas,
+    PosicaoPing, PontoUsoHoras, CustoCategoria, CustosVeiculo
 )
 from app.services import (
-    calcular_nota_ocupacao, get_kpis, get_vida_util_por_categoria,
-    get_fipe_por_categoria, get_top_rodados, get_top_horas,
-    get_top_manutencoes, get_recomendacoes_descarte,
-    get_geo_batalhoes, get_geo_bases, get_geo_viaturas
+    sincronizar_notas, CAMPOS_DASHBOARD, get_dashboard_resumo_async,
+    CAMPOS_VEICULO, ORDENACOES_VEICULO, get_pagina_veiculos,
+    get_kpis_async, get_vida_util_por_categoria_async,
+    get_fipe_por_categoria_async, get_top_rodados_async, get_top_horas_async,
+    get_top_manutencoes_async, get_recomendacoes_descarte_async, get_serie_uso_horas_async,
+    get_custo_por_categoria_async, get_top_custos_async, get_custos_veiculo,
+    stream_geo_batalhoes, stream_geo_bases, stream_geo_viaturas_async, get_clusters_viaturas_async,
+    get_resumo_areas_async
 )
 
 # Criar tabelas no startup
 create_tables()
 
+# Atualizar notas persistidas (parâmetros alterados ou veículos sem nota),
+# indicadores derivados dos eventos, série mensal de uso, custos acumulados, células da grade espacial dos veículos
+# ainda sem célula e áreas dos batalhões
+with SessionLocal() as _db:
+    sincronizar_notas(_db)
+    indicadores.sincronizar_indicadores(_db)
+    sincronizar_uso_mensal(_db)
+    sincronizar_custos(_db)
+    sincronizar_celulas(_db)
+    sincronizar_areas(_db)
+
 # Inicializar FastAPI
 app = FastAPI(
     title="Sistema de Gestão de Veículos (SGV)",
@@ -42,6 +74,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+def iniciar_gravacao_posicoes():
+    buffer_posicoes.iniciar()
+
+@app.on_event("shutdown")
+def parar_gravacao_posicoes():
+    buffer_posicoes.parar()
+
+@app.on_event("startup")
+def iniciar_sincronizacao_indicadores():
+    indicadores.iniciar()
+
+@app.on_event("shutdown")
+def parar_sincronizacao_indicadores():
+    indicadores.parar()
+
+@app.on_event("shutdown")
+async def fechar_engine_assincrono():
+    # Conexões do aiosqlite mantêm threads próprias abertas até serem fechadas
+    await engine_leitura_assincrono.dispose()
+
 # Servir arquivos estáticos
 app.mount("/static", StaticFiles(directory="frontend"), name="static")
 
@@ -54,9 +107,38 @@ async def read_root():
     except FileNotFoundError:
         return HTMLResponse(content="<h1>Frontend não encontrado</h1><p>Execute o script de setup primeiro.</p>")
 
+def resposta_condicional(request: Request, db: Session, recurso: str, tabelas: Iterable[str], gerar: Callable):
+    """
+    Responde 304 se o cliente já tem a versão atual do recurso
+    
+    A verificação lê apenas as versões das tabelas (versao_tabela, por chave
+    primária); o conteúdo só é consultado (por gerar) quando precisa ser
+    enviado.
+    """
+    tabelas = list(tabelas)
+    estado = versoes.ler_estado(db, tabelas)
+    etag = versoes.etag(recurso, estado, tabelas)
+    cabecalhos = {
+        "ETag": etag,
+        "Last-Modified": versoes.last_modified(estado, tabelas),
+        "Cache-Control": "no-cache"
+    }
+    
+    if versoes.nao_modificado(
+        estado, tabelas, etag,
+        request.headers.get("if-none-match"),
+        request.headers.get("if-modified-since")
+    ):
+        return Response(status_code=304, headers=cabecalhos)
+    
+    conteudo = gerar()
+    resposta = conteudo if isinstance(conteudo, Response) else JSONResponse(jsonable_encoder(conteudo))
+    resposta.headers.update(cabecalhos)
+    return resposta
+
 # ====== ENDPOINTS DE VEÍCULOS ======
 
-@app.get("/api/veiculos", response_model=List[VeiculoSchema])
+@app.get("/api/veiculos", response_model=PaginaVeiculos)
 def listar_veiculos(
     comando: Optional[str] = Query(None),
     unidade: Optional[str] = Query(None),
@@ -65,120 +147,132 @@ def listar_veiculos(
     municipio: Optional[str] = Query(None),
     bairro: Optional[str] = Query(None),
     ativo: Optional[bool] = Query(None),
-    db: Session = Depends(get_db)
+    faixa: Optional[str] = Query(None, description="Crítico, Atenção, Adequado"),
+    fora_area: Optional[bool] = Query(None, description="Fora (true) ou dentro (false) da área do próprio batalhão"),
+    limite: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="proximo_cursor da página anterior"),
+    ordenar_por: str = Query("id", description=", ".join(ORDENACOES_VEICULO)),
+    ordem: str = Query("asc", pattern="^(asc|desc)$"),
+    campos: Optional[str] = Query(None, description="Campos separados por vírgula; vazio para todos"),
+    incluir_total: bool = Query(False),
+    db: Session = Depends(get_db_leitura)
 ):
-    """Listar veículos com filtros"""
-    
-    query = db.query(Veiculo).join(Organizacao)
-    
-    # Aplicar filtros conforme services.py
-    if comando:
-        comandos = db.query(Organizacao).filter(
-            Organizacao.tipo == "Comando",
-            Organizacao.nome.ilike(f"%{comando}%")
-        ).all()
-        if comandos:
-            comando_ids = [c.id for c in comandos]
-            from app.services import get_organizacao_filhos_ids
-            filhos_ids = get_organizacao_filhos_ids(db, comando_ids)
-            query = query.filter(Veiculo.organizacao_id.in_(filhos_ids))
-    
-    if unidade:
-        unidades = db.query(Organizacao).filter(
-            Organizacao.tipo == "Unidade",
-            Organizacao.nome.ilike(f"%{unidade}%")
-        ).all()
-        if unidades:
-            unidade_ids = [u.id for u in unidades]
-            from app.services import get_organizacao_filhos_ids
-            filhos_ids = get_organizacao_filhos_ids(db, unidade_ids)
-            query = query.filter(Veiculo.organizacao_id.in_(filhos_ids))
-    
-    if batalhao:
-        batalhoes = db.query(Organizacao).filter(
-            Organizacao.tipo == "Batalhao",
-            Organizacao.nome.ilike(f"%{batalhao}%")
-        ).all()
-        if batalhoes:
-            batalhao_ids = [b.id for b in batalhoes]
-            query = query.filter(Veiculo.organizacao_id.in_(batalhao_ids))
-    
-    if viatura:
-        query = query.filter(
-            (Veiculo.prefixo.ilike(f"%{viatura}%")) |
-            (Veiculo.placa.ilike(f"%{viatura}%"))
-        )
+    """Listar veículos com filtros, paginação por cursor e projeção de campos"""
     
-    if municipio:
-        query = query.filter(Veiculo.municipio.ilike(f"%{municipio}%"))
-    
-    if bairro:
-        query = query.filter(Veiculo.bairro.ilike(f"%{bairro}%"))
-    
-    if ativo is not None:
-        query = query.filter(Veiculo.ativo == ativo)
+    filtros = {
+        "comando": comando,
+        "unidade": unidade,
+        "batalhao": batalhao,
+        "viatura": viatura,
+        "municipio": municipio,
+        "bairro": bairro,
+        "ativo": ativo,
+        "faixa": faixa,
+        "fora_area": fora_area
+    }
     
-    veiculos = query.all()
+    if ordenar_por not in ORDENACOES_VEICULO:
+        raise HTTPException(status_code=400, detail=f"Ordenação inválida: {ordenar_por}")
     
-    # Adicionar nota de ocupação
-    resultado = []
-    for veiculo in veiculos:
-        nota, faixa = calcular_nota_ocupacao(veiculo)
-        veiculo_dict = VeiculoSchema.model_validate(veiculo).model_dump()
-        veiculo_dict["nota_ocupacao"] = nota
-        veiculo_dict["faixa_ocupacao"] = faixa
-        resultado.append(veiculo_dict)
+    selecionados = [c.strip() for c in campos.split(",") if c.strip()] if campos else None
+    invalidos = set(selecionados or []) - set(CAMPOS_VEICULO)
+    if invalidos:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Campos inválidos: {', '.join(sorted(invalidos))}"
+        )
     
-    return resultado
+    try:
+        return get_pagina_veiculos(
+            db, filtros, limite, cursor, ordenar_por, ordem, selecionados, incluir_total
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/api/veiculos/{veiculo_id}", response_model=VeiculoDetalhado)
-def obter_veiculo(veiculo_id: int, db: Session = Depends(get_db)):
+def obter_veiculo(veiculo_id: int, db: Session = Depends(get_db_leitura)):
     """Obter detalhes de um veículo"""
     
     veiculo = db.query(Veiculo).filter(Veiculo.id == veiculo_id).first()
     if not veiculo:
         raise HTTPException(status_code=404, detail="Veículo não encontrado")
     
-    nota, faixa = calcular_nota_ocupacao(veiculo)
-    
-    veiculo_dict = VeiculoDetalhado.model_validate(veiculo).model_dump()
-    veiculo_dict["nota_ocupacao"] = nota
-    veiculo_dict["faixa_ocupacao"] = faixa
-    
-    return veiculo_dict
+    return VeiculoDetalhado.model_validate(veiculo).model_dump()
 
 @app.get("/api/veiculos/{veiculo_id}/nota", response_model=NotaOcupacao)
-def obter_nota_ocupacao(veiculo_id: int, db: Session = Depends(get_db)):
+def obter_nota_ocupacao(veiculo_id: int, db: Session = Depends(get_db_leitura)):
     """Obter nota de ocupação de um veículo"""
     
     veiculo = db.query(Veiculo).filter(Veiculo.id == veiculo_id).first()
     if not veiculo:
         raise HTTPException(status_code=404, detail="Veículo não encontrado")
     
-    nota, faixa = calcular_nota_ocupacao(veiculo)
+    return NotaOcupacao(nota=veiculo.nota_ocupacao, faixa=veiculo.faixa_ocupacao)
+
+@app.get("/api/veiculos/{veiculo_id}/custos", response_model=CustosVeiculo)
+def obter_custos_veiculo(
+    veiculo_id: int,
+    meses: int = Query(12, ge=1, le=120, description="Janela em meses, até o mês corrente"),
+    db: Session = Depends(get_db_leitura)
+):
+    """Obter custos de manutenção de um veículo (total, por km e na janela)"""
+    
+    custos = get_custos_veiculo(db, veiculo_id, meses)
+    if custos is None:
+        raise HTTPException(status_code=404, detail="Veículo não encontrado")
     
-    return NotaOcupacao(nota=nota, faixa=faixa)
+    return custos
 
 # ====== ENDPOINTS GEO ======
 
-@app.get("/api/geo/batalhoes", response_model=GeoJSONFeatureCollection)
+@app.get("/api/geo/batalhoes", response_class=StreamingResponse)
 def obter_geo_batalhoes(
+    request: Request,
     municipio: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_leitura)
 ):
     """Obter polígonos dos batalhões"""
-    return get_geo_batalhoes(db, municipio)
+    return resposta_condicional(
+        request, db, "geo-batalhoes", ["geo_batalhoes"],
+        lambda: StreamingResponse(stream_geo_batalhoes(db, municipio), media_type="application/json")
+    )
 
-@app.get("/api/geo/bases", response_model=GeoJSONFeatureCollection)
+@app.get("/api/geo/bases", response_class=StreamingResponse)
 def obter_geo_bases(
+    request: Request,
     municipio: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_leitura)
 ):
     """Obter pontos das bases"""
-    return get_geo_bases(db, municipio)
+    return resposta_condicional(
+        request, db, "geo-bases", ["geo_bases"],
+        lambda: StreamingResponse(stream_geo_bases(db, municipio), media_type="application/json")
+    )
+
+@app.get("/api/geo/areas", response_model=ResumoAreas)
+async def obter_resumo_areas(db: AsyncSession = Depends(get_db_leitura_assincrona)):
+    """Viaturas por área de batalhão e viaturas fora da área do próprio batalhão"""
+    return await get_resumo_areas_async(db)
+
+@app.get("/api/geo/tiles/{z}/{x}/{y}")
+def obter_geo_tile(
+    request: Request,
+    z: int,
+    x: int,
+    y: int,
+    db: Session = Depends(get_db_leitura)
+):
+    """Obter batalhões e bases recortados e simplificados para um tile XYZ"""
+    if not tile_valido(z, x, y):
+        raise HTTPException(status_code=400, detail=f"Tile inválido: {z}/{x}/{y}")
+    
+    return resposta_condicional(
+        request, db, f"geo-tile-{z}-{x}-{y}", TABELAS_TILES,
+        lambda: Response(obter_tile(db, z, x, y), media_type="application/json")
+    )
 
-@app.get("/api/geo/viaturas", response_model=GeoJSONFeatureCollection)
-def obter_geo_viaturas(
+@app.get("/api/geo/viaturas", response_class=StreamingResponse)
+async def obter_geo_viaturas(
     comando: Optional[str] = Query(None),
     unidade: Optional[str] = Query(None),
     batalhao: Optional[str] = Query(None),
@@ -186,9 +280,25 @@ def obter_geo_viaturas(
     municipio: Optional[str] = Query(None),
     bairro: Optional[str] = Query(None),
     ativo: Optional[bool] = Query(None),
-    db: Session = Depends(get_db)
+    faixa: Optional[str] = Query(None, description="Crítico, Atenção, Adequado"),
+    fora_area: Optional[bool] = Query(None, description="Fora (true) ou dentro (false) da área do próprio batalhão"),
+    bbox: Optional[str] = Query(None, description="Área visível: minLon,minLat,maxLon,maxLat"),
+    zoom: Optional[int] = Query(None, ge=0, le=22, description="Zoom do mapa; abaixo do limite devolve clusters"),
+    since: Optional[int] = Query(None, ge=0, description="Versão já carregada: devolve apenas as alterações"),
+    db: AsyncSession = Depends(get_db_leitura_assincrona)
 ):
-    """Obter pontos das viaturas com filtros"""
+    """
+    Obter pontos das viaturas com filtros (ou clusters, em zoom baixo)
+    
+    Com since, devolve apenas as viaturas alteradas depois daquela versão e
+    os ids removidos da camada; since é ignorado quando a resposta é de clusters.
+    """
+    
+    if bbox is not None:
+        try:
+            bbox = parse_bbox(bbox)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     
     filtros = {
         "comando": comando,
@@ -197,13 +307,21 @@ def obter_geo_viaturas(
         "viatura": viatura,
         "municipio": municipio,
         "bairro": bairro,
-        "ativo": ativo
+        "ativo": ativo,
+        "faixa": faixa,
+        "fora_area": fora_area,
+        "bbox": bbox
     }
     
     # Remover filtros None
     filtros = {k: v for k, v in filtros.items() if v is not None}
     
-    return get_geo_viaturas(db, **filtros)
+    if zoom is not None and zoom < GEO_ZOOM_AGRUPAMENTO:
+        return JSONResponse(await get_clusters_viaturas_async(db, zoom, **filtros))
+    
+    if since is not None:
+        filtros["desde"] = since
+    return StreamingResponse(stream_geo_viaturas_async(db, **filtros), media_type="application/json")
 
 @app.post("/api/geo/upload")
 def upload_geojson(
@@ -211,84 +329,211 @@ def upload_geojson(
     file: UploadFile = File(...),
     db: Session = Depends(get_db)
 ):
-    """Upload de arquivo GeoJSON"""
+    """Upload de arquivo GeoJSON, importado em lotes à medida que é lido"""
+    
+    if tipo not in TIPOS_IMPORTACAO:
+        raise HTTPException(status_code=400, detail=f"Tipo deve ser um de: {', '.join(TIPOS_IMPORTACAO)}")
     
     if not file.filename.endswith('.geojson'):
         raise HTTPException(status_code=400, detail="Arquivo deve ser .geojson")
     
     try:
-        content = file.file.read()
-        geojson_data = json.loads(content)
-        
-        # Validação básica
-        if geojson_data.get("type") != "FeatureCollection":
-            raise HTTPException(status_code=400, detail="GeoJSON deve ser FeatureCollection")
-        
-        # Implementação simplificada - apenas retorna sucesso
-        # Em produção, processar e salvar cada feature
-        
-        return {"message": f"Upload de {tipo} realizado com sucesso", "features": len(geojson_data.get("features", []))}
-        
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=400, detail="Arquivo GeoJSON inválido")
+        resultado = importar_geojson(db, tipo, file.file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
+        db.rollback()
         raise HTTPException(status_code=500, detail=f"Erro no upload: {str(e)}")
+    
+    return {"message": f"Upload de {tipo} realizado com sucesso", **resultado}
+
+@app.post("/api/import/{tipo}")
+def importar_arquivo_csv(tipo: str, file: UploadFile = File(...), db: Session = Depends(get_db)):
+    """Importação de CSV de veículos, manutenções ou uso de horas, gravado em lotes à medida que é lido"""
+    
+    if tipo not in TIPOS_CSV:
+        raise HTTPException(status_code=404, detail=f"Tipo deve ser um de: {', '.join(TIPOS_CSV)}")
+    
+    if not file.filename.lower().endswith('.csv'):
+        raise HTTPException(status_code=400, detail="Arquivo deve ser .csv")
+    
+    try:
+        resultado = importar_csv(db, tipo, file.file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Erro na importação: {str(e)}")
+    
+    return {"message": f"Importação de {tipo} concluída", **resultado}
+
+@app.get("/api/export/{tipo}", response_class=StreamingResponse)
+def exportar(
+    request: Request,
+    tipo: str,
+    formato: str = Query("csv", description=", ".join(FORMATOS_EXPORTACAO)),
+    comando: Optional[str] = Query(None),
+    unidade: Optional[str] = Query(None),
+    batalhao: Optional[str] = Query(None),
+    viatura: Optional[str] = Query(None),
+    municipio: Optional[str] = Query(None),
+    bairro: Optional[str] = Query(None),
+    ativo: Optional[bool] = Query(None),
+    faixa: Optional[str] = Query(None, description="Crítico, Atenção, Adequado"),
+    fora_area: Optional[bool] = Query(None, description="Fora (true) ou dentro (false) da área do próprio batalhão"),
+    bbox: Optional[str] = Query(None, description="Área: minLon,minLat,maxLon,maxLat"),
+    inicio: Optional[date] = Query(None, description="Manutenções a partir desta data"),
+    fim: Optional[date] = Query(None, description="Manutenções até esta data"),
+    db: Session = Depends(get_db_leitura)
+):
+    """
+    Exportar veículos ou manutenções em CSV ou NDJSON, em streaming
+    
+    Aceita os filtros do mapa (nas manutenções, aplicados ao veículo). A
+    resposta é comprimida com gzip quando o cliente aceita (Accept-Encoding).
+    """
+    
+    if tipo not in TIPOS_EXPORTACAO:
+        raise HTTPException(status_code=404, detail=f"Tipo deve ser um de: {', '.join(TIPOS_EXPORTACAO)}")
+    
+    if formato not in FORMATOS_EXPORTACAO:
+        raise HTTPException(status_code=400, detail=f"Formato deve ser um de: {', '.join(FORMATOS_EXPORTACAO)}")
+    
+    if bbox is not None:
+        try:
+            bbox = parse_bbox(bbox)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    filtros = {
+        "comando": comando,
+        "unidade": unidade,
+        "batalhao": batalhao,
+        "viatura": viatura,
+        "municipio": municipio,
+        "bairro": bairro,
+        "ativo": ativo,
+        "faixa": faixa,
+        "fora_area": fora_area,
+        "bbox": bbox
+    }
+    
+    gzip = "gzip" in request.headers.get("accept-encoding", "").lower()
+    cabecalhos = {"Content-Disposition": f'attachment; filename="{tipo}.{formato}"', "Vary": "Accept-Encoding"}
+    if gzip:
+        cabecalhos["Content-Encoding"] = "gzip"
+    
+    return StreamingResponse(
+        stream_exportacao(db, tipo, formato, filtros, inicio, fim, gzip),
+        media_type=FORMATOS_EXPORTACAO[formato],
+        headers=cabecalhos
+    )
 
 # ====== ENDPOINTS DASHBOARD ======
 
+# Competência no formato YYYY-MM
+COMPETENCIA = r"^\d{4}-(0[1-9]|1[0-2])$"
+
+@app.get("/api/dashboard/summary", response_model=DashboardResumo, response_model_exclude_none=True)
+async def obter_resumo_dashboard(
+    campos: Optional[str] = Query(None, description="Painéis separados por vírgula; vazio para todos"),
+    limit: int = Query(10, ge=1, le=50),
+    db: AsyncSession = Depends(get_db_leitura_assincrona)
+):
+    """Obter todos os painéis do dashboard em uma única requisição"""
+    
+    selecionados = [c.strip() for c in campos.split(",") if c.strip()] if campos else None
+    invalidos = set(selecionados or []) - set(CAMPOS_DASHBOARD)
+    if invalidos:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Campos inválidos: {', '.join(sorted(invalidos))}"
+        )
+    
+    return await get_dashboard_resumo_async(db, selecionados, limit)
+
 @app.get("/api/dashboard/kpis", response_model=KPIs)
-def obter_kpis(db: Session = Depends(get_db)):
+async def obter_kpis(db: AsyncSession = Depends(get_db_leitura_assincrona)):
     """Obter KPIs principais do dashboard"""
-    return get_kpis(db)
+    return await get_kpis_async(db)
 
 @app.get("/api/dashboard/vida_util_por_categoria", response_model=List[VidaUtilCategoria])
-def obter_vida_util_por_categoria(db: Session = Depends(get_db)):
+async def obter_vida_util_por_categoria(db: AsyncSession = Depends(get_db_leitura_assincrona)):
     """Obter vida útil média por categoria"""
-    return get_vida_util_por_categoria(db)
+    return await get_vida_util_por_categoria_async(db)
 
 @app.get("/api/dashboard/fipe_por_categoria", response_model=List[FipeCategoria])
-def obter_fipe_por_categoria(db: Session = Depends(get_db)):
+async def obter_fipe_por_categoria(db: AsyncSession = Depends(get_db_leitura_assincrona)):
     """Obter valores FIPE por categoria"""
-    return get_fipe_por_categoria(db)
+    return await get_fipe_por_categoria_async(db)
 
 @app.get("/api/dashboard/top_rodados", response_model=List[TopVeiculo])
-def obter_top_rodados(limit: int = Query(10, ge=1, le=50), db: Session = Depends(get_db)):
+async def obter_top_rodados(limit: int = Query(10, ge=1, le=50), db: AsyncSession = Depends(get_db_leitura_assincrona)):
     """Obter veículos mais rodados"""
-    return get_top_rodados(db, limit)
+    return await get_top_rodados_async(db, limit)
 
 @app.get("/api/dashboard/top_horas", response_model=List[TopVeiculo])
-def obter_top_horas(limit: int = Query(10, ge=1, le=50), db: Session = Depends(get_db)):
+async def obter_top_horas(limit: int = Query(10, ge=1, le=50), db: AsyncSession = Depends(get_db_leitura_assincrona)):
     """Obter veículos com mais horas trabalhadas"""
-    return get_top_horas(db, limit)
+    return await get_top_horas_async(db, limit)
 
 @app.get("/api/dashboard/top_manutencoes", response_model=List[TopVeiculo])
-def obter_top_manutencoes(limit: int = Query(10, ge=1, le=50), db: Session = Depends(get_db)):
+async def obter_top_manutencoes(limit: int = Query(10, ge=1, le=50), db: AsyncSession = Depends(get_db_leitura_assincrona)):
     """Obter veículos com mais manutenções"""
-    return get_top_manutencoes(db, limit)
+    return await get_top_manutencoes_async(db, limit)
+
+@app.get("/api/dashboard/custo_por_categoria", response_model=List[CustoCategoria])
+async def obter_custo_por_categoria(db: AsyncSession = Depends(get_db_leitura_assincrona)):
+    """Obter custos de manutenção por categoria"""
+    return await get_custo_por_categoria_async(db)
+
+@app.get("/api/dashboard/top_custos", response_model=List[TopVeiculo])
+async def obter_top_custos(limit: int = Query(10, ge=1, le=50), db: AsyncSession = Depends(get_db_leitura_assincrona)):
+    """Obter veículos com maior custo de manutenção em 12 meses"""
+    return await get_top_custos_async(db, limit)
+
+@app.get("/api/dashboard/uso_horas_serie", response_model=List[PontoUsoHoras], response_model_exclude_none=True)
+async def obter_serie_uso_horas(
+    inicio: Optional[str] = Query(None, pattern=COMPETENCIA, description="Primeira competência (YYYY-MM)"),
+    fim: Optional[str] = Query(None, pattern=COMPETENCIA, description="Última competência (YYYY-MM)"),
+    organizacao_id: Optional[int] = Query(None, description="Organização; inclui as subordinadas"),
+    categoria: Optional[str] = Query(None),
+    por_categoria: bool = Query(False, description="Um ponto por mês e categoria"),
+    db: AsyncSession = Depends(get_db_leitura_assincrona)
+):
+    """Obter a série mensal de horas de uso"""
+    if inicio and fim and inicio > fim:
+        raise HTTPException(status_code=400, detail="inicio deve ser anterior ou igual a fim")
+    
+    return await get_serie_uso_horas_async(db, inicio, fim, organizacao_id, categoria, por_categoria)
 
 @app.get("/api/recomendacoes", response_model=List[Recomendacao])
-def obter_recomendacoes(db: Session = Depends(get_db)):
+async def obter_recomendacoes(db: AsyncSession = Depends(get_db_leitura_assincrona)):
     """Obter recomendações de descarte"""
-    return get_recomendacoes_descarte(db)
+    return await get_recomendacoes_descarte_async(db)
 
 # ====== ENDPOINTS ORGANIZAÇÕES ======
 
 @app.get("/api/organizacoes", response_model=List[OrganizacaoSchema])
 def listar_organizacoes(
+    request: Request,
     tipo: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_leitura)
 ):
     """Listar organizações"""
     
-    query = db.query(Organizacao)
-    
-    if tipo:
-        query = query.filter(Organizacao.tipo == tipo)
+    def gerar():
+        query = db.query(Organizacao)
+        
+        if tipo:
+            query = query.filter(Organizacao.tipo == tipo)
+        
+        return [OrganizacaoSchema.model_validate(o).model_dump() for o in query.all()]
     
-    return query.all()
+    return resposta_condicional(request, db, "organizacoes", ["organizacao"], gerar)
 
 @app.get("/api/organizacoes/{org_id}/filhos", response_model=List[OrganizacaoSchema])
-def listar_filhos_organizacao(org_id: int, db: Session = Depends(get_db)):
+def listar_filhos_organizacao(org_id: int, db: Session = Depends(get_db_leitura)):
     """Listar organizações filhas"""
     
     return db.query(Organizacao).filter(Organizacao.pai_id == org_id).all()
@@ -308,22 +553,62 @@ def obter_parametros():
         "w_mnt": W_MNT
     }
 
+@app.get("/api/admin/cache")
+def obter_estatisticas_cache():
+    """Obter contadores do cache de resultados"""
+    return cache_servicos.estatisticas()
+
+@app.delete("/api/admin/cache")
+def limpar_cache():
+    """Esvaziar o cache de resultados"""
+    return {"removidos": cache_servicos.invalidar()}
+
+@app.get("/api/admin/posicoes")
+def obter_estatisticas_posicoes():
+    """Obter contadores da ingestão de posições"""
+    return buffer_posicoes.estatisticas()
+
 @app.put("/api/admin/parametros")
 def atualizar_parametros():
     """Atualizar parâmetros do sistema (placeholder)"""
     raise HTTPException(status_code=501, detail="Funcionalidade em desenvolvimento")
 
+# ====== ENDPOINTS DE POSIÇÕES ======
+
+@app.post("/api/posicoes", status_code=202)
+def receber_posicoes(pings: List[PosicaoPing]):
+    """
+    Receber posições de viaturas (AVL/GPS)
+    
+    As posições são gravadas em lote em até POSICOES_INTERVALO segundos;
+    apenas a mais recente de cada viatura é mantida.
+    """
+    aceitos, rejeitados = buffer_posicoes.registrar(pings)
+    return {"aceitos": aceitos, "rejeitados": rejeitados, "pendentes": buffer_posicoes.pendentes}
+
+@app.get("/api/posicoes/stream")
+async def stream_posicoes(request: Request):
+    """Stream (Server-Sent Events) das posições gravadas, para o mapa"""
+    return StreamingResponse(
+        buffer_posicoes.eventos(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # ====== ENDPOINTS UTILITÁRIOS ======
 
 @app.get("/api/municipios")
-def listar_municipios(db: Session = Depends(get_db)):
+def listar_municipios(request: Request, db: Session = Depends(get_db_leitura)):
     """Listar municípios únicos"""
     
-    municipios = db.query(Veiculo.municipio).distinct().all()
-    return [m[0] for m in municipios if m[0]]
+    def gerar():
+        municipios = db.query(Veiculo.municipio).distinct().order_by(Veiculo.municipio).all()
+        return [m[0] for m in municipios if m[0]]
+    
+    return resposta_condicional(request, db, "municipios", ["veiculo"], gerar)
 
 @app.get("/api/bairros")
-def listar_bairros(municipio: Optional[str] = Query(None), db: Session = Depends(get_db)):
+def listar_bairros(municipio: Optional[str] = Query(None), db: Session = Depends(get_db_leitura)):
     """Listar bairros, opcionalmente filtrados por município"""
     
     query = db.query(Veiculo.bairro).distinct()
@@ -335,11 +620,14 @@ def listar_bairros(municipio: Optional[str] = Query(None), db: Session = Depends
     return [b[0] for b in bairros if b[0]]
 
 @app.get("/api/categorias")
-def listar_categorias(db: Session = Depends(get_db)):
+def listar_categorias(request: Request, db: Session = Depends(get_db_leitura)):
     """Listar categorias de veículos"""
     
-    categorias = db.query(Veiculo.categoria).distinct().all()
-    return [c[0] for c in categorias if c[0]]
+    def gerar():
+        categorias = db.query(Veiculo.categoria).distinct().all()
+        return [c[0] for c in categorias if c[0]]
+    
+    return resposta_condicional(request, db, "categorias", ["veiculo"], gerar)
 
 if __name__ == "__main__":
     import uvicorn
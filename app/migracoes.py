@@ -0,0 +1,143 @@
+"""
+Migrações versionadas do esquema, aplicadas no startup a bancos existentes
+
+create_all só cria tabelas que ainda não existem; colunas e índices novos em
+tabelas já criadas entram por aqui. Cada migração roda uma única vez, na
+ordem da versão, em sua própria transação, e fica registrada em
+schema_migracao. Em um banco novo (já criado completo pelo create_all) as
+migrações não encontram nada a fazer e são apenas registradas.
+
+Para alterar o esquema: declarar a mudança em app.models e acrescentar uma
+Migracao com a próxima versão ao fim de MIGRACOES.
+"""
+from datetime import datetime
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import (
+    Column, DateTime, Integer, MetaData, String, Table, cast, func, inspect, insert, literal, select, text, union_all
+)
+from sqlalchemy.engine import Connection, Engine
+
+_schema_migracao = Table(
+    "schema_migracao", MetaData(),
+    Column("versao", Integer, primary_key=True),
+    Column("nome", String(100), nullable=False),
+    Column("aplicada_em", DateTime, nullable=False)
+)
+
+class Migracao(NamedTuple):
+    versao: int
+    nome: str
+    aplicar: Callable[[Connection, MetaData], None]
+
+# ====== OPERAÇÕES IDEMPOTENTES ======
+
+def adicionar_colunas(conn: Connection, tabela: Table, *nomes: str):
+    """Adiciona as colunas do modelo que ainda não existem na tabela"""
+    existentes = {c["name"] for c in inspect(conn).get_columns(tabela.name)}
+    for nome in nomes:
+        if nome not in existentes:
+            tipo = tabela.c[nome].type.compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {tabela.name} ADD COLUMN {nome} {tipo}"))
+
+def alterar_tipos(conn: Connection, tabela: Table, *nomes: str):
+    """Leva ao tipo do modelo as colunas declaradas com outro tipo no banco (o SQLite não tipa colunas)"""
+    if conn.dialect.name == "sqlite":
+        return
+    existentes = {c["name"]: c["type"].compile(dialect=conn.dialect) for c in inspect(conn).get_columns(tabela.name)}
+    for nome in nomes:
+        tipo = tabela.c[nome].type.compile(dialect=conn.dialect)
+        if existentes[nome] != tipo:
+            conn.execute(text(f"ALTER TABLE {tabela.name} ALTER COLUMN {nome} TYPE {tipo}"))
+
+def criar_indices(conn: Connection, tabela: Table, *nomes: str):
+    """Cria os índices do modelo (pelo nome) que ainda não existem"""
+    indices = {indice.name: indice for indice in tabela.indexes}
+    for nome in nomes:
+        indices[nome].create(bind=conn, checkfirst=True)
+
+# ====== MIGRAÇÕES ======
+
+def _colunas_derivadas_do_veiculo(conn: Connection, metadata: MetaData):
+    """Nota persistida, grade espacial, área, posição e versão de linha"""
+    veiculo = metadata.tables["veiculo"]
+    adicionar_colunas(
+        conn, veiculo,
+        "nota_ocupacao", "faixa_ocupacao", "geo_celula", "geo_batalhao_id", "posicao_em", "versao"
+    )
+    criar_indices(
+        conn, veiculo,
+        "ix_veiculo_nota_ocupacao", "ix_veiculo_faixa_ocupacao", "ix_veiculo_organizacao_faixa",
+        "ix_veiculo_geo_celula", "ix_veiculo_geo_batalhao_id", "ix_veiculo_versao"
+    )
+    
+    geo_viaturas = metadata.tables["geo_viaturas"]
+    adicionar_colunas(conn, geo_viaturas, "versao")
+    criar_indices(conn, geo_viaturas, "ix_geo_viaturas_versao")
+
+def _indices_de_filtros_e_detalhes(conn: Connection, metadata: MetaData):
+    """Chaves usadas pelos filtros, pela hierarquia e pelo detalhe do veículo"""
+    tabelas = metadata.tables
+    criar_indices(conn, tabelas["organizacao"], "ix_organizacao_pai_id")
+    criar_indices(conn, tabelas["veiculo"], "ix_veiculo_categoria", "ix_veiculo_municipio_bairro")
+    criar_indices(conn, tabelas["manutencao"], "ix_manutencao_veiculo_data")
+    criar_indices(conn, tabelas["uso_horas"], "ix_uso_horas_veiculo_ano_mes")
+    criar_indices(conn, tabelas["geo_viaturas"], "ix_geo_viaturas_veiculo_id")
+
+def _indices_da_janela_de_indicadores(conn: Connection, metadata: MetaData):
+    """Datas dos eventos percorridas ao aplicar a janela dos indicadores"""
+    criar_indices(conn, metadata.tables["manutencao"], "ix_manutencao_data")
+    criar_indices(conn, metadata.tables["uso_horas"], "ix_uso_horas_ano_mes")
+
+def _contador_de_versao_de_linha(conn: Connection, metadata: MetaData):
+    """Contador das versões de linha em sistema_meta (app.sincronizacao), a partir da maior já gravada"""
+    meta = metadata.tables["sistema_meta"]
+    if conn.execute(select(meta.c.chave).where(meta.c.chave == "versao_linha")).first() is not None:
+        return
+    maiores = union_all(*(
+        select(func.max(metadata.tables[tabela].c.versao))
+        for tabela in ("veiculo", "geo_viaturas", "veiculo_removido")
+    )).subquery()
+    maior = select(func.coalesce(func.max(maiores.c[0]), 0)).scalar_subquery()
+    conn.execute(insert(meta).from_select(["chave", "valor"], select(literal("versao_linha"), cast(maior, String))))
+
+def _celula_da_grade_em_64_bits(conn: Connection, metadata: MetaData):
+    """Códigos Morton da grade espacial (app.geo) passam de 2^31"""
+    alterar_tipos(conn, metadata.tables["veiculo"], "geo_celula")
+
+MIGRACOES: List[Migracao] = [
+    Migracao(1, "colunas_derivadas_do_veiculo", _colunas_derivadas_do_veiculo),
+    Migracao(2, "indices_de_filtros_e_detalhes", _indices_de_filtros_e_detalhes),
+    Migracao(3, "indices_da_janela_de_indicadores", _indices_da_janela_de_indicadores),
+    Migracao(4, "contador_de_versao_de_linha", _contador_de_versao_de_linha),
+    Migracao(5, "celula_da_grade_em_64_bits", _celula_da_grade_em_64_bits),
+]
+
+# ====== EXECUÇÃO ======
+
+def aplicar_migracoes(engine: Engine, metadata: MetaData) -> List[int]:
+    """
+    Aplica as migrações ainda não registradas no banco
+    
+    Args:
+        engine: Engine de escrita
+        metadata: Metadados dos modelos (Base.metadata)
+    
+    Returns:
+        List[int]: Versões aplicadas nesta chamada
+    """
+    with engine.begin() as conn:
+        _schema_migracao.create(bind=conn, checkfirst=True)
+        aplicadas = set(conn.execute(select(_schema_migracao.c.versao)).scalars())
+    
+    novas = []
+    for migracao in sorted(MIGRACOES, key=lambda m: m.versao):
+        if migracao.versao in aplicadas:
+            continue
+        with engine.begin() as conn:
+            migracao.aplicar(conn, metadata)
+            conn.execute(insert(_schema_migracao).values(
+                versao=migracao.versao, nome=migracao.nome, aplicada_em=datetime.utcnow()
+            ))
+        novas.append(migracao.versao)
+    return novas
@@ -1,7 +1,7 @@
 """
 Modelos SQLAlchemy para o SGV
 """
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime, Text, JSON
+from sqlalchemy import Column, BigInteger, Integer, String, Float, Boolean, ForeignKey, DateTime, Text, JSON, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.db import Base
@@ -13,7 +13,7 @@ class Organizacao(Base):
     id = Column(Integer, primary_key=True, index=True)
     nome = Column(String(100), nullable=False)
     tipo = Column(String(20), nullable=False)  # Comando, Unidade, Batalhao
-    pai_id = Column(Integer, ForeignKey("organizacao.id"), nullable=True)
+    pai_id = Column(Integer, ForeignKey("organizacao.id"), nullable=True, index=True)
     
     # Relacionamentos
     pai = relationship("Organizacao", remote_side=[id], back_populates="filhos")
@@ -27,24 +27,35 @@ class Veiculo(Base):
     id = Column(Integer, primary_key=True, index=True)
     prefixo = Column(String(20), nullable=False, unique=True)
     placa = Column(String(10), nullable=False, unique=True)
-    categoria = Column(String(30), nullable=False)  # Caminhonete, SUV, Moto, Van, etc.
+    categoria = Column(String(30), nullable=False, index=True)  # Caminhonete, SUV, Moto, Van, etc.
     organizacao_id = Column(Integer, ForeignKey("organizacao.id"), nullable=False)
     municipio = Column(String(50), nullable=False)
     bairro = Column(String(50), nullable=False)
     area_atuacao = Column(String(20), nullable=False)  # Urbana, Rural, Mista
     ativo = Column(Boolean, default=True)
     odometro_km = Column(Integer, default=0)
-    horas_mes = Column(Integer, default=0)
-    manutencoes_6m = Column(Integer, default=0)
+    horas_mes = Column(Integer, default=0)  # Mantido por app.indicadores (uso_horas)
+    manutencoes_6m = Column(Integer, default=0)  # Mantido por app.indicadores (manutencao)
     valor_fipe = Column(Float, default=0.0)
     latitude = Column(Float, nullable=True)
     longitude = Column(Float, nullable=True)
+    nota_ocupacao = Column(Integer, nullable=True, index=True)  # Mantida por services
+    faixa_ocupacao = Column(String(10), nullable=True, index=True)  # Crítico, Atenção, Adequado
+    geo_celula = Column(BigInteger, nullable=True, index=True)  # Célula da grade espacial (app.geo)
+    geo_batalhao_id = Column(Integer, ForeignKey("geo_batalhoes.id"), nullable=True, index=True)  # Área que contém a posição
+    posicao_em = Column(DateTime, nullable=True)  # Instante da última posição recebida (UTC)
+    versao = Column(Integer, nullable=True, index=True)  # Versão da última alteração (app.sincronizacao)
     created_at = Column(DateTime, server_default=func.now())
     
+    __table_args__ = (
+        Index("ix_veiculo_organizacao_faixa", "organizacao_id", "faixa_ocupacao"),
+        Index("ix_veiculo_municipio_bairro", "municipio", "bairro"),
+    )
+    
     # Relacionamentos
     organizacao = relationship("Organizacao", back_populates="veiculos")
-    manutencoes = relationship("Manutencao", back_populates="veiculo")
-    uso_horas = relationship("UsoHoras", back_populates="veiculo")
+    manutencoes = relationship("Manutencao", back_populates="veiculo", order_by="Manutencao.id")
+    uso_horas = relationship("UsoHoras", back_populates="veiculo", order_by="UsoHoras.id")
 
 class Manutencao(Base):
     """Histórico de manutenções"""
@@ -52,26 +63,55 @@ class Manutencao(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     veiculo_id = Column(Integer, ForeignKey("veiculo.id"), nullable=False)
-    data = Column(DateTime, nullable=False)
+    data = Column(DateTime, nullable=False, index=True)
     tipo = Column(String(50), nullable=False)
     custo = Column(Float, default=0.0)
     descricao = Column(Text, nullable=True)
     
+    __table_args__ = (
+        Index("ix_manutencao_veiculo_data", "veiculo_id", "data"),
+    )
+    
     # Relacionamentos
     veiculo = relationship("Veiculo", back_populates="manutencoes")
 
+class CustoManutencaoMensal(Base):
+    """Custo de manutenção mensal e acumulado por veículo (mantido por app.custos)"""
+    __tablename__ = "custo_manutencao_mensal"
+
+    veiculo_id = Column(Integer, ForeignKey("veiculo.id"), primary_key=True)
+    ano_mes = Column(String(7), primary_key=True)  # YYYY-MM
+    custo = Column(Float, nullable=False, default=0.0)
+    quantidade = Column(Integer, nullable=False, default=0)
+    custo_acumulado = Column(Float, nullable=False, default=0.0)  # Desde a primeira manutenção, inclusive o mês
+    quantidade_acumulada = Column(Integer, nullable=False, default=0)
+
 class UsoHoras(Base):
     """Controle de horas mensais"""
     __tablename__ = "uso_horas"
 
     id = Column(Integer, primary_key=True, index=True)
     veiculo_id = Column(Integer, ForeignKey("veiculo.id"), nullable=False)
-    ano_mes = Column(String(7), nullable=False)  # YYYY-MM
+    ano_mes = Column(String(7), nullable=False, index=True)  # YYYY-MM
     horas = Column(Integer, default=0)
     
+    __table_args__ = (
+        Index("ix_uso_horas_veiculo_ano_mes", "veiculo_id", "ano_mes"),
+    )
+    
     # Relacionamentos
     veiculo = relationship("Veiculo", back_populates="uso_horas")
 
+class UsoHorasMensal(Base):
+    """Horas mensais agregadas por organização e categoria (mantido por app.uso_mensal)"""
+    __tablename__ = "uso_horas_mensal"
+
+    ano_mes = Column(String(7), primary_key=True)  # YYYY-MM
+    organizacao_id = Column(Integer, ForeignKey("organizacao.id"), primary_key=True)
+    categoria = Column(String(30), primary_key=True)
+    horas = Column(Integer, nullable=False, default=0)
+    registros = Column(Integer, nullable=False, default=0)  # Linhas de uso_horas somadas
+
 class GeoBatalhoes(Base):
     """Polígonos dos batalhões por município"""
     __tablename__ = "geo_batalhoes"
@@ -95,8 +135,33 @@ class GeoViaturas(Base):
     __tablename__ = "geo_viaturas"
 
     id = Column(Integer, primary_key=True, index=True)
-    veiculo_id = Column(Integer, ForeignKey("veiculo.id"), nullable=False)
+    veiculo_id = Column(Integer, ForeignKey("veiculo.id"), nullable=False, index=True)
     geojson = Column(JSON, nullable=False)
+    versao = Column(Integer, nullable=True, index=True)  # Versão da última alteração (app.sincronizacao)
     
     # Relacionamentos
     veiculo = relationship("Veiculo")
+
+class VeiculoRemovido(Base):
+    """Veículos removidos, para a sincronização incremental do mapa"""
+    __tablename__ = "veiculo_removido"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    veiculo_id = Column(Integer, nullable=False)
+    versao = Column(Integer, nullable=False, index=True)
+    removido_em = Column(DateTime, server_default=func.now())
+
+class SistemaMeta(Base):
+    """Metadados internos do sistema (chave/valor)"""
+    __tablename__ = "sistema_meta"
+
+    chave = Column(String(50), primary_key=True)
+    valor = Column(Text, nullable=True)
+
+class VersaoTabela(Base):
+    """Versão de conteúdo de cada tabela, incrementada no commit que a altera (app.versoes)"""
+    __tablename__ = "versao_tabela"
+
+    tabela = Column(String(50), primary_key=True)
+    versao = Column(Integer, nullable=False, default=0)
+    modificado_em = Column(DateTime, nullable=False)  # UTC
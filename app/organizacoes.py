@@ -0,0 +1,118 @@
+"""
+Índice em memória da hierarquia organizacional (Comando → Unidade → Batalhão)
+"""
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.cache import ao_escrever
+from app.models import Organizacao
+
+class IndiceOrganizacoes:
+    """Árvore organizacional com conjuntos de ancestrais e descendentes pré-calculados"""
+
+    def __init__(self, linhas: Iterable[Tuple[int, str, str, Optional[int]]]):
+        """
+        Args:
+            linhas: Tuplas (id, nome, tipo, pai_id) de todas as organizações
+        """
+        self.por_id: Dict[int, Tuple[str, str, Optional[int]]] = {}
+        self.filhos: Dict[int, List[int]] = {}
+        
+        for org_id, nome, tipo, pai_id in linhas:
+            self.por_id[org_id] = (nome, tipo, pai_id)
+            self.filhos.setdefault(org_id, [])
+        for org_id, (_, _, pai_id) in self.por_id.items():
+            if pai_id in self.por_id:
+                self.filhos[pai_id].append(org_id)
+        
+        self.descendentes: Dict[int, FrozenSet[int]] = {}
+        self.ancestrais: Dict[int, FrozenSet[int]] = {}
+        # Filtros por nome já resolvidos, preenchido por app.filtros
+        self.resolucoes: Dict[Tuple[str, str, bool], Tuple[int, ...]] = {}
+        for org_id in self.por_id:
+            self._calcular_descendentes(org_id)
+            self._calcular_ancestrais(org_id)
+
+    def _calcular_descendentes(self, org_id: int) -> FrozenSet[int]:
+        """Descendentes de org_id, incluindo ele mesmo"""
+        if org_id not in self.descendentes:
+            conjunto = {org_id}
+            pilha = list(self.filhos[org_id])
+            while pilha:
+                atual = pilha.pop()
+                if atual not in conjunto:
+                    conjunto.add(atual)
+                    pilha.extend(self.filhos[atual])
+            self.descendentes[org_id] = frozenset(conjunto)
+        return self.descendentes[org_id]
+
+    def _calcular_ancestrais(self, org_id: int) -> FrozenSet[int]:
+        """Ancestrais de org_id, sem incluir ele mesmo"""
+        conjunto = set()
+        pai_id = self.por_id[org_id][2]
+        while pai_id in self.por_id and pai_id not in conjunto:
+            conjunto.add(pai_id)
+            pai_id = self.por_id[pai_id][2]
+        self.ancestrais[org_id] = frozenset(conjunto)
+        return self.ancestrais[org_id]
+
+    def descendentes_de(self, ids: Iterable[int]) -> Set[int]:
+        """Todas as organizações abaixo dos ids informados, incluindo eles"""
+        resultado = set()
+        for org_id in ids:
+            resultado |= self.descendentes.get(org_id, {org_id})
+        return resultado
+
+_indice: Optional[IndiceOrganizacoes] = None
+# Incrementada a cada invalidação: índice lido antes dela não entra no cache
+_geracao = 0
+# Protege apenas as variáveis acima; a carga síncrona usa _lock_carga
+_lock = threading.Lock()
+_lock_carga = threading.Lock()
+
+_COLUNAS = (Organizacao.id, Organizacao.nome, Organizacao.tipo, Organizacao.pai_id)
+
+def _atual() -> Tuple[Optional[IndiceOrganizacoes], int]:
+    """Índice em cache (ou None) e a geração vigente"""
+    with _lock:
+        return _indice, _geracao
+
+def _guardar(indice: IndiceOrganizacoes, geracao: int) -> IndiceOrganizacoes:
+    """Guarda o índice lido na geração informada, se nenhuma escrita o invalidou desde então"""
+    global _indice
+    with _lock:
+        if geracao == _geracao:
+            if _indice is None:
+                _indice = indice
+            return _indice
+    return indice
+
+def obter_indice(db: Session) -> IndiceOrganizacoes:
+    """Retorna o índice, carregando-o com uma única consulta se necessário"""
+    indice = _indice
+    if indice is None:
+        with _lock_carga:
+            indice, geracao = _atual()
+            if indice is None:
+                indice = _guardar(IndiceOrganizacoes(db.execute(select(*_COLUNAS)).all()), geracao)
+    return indice
+
+async def obter_indice_async(db: AsyncSession) -> IndiceOrganizacoes:
+    """Como obter_indice, aguardando a consulta no driver assíncrono (sem segurar lock)"""
+    indice, geracao = _atual()
+    if indice is None:
+        indice = _guardar(IndiceOrganizacoes((await db.execute(select(*_COLUNAS))).all()), geracao)
+    return indice
+
+@ao_escrever
+def _invalidar_indice(tabelas: Set[str]):
+    """Descarta o índice quando a tabela organizacao é alterada"""
+    global _indice, _geracao
+    if "organizacao" in tabelas:
+        with _lock:
+            _geracao += 1
+            _indice = None
@@ -0,0 +1,311 @@
+"""
+Ingestão de posições das viaturas (AVL/GPS) com gravação em lote e envio ao mapa
+
+Os pings recebidos ficam num buffer em memória que guarda apenas a última
+posição de cada veículo. Uma thread grava o buffer a cada
+POSICOES_INTERVALO segundos (ou antes, quando ele chega a POSICOES_LOTE
+veículos) numa única transação, já com célula da grade e área do batalhão,
+e publica as posições gravadas aos mapas conectados por Server-Sent Events.
+
+As gravações anotam apenas a pseudo-tabela TABELA_POSICOES, de modo que o
+cache do dashboard e as versões de "veiculo" não são invalidados a cada ping.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from fastapi import Request
+from sqlalchemy import bindparam, select, update
+
+from app.cache import anotar_escrita, ao_escrever
+from app.config import POSICOES_INTERVALO, POSICOES_LOTE, POSICOES_FILA_CLIENTE
+from app.db import SessionLocal, SessionLeitura
+from app.geo import TABELA_POSICOES, celula_grade, obter_indice_areas
+from app.sincronizacao import versao_sessao
+from app.models import Veiculo
+
+# Veículos consultados por vez ao comparar com a posição já gravada
+CONSULTA_LOTE = 500
+
+# Intervalo entre comentários de keep-alive no stream (segundos)
+HEARTBEAT = 15
+
+logger = logging.getLogger(__name__)
+
+_tabela = Veiculo.__table__
+_atualizacao = (
+    update(_tabela)
+    .where(_tabela.c.id == bindparam("vid"))
+    .values(
+        latitude=bindparam("lat"),
+        longitude=bindparam("lon"),
+        posicao_em=bindparam("instante"),
+        geo_celula=bindparam("celula"),
+        geo_batalhao_id=bindparam("area"),
+        versao=bindparam("versao")
+    )
+)
+
+def _evento(nome: str, dados: Dict) -> bytes:
+    """Mensagem SSE já serializada"""
+    return f"event: {nome}\ndata: {json.dumps(dados, separators=(',', ':'))}\n\n".encode("utf-8")
+
+def _instante_utc(instante: Optional[datetime], agora: datetime) -> datetime:
+    """Instante do ping em UTC sem fuso (como gravado no banco)"""
+    if instante is None:
+        return agora
+    if instante.tzinfo is not None:
+        return instante.astimezone(timezone.utc).replace(tzinfo=None)
+    return instante
+
+class BufferPosicoes:
+    """Buffer das últimas posições por veículo e assinantes do stream"""
+    
+    def __init__(self, intervalo: float = POSICOES_INTERVALO, lote: int = POSICOES_LOTE):
+        self.intervalo = intervalo
+        self.lote = lote
+        self._pendentes: Dict[int, Tuple[float, float, datetime]] = {}
+        self._lock = threading.Lock()
+        self._sinal = threading.Event()
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._ids: Optional[Set[int]] = None
+        self._clientes: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = set()
+        self.recebidas = 0
+        self.rejeitadas = 0
+        self.gravadas = 0
+        self.descartadas = 0
+        self.gravacoes = 0
+        self.ultima_gravacao: Optional[float] = None
+    
+    # ====== RECEBIMENTO ======
+    
+    def _ids_validos(self) -> Set[int]:
+        ids = self._ids
+        if ids is None:
+            with SessionLeitura() as db:
+                ids = self._ids = set(db.execute(select(Veiculo.id)).scalars())
+        return ids
+    
+    def invalidar_ids(self):
+        self._ids = None
+    
+    def registrar(self, pings: Iterable) -> Tuple[int, int]:
+        """
+        Coloca pings no buffer, mantendo a posição mais recente de cada veículo
+        
+        Args:
+            pings: Objetos com veiculo_id, latitude, longitude e instante
+                (sem fuso é tratado como UTC; None é o momento do recebimento)
+        
+        Returns:
+            Tuple[int, int]: (aceitos, rejeitados por veículo inexistente)
+        """
+        ids = self._ids_validos()
+        agora = datetime.utcnow()
+        aceitos = rejeitados = 0
+        
+        with self._lock:
+            for ping in pings:
+                if ping.veiculo_id not in ids:
+                    rejeitados += 1
+                    continue
+                instante = _instante_utc(ping.instante, agora)
+                atual = self._pendentes.get(ping.veiculo_id)
+                if atual is None or atual[2] <= instante:
+                    self._pendentes[ping.veiculo_id] = (ping.latitude, ping.longitude, instante)
+                aceitos += 1
+            
+            self.recebidas += aceitos
+            self.rejeitadas += rejeitados
+            cheio = len(self._pendentes) >= self.lote
+        
+        if cheio:
+            self._sinal.set()
+        return aceitos, rejeitados
+    
+    @property
+    def pendentes(self) -> int:
+        return len(self._pendentes)
+    
+    def _devolver(self, pendentes: Dict[int, Tuple[float, float, datetime]]):
+        """Devolve ao buffer um lote não gravado, sem sobrepor pings mais novos"""
+        with self._lock:
+            for veiculo_id, posicao in pendentes.items():
+                atual = self._pendentes.get(veiculo_id)
+                if atual is None or atual[2] < posicao[2]:
+                    self._pendentes[veiculo_id] = posicao
+    
+    # ====== GRAVAÇÃO EM LOTE ======
+    
+    def gravar(self) -> int:
+        """
+        Grava as posições pendentes numa única transação e publica o delta
+        
+        Pings mais antigos que a posição já gravada do veículo são descartados.
+        Se a gravação falhar, o lote volta ao buffer para a próxima tentativa.
+        
+        Returns:
+            int: Quantidade de veículos com posição atualizada
+        """
+        with self._lock:
+            pendentes, self._pendentes = self._pendentes, {}
+        if not pendentes:
+            return 0
+        
+        try:
+            linhas = self._gravar_lote(pendentes)
+        except Exception:
+            self._devolver(pendentes)
+            raise
+        
+        self.gravadas += len(linhas)
+        self.descartadas += len(pendentes) - len(linhas)
+        self.gravacoes += 1
+        self.ultima_gravacao = time.time()
+        
+        if linhas:
+            self._publicar(_evento("posicoes", {
+                "t": int(self.ultima_gravacao),
+                "v": [[l["vid"], round(l["lon"], 6), round(l["lat"], 6)] for l in linhas]
+            }))
+        return len(linhas)
+    
+    def _gravar_lote(self, pendentes: Dict[int, Tuple[float, float, datetime]]) -> list:
+        """Grava o lote numa transação e retorna as linhas gravadas"""
+        ids = list(pendentes)
+        with SessionLocal() as db:
+            gravadas_em: Dict[int, Optional[datetime]] = {}
+            for i in range(0, len(ids), CONSULTA_LOTE):
+                gravadas_em.update(db.execute(
+                    select(Veiculo.id, Veiculo.posicao_em).where(Veiculo.id.in_(ids[i:i + CONSULTA_LOTE]))
+                ).all())
+            
+            indice = obter_indice_areas(db)
+            linhas = []
+            for veiculo_id, (latitude, longitude, instante) in pendentes.items():
+                if veiculo_id not in gravadas_em:
+                    continue
+                anterior = gravadas_em[veiculo_id]
+                if anterior is not None and instante <= anterior:
+                    continue
+                linhas.append({
+                    "vid": veiculo_id,
+                    "lat": latitude,
+                    "lon": longitude,
+                    "instante": instante,
+                    "celula": celula_grade(latitude, longitude),
+                    "area": indice.localizar(latitude, longitude)
+                })
+            
+            if linhas:
+                versao = versao_sessao(db)
+                for linha in linhas:
+                    linha["versao"] = versao
+                db.execute(_atualizacao, linhas)
+                anotar_escrita(db, TABELA_POSICOES)
+                db.commit()
+        return linhas
+    
+    def _executar(self):
+        while not self._parar.is_set():
+            self._sinal.wait(self.intervalo)
+            self._sinal.clear()
+            try:
+                self.gravar()
+            except Exception:
+                logger.exception("Erro ao gravar posições (%d veículos pendentes)", len(self._pendentes))
+    
+    def iniciar(self):
+        """Inicia a thread de gravação periódica"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._executar, name="gravacao-posicoes", daemon=True)
+        self._thread.start()
+    
+    def parar(self):
+        """Encerra a thread de gravação e grava o que ainda estiver no buffer"""
+        self._parar.set()
+        self._sinal.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.gravar()
+        except Exception:
+            logger.exception("Erro ao gravar posições no encerramento (%d veículos perdidos)", len(self._pendentes))
+    
+    # ====== STREAM PARA O MAPA ======
+    
+    def _publicar(self, mensagem: bytes):
+        with self._lock:
+            clientes = list(self._clientes)
+        for loop, fila in clientes:
+            try:
+                loop.call_soon_threadsafe(self._entregar, fila, mensagem)
+            except RuntimeError:
+                # Loop encerrado: o cliente é removido ao fim do gerador
+                pass
+    
+    @staticmethod
+    def _entregar(fila: asyncio.Queue, mensagem: bytes):
+        """Enfileira para um cliente; se ele não acompanha, pede que recarregue"""
+        if fila.full():
+            while not fila.empty():
+                fila.get_nowait()
+            fila.put_nowait(_evento("resync", {"t": int(time.time())}))
+        else:
+            fila.put_nowait(mensagem)
+    
+    async def eventos(self, request: Request):
+        """Gerador do stream text/event-stream de um cliente do mapa"""
+        cliente = (asyncio.get_running_loop(), asyncio.Queue(maxsize=POSICOES_FILA_CLIENTE))
+        with self._lock:
+            self._clientes.add(cliente)
+        
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                try:
+                    mensagem = await asyncio.wait_for(cliente[1].get(), timeout=HEARTBEAT)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield b": ping\n\n"
+                    continue
+                yield mensagem
+        finally:
+            with self._lock:
+                self._clientes.discard(cliente)
+    
+    def estatisticas(self) -> Dict:
+        """Contadores da ingestão"""
+        with self._lock:
+            return {
+                "recebidas": self.recebidas,
+                "rejeitadas": self.rejeitadas,
+                "gravadas": self.gravadas,
+                "descartadas": self.descartadas,
+                "gravacoes": self.gravacoes,
+                "pendentes": len(self._pendentes),
+                "clientes": len(self._clientes),
+                "intervalo": self.intervalo,
+                "lote": self.lote,
+                "ultima_gravacao": (
+                    datetime.utcfromtimestamp(self.ultima_gravacao).isoformat() + "Z"
+                    if self.ultima_gravacao else None
+                )
+            }
+
+buffer_posicoes = BufferPosicoes()
+
+@ao_escrever
+def _invalidar_ids(tabelas):
+    """Recarrega os ids aceitos quando veículos são criados ou removidos"""
+    if "veiculo" in tabelas:
+        buffer_posicoes.invalidar_ids()
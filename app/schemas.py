@@ -1,7 +1,7 @@
 """
 Schemas Pydantic para validação de dados
 """
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 
@@ -48,6 +48,12 @@ class Veiculo(VeiculoBase):
     nota_ocupacao: Optional[int] = None
     faixa_ocupacao: Optional[str] = None
 
+class PaginaVeiculos(BaseModel):
+    """Página de veículos com cursor para a próxima página"""
+    itens: List[Dict[str, Any]]
+    proximo_cursor: Optional[str] = None
+    total: Optional[int] = None
+
 class ManutencaoBase(BaseModel):
     veiculo_id: int
     data: datetime
@@ -69,7 +75,7 @@ class UsoHorasBase(BaseModel):
     horas: int = 0
 
 class UsoHorasCreate(UsoHorasBase):
-    pass
+    ano_mes: str = Field(..., pattern=r"^\d{4}-(0[1-9]|1[0-2])$")
 
 class UsoHoras(UsoHorasBase):
     model_config = ConfigDict(from_attributes=True)
@@ -100,6 +106,25 @@ class GeoViaturasCreate(BaseModel):
     veiculo_id: int
     geojson: Dict[str, Any]
 
+class PosicaoPing(BaseModel):
+    veiculo_id: int
+    latitude: float = Field(..., ge=-90, le=90)
+    longitude: float = Field(..., ge=-180, le=180)
+    instante: Optional[datetime] = None  # Padrão: momento do recebimento
+
+class ContagemArea(BaseModel):
+    area_id: int
+    batalhao_nome: str
+    municipio: str
+    viaturas: int
+    ativas: int
+    de_outros_batalhoes: int  # Viaturas na área que pertencem a outro batalhão
+
+class ResumoAreas(BaseModel):
+    areas: List[ContagemArea]
+    sem_area: int  # Viaturas com posição fora de qualquer área cadastrada
+    fora_da_propria_area: int
+
 # Dashboard schemas
 class KPIs(BaseModel):
     frota_total: int
@@ -124,13 +149,20 @@ class FipeCategoria(BaseModel):
     valor_fipe_medio: float
     valor_fipe_total: float
 
+class CustoCategoria(BaseModel):
+    categoria: str
+    custo_total: float  # Todas as manutenções registradas
+    custo_12m: float
+    custo_12m_medio: float  # Por veículo
+    custo_por_km: float  # Custo total / km rodados da categoria
+
 class TopVeiculo(BaseModel):
     id: int
     prefixo: str
     placa: str
     categoria: str
     organizacao_nome: str
-    valor: int  # odometro_km, horas_mes ou manutencoes_6m
+    valor: int  # odometro_km, horas_mes, manutencoes_6m ou custo em 12 meses (R$)
 
 class Recomendacao(BaseModel):
     veiculo_id: int
@@ -140,7 +172,43 @@ class Recomendacao(BaseModel):
     organizacao_nome: str
     motivo: str
     impacto: str
-    nota_ocupacao: int
+    nota_ocupacao: Optional[int] = None
+
+class PontoCusto(BaseModel):
+    ano_mes: str  # YYYY-MM
+    custo: float
+    manutencoes: int
+    custo_acumulado: float
+
+class CustosVeiculo(BaseModel):
+    veiculo_id: int
+    custo_total: float
+    manutencoes_total: int
+    custo_por_km: Optional[float] = None  # None sem odômetro
+    meses: int  # Tamanho da janela
+    custo_janela: float
+    manutencoes_janela: int
+    custo_mensal_medio: float  # Na janela
+    serie: List[PontoCusto]  # Meses com manutenção dentro da janela
+
+class PontoUsoHoras(BaseModel):
+    ano_mes: str  # YYYY-MM
+    categoria: Optional[str] = None  # Apenas quando agrupado por categoria
+    horas: int
+    registros: int
+    media_horas: float
+
+class DashboardResumo(BaseModel):
+    """Painéis do dashboard; apenas os solicitados vêm preenchidos"""
+    kpis: Optional[KPIs] = None
+    vida_util_por_categoria: Optional[List[VidaUtilCategoria]] = None
+    fipe_por_categoria: Optional[List[FipeCategoria]] = None
+    top_rodados: Optional[List[TopVeiculo]] = None
+    top_horas: Optional[List[TopVeiculo]] = None
+    top_manutencoes: Optional[List[TopVeiculo]] = None
+    custo_por_categoria: Optional[List[CustoCategoria]] = None
+    top_custos: Optional[List[TopVeiculo]] = None
+    recomendacoes: Optional[List[Recomendacao]] = None
 
 class NotaOcupacao(BaseModel):
     nota: int
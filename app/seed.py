@@ -6,6 +6,9 @@ from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 
 from app.db import engine, SessionLocal, create_tables
+from app.indicadores import reconstruir_indicadores
+from app.uso_mensal import reconstruir_uso_mensal
+from app.custos import reconstruir_custos
 from app.models import (
     Organizacao, Veiculo, Manutencao, UsoHoras, 
     GeoBatalhoes, GeoBases, GeoViaturas
@@ -101,6 +104,11 @@ def create_seed_data():
         
         veiculos = []
         
+        # Valores sorteados por prefixo: horas_mes e manutencoes_6m são
+        # derivados dos eventos e zerados pelo primeiro flush de manutenções
+        horas_sorteadas = {}
+        manutencoes_sorteadas = {}
+        
         # Coordenadas de exemplo (região de SP)
         coordenadas_base = [
             (-23.550520, -46.633308),  # Centro SP
@@ -129,8 +137,10 @@ def create_seed_data():
             lat = lat_base + random.uniform(-0.05, 0.05)
             lng = lng_base + random.uniform(-0.05, 0.05)
             
+            prefixo = f"PM-{i+1:03d}"
+            
             veiculo = Veiculo(
-                prefixo=f"PM-{i+1:03d}",
+                prefixo=prefixo,
                 placa=f"ABC{i+1000}",
                 categoria=categoria,
                 organizacao_id=batalhao.id,
@@ -139,13 +149,13 @@ def create_seed_data():
                 area_atuacao=random.choice(areas_atuacao),
                 ativo=random.choice([True, True, True, False]),  # 75% ativos
                 odometro_km=odometro,
-                horas_mes=random.randint(80, 200),
-                manutencoes_6m=random.randint(0, 8),
                 valor_fipe=random.uniform(30000, 150000),
                 latitude=lat,
                 longitude=lng
             )
             
+            horas_sorteadas[prefixo] = random.randint(80, 200)
+            manutencoes_sorteadas[prefixo] = random.randint(0, 8)
             veiculos.append(veiculo)
         
         db.add_all(veiculos)
@@ -162,8 +172,8 @@ def create_seed_data():
         
         manutencoes = []
         for veiculo in veiculos:
-            # Criar histórico de manutenções baseado no campo manutencoes_6m
-            num_manutencoes = max(1, veiculo.manutencoes_6m + random.randint(-2, 3))
+            # Criar histórico de manutenções a partir do valor sorteado para manutencoes_6m
+            num_manutencoes = max(1, manutencoes_sorteadas[veiculo.prefixo] + random.randint(-2, 3))
             
             for j in range(num_manutencoes):
                 data_manutencao = datetime.now() - timedelta(days=random.randint(1, 365))
@@ -191,10 +201,11 @@ def create_seed_data():
                 ano_mes = data_ref.strftime("%Y-%m")
                 
                 # Variar as horas com tendência baseada no mês atual
+                horas_mes = horas_sorteadas[veiculo.prefixo]
                 if mes_offset == 0:
-                    horas = veiculo.horas_mes
+                    horas = horas_mes
                 else:
-                    horas = max(0, veiculo.horas_mes + random.randint(-30, 30))
+                    horas = max(0, horas_mes + random.randint(-30, 30))
                 
                 uso = UsoHoras(
                     veiculo_id=veiculo.id,
@@ -363,6 +374,11 @@ def create_seed_data():
         
         db.commit()
         
+        # manutencoes_6m, horas_mes, a série mensal e os custos passam a refletir o histórico criado
+        reconstruir_indicadores(db)
+        reconstruir_uso_mensal(db)
+        reconstruir_custos(db)
+        
         print(f"✅ Seed concluído com sucesso!")
         print(f"   - {len(batalhoes)} batalhões criados")
         print(f"   - {len(veiculos)} veículos criados")
@@ -1,13 +1,34 @@
 """
 Regras de negócio e serviços do SGV
 """
-from typing import Dict, List, Optional, Tuple
+import base64
+import hashlib
+import heapq
+import json
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
-from app.models import Veiculo, Organizacao, Manutencao, UsoHoras, GeoBatalhoes, GeoBases, GeoViaturas
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import (
+    func, desc, case, cast, Integer, Float, select, union, update, event, inspect, tuple_, bindparam, or_, and_
+)
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.functions import GenericFunction
+from sqlalchemy.sql.elements import ColumnElement
+from app.cache import cache_resultado
+from app.custos import acumulado_ate, custo_janela, deslocar_mes, mes_atual
+from app.filtros import consulta_veiculos
+from app.geo import NIVEL_GRADE, TABELA_POSICOES, nivel_agrupamento
+from app.organizacoes import IndiceOrganizacoes, obter_indice, obter_indice_async
+from app.sincronizacao import versao_estavel, versao_estavel_async, versao_sessao
+from app.models import (
+    Veiculo, Organizacao, Manutencao, CustoManutencaoMensal, UsoHoras, UsoHorasMensal, GeoBatalhoes,
+    GeoBases, GeoViaturas, SistemaMeta, VeiculoRemovido
+)
 from app.schemas import (
     KPIs, VidaUtilCategoria, FipeCategoria, TopVeiculo, 
-    Recomendacao, NotaOcupacao, GeoJSONFeatureCollection
+    Recomendacao, NotaOcupacao, DashboardResumo, PaginaVeiculos, ContagemArea, ResumoAreas, PontoUsoHoras,
+    CustoCategoria, CustosVeiculo, PontoCusto
 )
 
 # Parâmetros do cálculo da Nota de Ocupação
@@ -44,235 +65,706 @@ def calcular_nota_ocupacao(veiculo: Veiculo) -> Tuple[int, str]:
     Returns:
         Tuple[int, str]: (nota, faixa)
     """
+    notas, faixas = calcular_notas_veiculos([veiculo])
+    return notas[0], faixas[0]
+
+def faixa_ocupacao(nota: int) -> str:
+    """Determina a faixa (Crítico, Atenção, Adequado) de uma nota"""
+    if nota < 60:
+        return "Crítico"
+    elif nota < 80:
+        return "Atenção"
+    return "Adequado"
+
+def calcular_notas_ocupacao(
+    categorias: Sequence[str],
+    odometros_km: Sequence[int],
+    manutencoes_6m: Sequence[int],
+    areas_atuacao: Sequence[str]
+) -> Tuple[List[int], List[str]]:
+    """
+    Calcula a Nota de Ocupação de toda a frota em lote
+    
+    Recebe as colunas do veículo como sequências paralelas e aplica cada
+    etapa da fórmula sobre a coluna inteira, sem instanciar objetos ORM.
+    É a única implementação da fórmula em Python (calcular_nota_ocupacao
+    delega a ela); nota_ocupacao_expr é a equivalente em SQL.
+    
+    Args:
+        categorias: Categoria de cada veículo
+        odometros_km: Odômetro de cada veículo
+        manutencoes_6m: Manutenções nos últimos 6 meses de cada veículo
+        areas_atuacao: Área de atuação de cada veículo
+        
+    Returns:
+        Tuple[List[int], List[str]]: (notas, faixas) na ordem de entrada
+    """
     # Normalização da quilometragem
-    km_ref = KM_REFERENCIA_CATEGORIA.get(veiculo.categoria, 250_000)
-    km_norm = min(veiculo.odometro_km / km_ref, 1.0)
+    km_refs = [KM_REFERENCIA_CATEGORIA.get(c, 250_000) for c in categorias]
+    km_norm = [min(km / ref, 1.0) for km, ref in zip(odometros_km, km_refs)]
     
     # Normalização das manutenções
-    mnt_norm = min(veiculo.manutencoes_6m / MNT_MAX_6M, 1.0)
+    mnt_norm = [min(m / MNT_MAX_6M, 1.0) for m in manutencoes_6m]
     
     # Fator da área de atuação
-    area_fator = AREA_FATOR.get(veiculo.area_atuacao, 1.0)
+    fatores = [AREA_FATOR.get(a, 1.0) for a in areas_atuacao]
+    
+    # Cálculo do desgaste e nota final (0-100)
+    notas = [
+        round(max(0, min(100, 100 * (1 - (W_KM * k + W_MNT * m) * f))))
+        for k, m, f in zip(km_norm, mnt_norm, fatores)
+    ]
+    
+    return notas, [faixa_ocupacao(n) for n in notas]
+
+def calcular_notas_veiculos(veiculos: Sequence) -> Tuple[List[int], List[str]]:
+    """Atalho de calcular_notas_ocupacao para linhas ou instâncias de veículo"""
+    return calcular_notas_ocupacao(
+        [v.categoria for v in veiculos],
+        [v.odometro_km or 0 for v in veiculos],
+        [v.manutencoes_6m or 0 for v in veiculos],
+        [v.area_atuacao for v in veiculos]
+    )
+
+def km_referencia_expr() -> ColumnElement:
+    """Expressão SQL da quilometragem de referência da categoria"""
+    return case(
+        *[(Veiculo.categoria == cat, ref) for cat, ref in KM_REFERENCIA_CATEGORIA.items()],
+        else_=250_000
+    )
+
+class menor(GenericFunction):
+    """Menor de dois valores: least() no PostgreSQL, min() escalar no SQLite"""
+    type = Float()
+    name = "least"
+    inherit_cache = True
+
+class maior(GenericFunction):
+    """Maior de dois valores: greatest() no PostgreSQL, max() escalar no SQLite"""
+    type = Float()
+    name = "greatest"
+    inherit_cache = True
+
+class piso(GenericFunction):
+    """Parte inteira de um valor não negativo, como inteiro: CAST(floor()) no PostgreSQL, CAST no SQLite"""
+    type = Integer()
+    name = "floor"
+    inherit_cache = True
+
+@compiles(menor, "sqlite")
+def _menor_sqlite(elemento, compiler, **kw):
+    return f"min({compiler.process(elemento.clauses, **kw)})"
+
+@compiles(maior, "sqlite")
+def _maior_sqlite(elemento, compiler, **kw):
+    return f"max({compiler.process(elemento.clauses, **kw)})"
+
+@compiles(piso)
+def _piso(elemento, compiler, **kw):
+    # floor() devolve double precision; o módulo do desempate exige inteiro
+    return f"CAST(floor({compiler.process(elemento.clauses, **kw)}) AS INTEGER)"
+
+@compiles(piso, "sqlite")
+def _piso_sqlite(elemento, compiler, **kw):
+    return f"CAST({compiler.process(elemento.clauses, **kw)} AS INTEGER)"
+
+def nota_ocupacao_expr() -> ColumnElement:
+    """
+    Expressão SQL equivalente a calcular_notas_ocupacao
+    
+    Reproduz a mesma sequência de operações em ponto flutuante e o
+    arredondamento bancário do round() do Python, de modo que o valor
+    calculado pelo banco seja idêntico ao calculado em Python. Mínimo,
+    máximo e piso são compilados conforme o dialeto (menor, maior, piso).
+    
+    Returns:
+        ColumnElement: expressão inteira com a nota (0-100)
+    """
+    # Normalização da quilometragem
+    km_ref = km_referencia_expr()
+    km_norm = menor(cast(func.coalesce(Veiculo.odometro_km, 0), Float) / km_ref, 1.0)
+    
+    # Normalização das manutenções
+    mnt_norm = menor(cast(func.coalesce(Veiculo.manutencoes_6m, 0), Float) / MNT_MAX_6M, 1.0)
+    
+    # Fator da área de atuação
+    area_fator = case(
+        *[(Veiculo.area_atuacao == area, fator) for area, fator in AREA_FATOR.items()],
+        else_=1.0
+    )
     
-    # Cálculo do desgaste
     desgaste = (W_KM * km_norm + W_MNT * mnt_norm) * area_fator
+    valor = maior(0, menor(100, 100 * (1 - desgaste)))
     
-    # Nota final (0-100)
-    nota = round(max(0, min(100, 100 * (1 - desgaste))))
+    # round() do Python arredonda empates para o par mais próximo
+    inteiro = piso(valor)
+    fracao = valor - inteiro
+    return case(
+        (fracao > 0.5, inteiro + 1),
+        (fracao < 0.5, inteiro),
+        else_=inteiro + inteiro % 2
+    )
+
+def faixa_ocupacao_expr(nota: ColumnElement) -> ColumnElement:
+    """Expressão SQL equivalente a faixa_ocupacao"""
+    return case(
+        (nota < 60, "Crítico"),
+        (nota < 80, "Atenção"),
+        else_="Adequado"
+    )
+
+# ====== NOTA PERSISTIDA ======
+
+# Campos do veículo que entram na fórmula da nota
+CAMPOS_NOTA = ("categoria", "odometro_km", "manutencoes_6m", "area_atuacao")
+
+def assinatura_parametros() -> str:
+    """Assinatura dos parâmetros da fórmula, usada para detectar mudanças"""
+    parametros = {
+        "km_referencia": KM_REFERENCIA_CATEGORIA,
+        "mnt_max_6m": MNT_MAX_6M,
+        "area_fator": AREA_FATOR,
+        "w_km": W_KM,
+        "w_mnt": W_MNT
+    }
+    return hashlib.sha1(json.dumps(parametros, sort_keys=True).encode()).hexdigest()
+
+@event.listens_for(Session, "before_flush")
+def _atualizar_notas_alteradas(session, flush_context, instances):
+    """Recalcula a nota apenas dos veículos novos ou com campos da fórmula alterados"""
     
-    # Determinação da faixa
-    if nota < 60:
-        faixa = "Crítico"
-    elif nota < 80:
-        faixa = "Atenção"
-    else:
-        faixa = "Adequado"
+    veiculos = [obj for obj in session.new if isinstance(obj, Veiculo)]
+    veiculos += [
+        obj for obj in session.dirty
+        if isinstance(obj, Veiculo) and any(
+            inspect(obj).attrs[campo].history.has_changes() for campo in CAMPOS_NOTA
+        )
+    ]
     
-    return nota, faixa
+    if veiculos:
+        notas, faixas = calcular_notas_veiculos(veiculos)
+        for veiculo, nota, faixa in zip(veiculos, notas, faixas):
+            veiculo.nota_ocupacao = nota
+            veiculo.faixa_ocupacao = faixa
 
-def get_kpis(db: Session) -> KPIs:
-    """Calcula os KPIs principais do dashboard"""
+def recalcular_notas(db: Session, *criterios) -> int:
+    """
+    Recalcula as notas persistidas diretamente no banco
     
-    # Frota total
-    frota_total = db.query(Veiculo).count()
+    Args:
+        db: Sessão do banco
+        *criterios: Filtros opcionais sobre Veiculo; sem filtros, toda a frota
+        
+    Returns:
+        int: Quantidade de veículos atualizados
+    """
+    nota = nota_ocupacao_expr()
+    resultado = db.execute(
+        update(Veiculo)
+        .where(*criterios)
+        .values(nota_ocupacao=nota, faixa_ocupacao=faixa_ocupacao_expr(nota), versao=versao_sessao(db))
+        .execution_options(synchronize_session=False)
+    )
+    return resultado.rowcount
+
+def sincronizar_notas(db: Session) -> int:
+    """
+    Garante que as notas persistidas estão de acordo com os parâmetros atuais
     
-    # Percentual de ativos
-    ativos = db.query(Veiculo).filter(Veiculo.ativo == True).count()
-    pct_ativos = (ativos / frota_total * 100) if frota_total > 0 else 0
+    Recalcula toda a frota quando os parâmetros mudaram desde o último
+    cálculo; caso contrário, apenas os veículos ainda sem nota.
     
-    # Vida útil média (nota de ocupação)
-    veiculos = db.query(Veiculo).all()
-    if veiculos:
-        notas = [calcular_nota_ocupacao(v)[0] for v in veiculos]
-        vida_util_media = sum(notas) / len(notas)
-    else:
-        vida_util_media = 0
+    Returns:
+        int: Quantidade de veículos recalculados
+    """
+    assinatura = assinatura_parametros()
+    meta = db.get(SistemaMeta, "parametros_nota")
     
-    # Total de horas no mês
-    horas_mes_total = db.query(func.sum(Veiculo.horas_mes)).scalar() or 0
+    if meta is None or meta.valor != assinatura:
+        atualizados = recalcular_notas(db)
+        db.merge(SistemaMeta(chave="parametros_nota", valor=assinatura))
+    else:
+        atualizados = recalcular_notas(db, Veiculo.nota_ocupacao.is_(None))
     
-    return KPIs(
-        frota_total=frota_total,
-        pct_ativos=round(pct_ativos, 1),
-        vida_util_media=round(vida_util_media, 1),
-        horas_mes_total=horas_mes_total
+    db.commit()
+    return atualizados
+
+# ====== DASHBOARD ======
+
+# Painéis disponíveis no resumo do dashboard
+CAMPOS_DASHBOARD = (
+    "kpis", "vida_util_por_categoria", "fipe_por_categoria",
+    "top_rodados", "top_horas", "top_manutencoes",
+    "custo_por_categoria", "top_custos", "recomendacoes"
+)
+
+# Janela, em meses, dos custos do dashboard e da economia das recomendações
+JANELA_CUSTO_MESES = 12
+
+# Painéis que leem os custos acumulados de manutenção
+CAMPOS_CUSTO = {"custo_por_categoria", "top_custos", "recomendacoes"}
+
+# Listas TOP: painel -> coluna ordenada
+COLUNAS_TOP = {
+    "top_rodados": "odometro_km",
+    "top_horas": "horas_mes",
+    "top_manutencoes": "manutencoes_6m",
+    "top_custos": "custo_12m"
+}
+
+# Linhas da frota lidas por vez do cursor
+DASHBOARD_LINHAS_POR_LOTE = 1000
+
+def _consulta_dashboard(campos: set) -> Select:
+    """Leitura única da frota com as colunas usadas pelos painéis"""
+    colunas = [
+        Veiculo.id, Veiculo.prefixo, Veiculo.placa, Veiculo.categoria,
+        Veiculo.ativo, Veiculo.odometro_km, Veiculo.horas_mes,
+        Veiculo.manutencoes_6m, Veiculo.valor_fipe,
+        Veiculo.nota_ocupacao, Veiculo.faixa_ocupacao,
+        Organizacao.nome.label("organizacao_nome")
+    ]
+    if campos & CAMPOS_CUSTO:
+        # Duas buscas por veículo na tabela de custos acumulados
+        colunas += [
+            acumulado_ate(mes_atual()).label("custo_total"),
+            custo_janela(JANELA_CUSTO_MESES).label("custo_12m")
+        ]
+    return (
+        select(*colunas)
+        .outerjoin(Organizacao, Veiculo.organizacao_id == Organizacao.id)
+        .execution_options(yield_per=DASHBOARD_LINHAS_POR_LOTE)
     )
 
-def get_vida_util_por_categoria(db: Session) -> List[VidaUtilCategoria]:
-    """Calcula vida útil média por categoria com informações detalhadas"""
+class _PassadaDashboard:
+    """
+    Painéis do dashboard acumulados numa única passada pelas linhas da frota
+    
+    As linhas chegam em lotes do cursor e não são guardadas: ficam apenas
+    os acumuladores por categoria, as listas TOP (heaps limitados a limit)
+    e as recomendações.
+    """
+    
+    def __init__(self, campos: set, limit: int):
+        self.campos = campos
+        self.limit = limit
+        self.custos = bool(campos & CAMPOS_CUSTO)
+        self.por_categoria: Dict[str, Dict[str, float]] = {}
+        # Heap mínimo de (valor, -id, linha): o topo é o primeiro a sair
+        self.tops = {campo: [] for campo in COLUNAS_TOP if campo in campos}
+        self.recomendacoes = []
     
-    categorias = db.query(Veiculo.categoria).distinct().all()
-    resultado = []
+    def adicionar(self, v):
+        acc = self.por_categoria.get(v.categoria)
+        if acc is None:
+            acc = self.por_categoria[v.categoria] = {
+                "total": 0, "ativos": 0, "notas": 0, "com_nota": 0,
+                "Crítico": 0, "Atenção": 0, "Adequado": 0,
+                "km": 0, "horas": 0, "manutencoes": 0, "fipe": 0.0,
+                "custo_total": 0.0, "custo_12m": 0.0
+            }
+        acc["total"] += 1
+        acc["ativos"] += 1 if v.ativo else 0
+        if v.nota_ocupacao is not None:
+            acc["notas"] += v.nota_ocupacao
+            acc["com_nota"] += 1
+            acc[v.faixa_ocupacao] += 1
+        acc["km"] += v.odometro_km or 0
+        acc["horas"] += v.horas_mes or 0
+        acc["manutencoes"] += v.manutencoes_6m or 0
+        acc["fipe"] += v.valor_fipe or 0.0
+        if self.custos:
+            acc["custo_total"] += v.custo_total
+            acc["custo_12m"] += v.custo_12m
+        
+        # Maior valor primeiro; empates pelo menor id
+        for campo, heap in self.tops.items():
+            item = (getattr(v, COLUNAS_TOP[campo]) or 0, -v.id, v)
+            if len(heap) < self.limit:
+                heapq.heappush(heap, item)
+            elif item[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, item)
+        
+        if "recomendacoes" in self.campos:
+            recomendacao = _avaliar_descarte(v)
+            if recomendacao:
+                self.recomendacoes.append(recomendacao)
     
-    for (categoria,) in categorias:
-        veiculos = db.query(Veiculo).filter(Veiculo.categoria == categoria).all()
+    def resumo(self) -> DashboardResumo:
+        campos = self.campos
+        categorias = sorted(self.por_categoria.items())
+        resumo = DashboardResumo()
         
-        if veiculos:
-            # Calcular notas de ocupação e estatísticas básicas
-            notas_e_faixas = [calcular_nota_ocupacao(v) for v in veiculos]
-            notas = [nota for nota, _ in notas_e_faixas]
-            faixas = [faixa for _, faixa in notas_e_faixas]
-            
-            # Estatísticas gerais
-            total_veiculos = len(veiculos)
-            veiculos_ativos = sum(1 for v in veiculos if v.ativo)
-            nota_media = sum(notas) / len(notas)
-            
-            # Contagem por faixa de vida útil
-            veiculos_criticos = sum(1 for faixa in faixas if faixa == "Crítico")
-            veiculos_atencao = sum(1 for faixa in faixas if faixa == "Atenção")
-            veiculos_adequados = sum(1 for faixa in faixas if faixa == "Adequado")
+        if "kpis" in campos:
+            frota_total = sum(acc["total"] for _, acc in categorias)
+            ativos = sum(acc["ativos"] for _, acc in categorias)
+            com_nota = sum(acc["com_nota"] for _, acc in categorias)
+            notas = sum(acc["notas"] for _, acc in categorias)
             
-            # Médias de uso
-            km_media = sum(v.odometro_km for v in veiculos) / total_veiculos
-            horas_mes_media = sum(v.horas_mes for v in veiculos) / total_veiculos
-            manutencoes_6m_media = sum(v.manutencoes_6m for v in veiculos) / total_veiculos
-            
-            resultado.append(VidaUtilCategoria(
-                categoria=categoria,
-                nota_media=round(nota_media, 1),
-                total_veiculos=total_veiculos,
-                veiculos_ativos=veiculos_ativos,
-                veiculos_criticos=veiculos_criticos,
-                veiculos_atencao=veiculos_atencao,
-                veiculos_adequados=veiculos_adequados,
-                km_media=round(km_media, 0),
-                horas_mes_media=round(horas_mes_media, 1),
-                manutencoes_6m_media=round(manutencoes_6m_media, 1)
-            ))
-    
-    return sorted(resultado, key=lambda x: x.nota_media, reverse=True)
+            resumo.kpis = KPIs(
+                frota_total=frota_total,
+                pct_ativos=round((ativos / frota_total * 100) if frota_total > 0 else 0, 1),
+                vida_util_media=round(notas / com_nota if com_nota else 0, 1),
+                horas_mes_total=sum(acc["horas"] for _, acc in categorias)
+            )
+        
+        if "vida_util_por_categoria" in campos:
+            resumo.vida_util_por_categoria = sorted(
+                [
+                    VidaUtilCategoria(
+                        categoria=categoria,
+                        nota_media=round(acc["notas"] / acc["com_nota"] if acc["com_nota"] else 0, 1),
+                        total_veiculos=acc["total"],
+                        veiculos_ativos=acc["ativos"],
+                        veiculos_criticos=acc["Crítico"],
+                        veiculos_atencao=acc["Atenção"],
+                        veiculos_adequados=acc["Adequado"],
+                        km_media=round(acc["km"] / acc["total"], 0),
+                        horas_mes_media=round(acc["horas"] / acc["total"], 1),
+                        manutencoes_6m_media=round(acc["manutencoes"] / acc["total"], 1)
+                    )
+                    for categoria, acc in categorias
+                ],
+                key=lambda x: x.nota_media,
+                reverse=True
+            )
+        
+        if "fipe_por_categoria" in campos:
+            resumo.fipe_por_categoria = [
+                FipeCategoria(
+                    categoria=categoria,
+                    valor_fipe_medio=round(acc["fipe"] / acc["total"], 2),
+                    valor_fipe_total=round(acc["fipe"], 2)
+                )
+                for categoria, acc in categorias
+            ]
+        
+        if "custo_por_categoria" in campos:
+            resumo.custo_por_categoria = [
+                CustoCategoria(
+                    categoria=categoria,
+                    custo_total=round(acc["custo_total"], 2),
+                    custo_12m=round(acc["custo_12m"], 2),
+                    custo_12m_medio=round(acc["custo_12m"] / acc["total"], 2),
+                    custo_por_km=round(acc["custo_total"] / acc["km"], 4) if acc["km"] else 0.0
+                )
+                for categoria, acc in categorias
+            ]
+        
+        for campo, heap in self.tops.items():
+            setattr(resumo, campo, [
+                TopVeiculo(
+                    id=v.id,
+                    prefixo=v.prefixo,
+                    placa=v.placa,
+                    categoria=v.categoria,
+                    organizacao_nome=v.organizacao_nome,
+                    valor=round(valor)
+                )
+                for valor, _, v in sorted(heap, reverse=True)
+            ])
+        
+        if "recomendacoes" in campos:
+            # Ordenar por prioridade (nota mais baixa primeiro, sem nota por último)
+            resumo.recomendacoes = sorted(
+                self.recomendacoes, key=lambda x: (x.nota_ocupacao is None, x.nota_ocupacao or 0)
+            )
+        
+        return resumo
+
+@cache_resultado("veiculo", "organizacao", "custo_manutencao_mensal")
+def get_dashboard_resumo(
+    db: Session,
+    campos: Optional[Sequence[str]] = None,
+    limit: int = 10
+) -> DashboardResumo:
+    """
+    Monta os painéis do dashboard a partir de uma única leitura da frota
+    
+    Args:
+        db: Sessão do banco
+        campos: Painéis desejados (ver CAMPOS_DASHBOARD); None para todos
+        limit: Tamanho das listas TOP
+        
+    Returns:
+        DashboardResumo: apenas os painéis solicitados preenchidos
+    """
+    campos = set(campos or CAMPOS_DASHBOARD)
+    passada = _PassadaDashboard(campos, limit)
+    for v in db.execute(_consulta_dashboard(campos)):
+        passada.adicionar(v)
+    return passada.resumo()
+
+def _avaliar_descarte(veiculo) -> Optional[Recomendacao]:
+    """Aplica as regras de descarte a um veículo e retorna a recomendação, se houver"""
+    
+    # Campos nulos (veículo ainda sem nota ou sem dados) não disparam regras
+    nota = veiculo.nota_ocupacao
+    manutencoes = veiculo.manutencoes_6m or 0
+    odometro = veiculo.odometro_km or 0
+    motivos = []
+    
+    # Regra 1: Nota baixa
+    if nota is not None and nota < 50:
+        motivos.append(f"Nota de ocupação crítica ({nota})")
+    
+    # Regra 2: Muitas manutenções
+    if manutencoes >= 5:
+        motivos.append(f"Excesso de manutenções ({manutencoes} em 6 meses)")
+    
+    # Regra 3: Alta quilometragem
+    km_ref = KM_REFERENCIA_CATEGORIA.get(veiculo.categoria, 250_000)
+    if odometro >= 0.9 * km_ref:
+        pct_km = (odometro / km_ref) * 100
+        motivos.append(f"Alta quilometragem ({pct_km:.1f}% da vida útil)")
+    
+    if not motivos:
+        return None
+    
+    # Economia estimada: custo real de manutenção dos últimos 12 meses,
+    # limitado a 30% do valor FIPE
+    economia = min(veiculo.custo_12m or 0.0, (veiculo.valor_fipe or 0.0) * 0.3)
+    
+    return Recomendacao(
+        veiculo_id=veiculo.id,
+        prefixo=veiculo.prefixo,
+        placa=veiculo.placa,
+        categoria=veiculo.categoria,
+        organizacao_nome=veiculo.organizacao_nome,
+        motivo="; ".join(motivos),
+        impacto=f"Economia estimada: R$ {economia:,.2f}/ano",
+        nota_ocupacao=nota
+    )
+
+def get_kpis(db: Session) -> KPIs:
+    """Calcula os KPIs principais do dashboard"""
+    return get_dashboard_resumo(db, ["kpis"]).kpis
+
+def get_vida_util_por_categoria(db: Session) -> List[VidaUtilCategoria]:
+    """Calcula vida útil média por categoria com informações detalhadas"""
+    return get_dashboard_resumo(db, ["vida_util_por_categoria"]).vida_util_por_categoria
 
 def get_fipe_por_categoria(db: Session) -> List[FipeCategoria]:
     """Calcula valores FIPE por categoria"""
-    
-    resultado = db.query(
-        Veiculo.categoria,
-        func.avg(Veiculo.valor_fipe).label('valor_medio'),
-        func.sum(Veiculo.valor_fipe).label('valor_total')
-    ).group_by(Veiculo.categoria).all()
-    
-    return [
-        FipeCategoria(
-            categoria=categoria,
-            valor_fipe_medio=round(valor_medio, 2),
-            valor_fipe_total=round(valor_total, 2)
-        )
-        for categoria, valor_medio, valor_total in resultado
-    ]
+    return get_dashboard_resumo(db, ["fipe_por_categoria"]).fipe_por_categoria
 
 def get_top_rodados(db: Session, limit: int = 10) -> List[TopVeiculo]:
     """Top veículos mais rodados"""
-    
-    veiculos = db.query(Veiculo).join(Organizacao)\
-        .order_by(desc(Veiculo.odometro_km))\
-        .limit(limit).all()
-    
-    return [
-        TopVeiculo(
-            id=v.id,
-            prefixo=v.prefixo,
-            placa=v.placa,
-            categoria=v.categoria,
-            organizacao_nome=v.organizacao.nome,
-            valor=v.odometro_km
-        )
-        for v in veiculos
-    ]
+    return get_dashboard_resumo(db, ["top_rodados"], limit).top_rodados
 
 def get_top_horas(db: Session, limit: int = 10) -> List[TopVeiculo]:
     """Top veículos com mais horas no mês"""
-    
-    veiculos = db.query(Veiculo).join(Organizacao)\
-        .order_by(desc(Veiculo.horas_mes))\
-        .limit(limit).all()
-    
-    return [
-        TopVeiculo(
-            id=v.id,
-            prefixo=v.prefixo,
-            placa=v.placa,
-            categoria=v.categoria,
-            organizacao_nome=v.organizacao.nome,
-            valor=v.horas_mes
-        )
-        for v in veiculos
-    ]
+    return get_dashboard_resumo(db, ["top_horas"], limit).top_horas
 
 def get_top_manutencoes(db: Session, limit: int = 10) -> List[TopVeiculo]:
     """Top veículos com mais manutenções nos últimos 6 meses"""
-    
-    veiculos = db.query(Veiculo).join(Organizacao)\
-        .order_by(desc(Veiculo.manutencoes_6m))\
-        .limit(limit).all()
-    
-    return [
-        TopVeiculo(
-            id=v.id,
-            prefixo=v.prefixo,
-            placa=v.placa,
-            categoria=v.categoria,
-            organizacao_nome=v.organizacao.nome,
-            valor=v.manutencoes_6m
-        )
-        for v in veiculos
-    ]
+    return get_dashboard_resumo(db, ["top_manutencoes"], limit).top_manutencoes
+
+def get_custo_por_categoria(db: Session) -> List[CustoCategoria]:
+    """Custos de manutenção por categoria"""
+    return get_dashboard_resumo(db, ["custo_por_categoria"]).custo_por_categoria
+
+def get_top_custos(db: Session, limit: int = 10) -> List[TopVeiculo]:
+    """Top veículos com maior custo de manutenção nos últimos 12 meses"""
+    return get_dashboard_resumo(db, ["top_custos"], limit).top_custos
 
 def get_recomendacoes_descarte(db: Session) -> List[Recomendacao]:
     """Gera recomendações de descarte baseadas nas regras"""
+    return get_dashboard_resumo(db, ["recomendacoes"]).recomendacoes
+
+def get_custos_veiculo(db: Session, veiculo_id: int, meses: int = JANELA_CUSTO_MESES) -> Optional[CustosVeiculo]:
+    """
+    Custos de manutenção de um veículo: total, por km e numa janela de meses
     
-    veiculos = db.query(Veiculo).join(Organizacao).all()
-    recomendacoes = []
+    Os totais vêm da diferença entre custos acumulados (app.custos), sem
+    somar as manutenções.
     
-    for veiculo in veiculos:
-        nota, faixa = calcular_nota_ocupacao(veiculo)
-        motivos = []
-        
-        # Regra 1: Nota baixa
-        if nota < 50:
-            motivos.append(f"Nota de ocupação crítica ({nota})")
+    Args:
+        db: Sessão do banco
+        veiculo_id: ID do veículo
+        meses: Tamanho da janela, terminando no mês corrente
         
-        # Regra 2: Muitas manutenções
-        if veiculo.manutencoes_6m >= 5:
-            motivos.append(f"Excesso de manutenções ({veiculo.manutencoes_6m} em 6 meses)")
+    Returns:
+        CustosVeiculo ou None se o veículo não existe
+    """
+    ate = mes_atual()
+    inicio = deslocar_mes(ate, -(meses - 1))
+    quantidade = CustoManutencaoMensal.quantidade_acumulada
+    
+    linha = db.execute(
+        select(
+            Veiculo.odometro_km,
+            acumulado_ate(ate).label("custo_total"),
+            acumulado_ate(ate, quantidade).label("manutencoes_total"),
+            acumulado_ate(inicio, inclusive=False).label("custo_anterior"),
+            acumulado_ate(inicio, quantidade, inclusive=False).label("manutencoes_anteriores")
+        ).where(Veiculo.id == veiculo_id)
+    ).first()
+    if linha is None:
+        return None
+    
+    serie = db.execute(
+        select(
+            CustoManutencaoMensal.ano_mes, CustoManutencaoMensal.custo,
+            CustoManutencaoMensal.quantidade, CustoManutencaoMensal.custo_acumulado
+        )
+        .where(
+            CustoManutencaoMensal.veiculo_id == veiculo_id,
+            CustoManutencaoMensal.ano_mes >= inicio,
+            CustoManutencaoMensal.ano_mes <= ate
+        )
+        .order_by(CustoManutencaoMensal.ano_mes)
+    ).all()
+    
+    custo_janela_veiculo = linha.custo_total - linha.custo_anterior
+    return CustosVeiculo(
+        veiculo_id=veiculo_id,
+        custo_total=round(linha.custo_total, 2),
+        manutencoes_total=linha.manutencoes_total,
+        custo_por_km=round(linha.custo_total / linha.odometro_km, 4) if linha.odometro_km else None,
+        meses=meses,
+        custo_janela=round(custo_janela_veiculo, 2),
+        manutencoes_janela=linha.manutencoes_total - linha.manutencoes_anteriores,
+        custo_mensal_medio=round(custo_janela_veiculo / meses, 2),
+        serie=[
+            PontoCusto(ano_mes=ano_mes, custo=round(custo, 2), manutencoes=qtd, custo_acumulado=round(acumulado, 2))
+            for ano_mes, custo, qtd, acumulado in serie
+        ]
+    )
+
+@cache_resultado("uso_horas_mensal", "organizacao")
+def get_serie_uso_horas(
+    db: Session,
+    inicio: Optional[str] = None,
+    fim: Optional[str] = None,
+    organizacao_id: Optional[int] = None,
+    categoria: Optional[str] = None,
+    por_categoria: bool = False
+) -> List[PontoUsoHoras]:
+    """
+    Série mensal de horas de uso a partir da tabela agregada uso_horas_mensal
+    
+    Args:
+        db: Sessão do banco
+        inicio: Primeira competência (YYYY-MM), inclusive
+        fim: Última competência (YYYY-MM), inclusive
+        organizacao_id: Organização; inclui todas as subordinadas
+        categoria: Categoria de veículo
+        por_categoria: Um ponto por mês e categoria em vez de um por mês
         
-        # Regra 3: Alta quilometragem
-        km_ref = KM_REFERENCIA_CATEGORIA.get(veiculo.categoria, 250_000)
-        if veiculo.odometro_km >= 0.9 * km_ref:
-            pct_km = (veiculo.odometro_km / km_ref) * 100
-            motivos.append(f"Alta quilometragem ({pct_km:.1f}% da vida útil)")
+    Returns:
+        List[PontoUsoHoras]: Pontos em ordem de competência
+    """
+    organizacoes = None
+    if organizacao_id is not None:
+        organizacoes = obter_indice(db).descendentes_de([organizacao_id])
+    consulta = _consulta_serie_uso_horas(inicio, fim, organizacoes, categoria, por_categoria)
+    return _pontos_uso_horas(db.execute(consulta), por_categoria)
+
+def _consulta_serie_uso_horas(
+    inicio: Optional[str],
+    fim: Optional[str],
+    organizacoes: Optional[Iterable[int]],
+    categoria: Optional[str],
+    por_categoria: bool
+) -> Select:
+    """Consulta agrupada da série de uso (organizacoes já com as subordinadas)"""
+    colunas = [UsoHorasMensal.ano_mes]
+    if por_categoria:
+        colunas.append(UsoHorasMensal.categoria)
+    
+    query = select(
+        *colunas, func.sum(UsoHorasMensal.horas), func.sum(UsoHorasMensal.registros)
+    ).group_by(*colunas).order_by(*colunas)
+    
+    if inicio:
+        query = query.where(UsoHorasMensal.ano_mes >= inicio)
+    if fim:
+        query = query.where(UsoHorasMensal.ano_mes <= fim)
+    if organizacoes is not None:
+        query = query.where(UsoHorasMensal.organizacao_id.in_(sorted(organizacoes)))
+    if categoria:
+        query = query.where(UsoHorasMensal.categoria == categoria)
+    return query
+
+def _pontos_uso_horas(linhas: Iterable, por_categoria: bool) -> List[PontoUsoHoras]:
+    pontos = []
+    for linha in linhas:
+        horas, registros = linha[-2], linha[-1]
+        pontos.append(PontoUsoHoras(
+            ano_mes=linha[0],
+            categoria=linha[1] if por_categoria else None,
+            horas=horas,
+            registros=registros,
+            media_horas=round(horas / registros, 1) if registros else 0.0
+        ))
+    return pontos
+
+# ====== GEOJSON EM STREAMING ======
+
+# Linhas lidas por vez do cursor e tamanho aproximado de cada bloco enviado
+GEO_LINHAS_POR_LOTE = 500
+GEO_BYTES_POR_BLOCO = 64 * 1024
+
+def _stream_feature_collection(features: Iterator[Dict], membros: Optional[Dict] = None) -> Iterator[bytes]:
+    """
+    Serializa uma FeatureCollection em blocos, à medida que as features chegam
+    
+    Nenhuma lista de features é montada: a memória usada é limitada ao
+    bloco corrente, independentemente do número de features.
+    
+    Args:
+        features: Features a serializar
+        membros: Membros adicionais da FeatureCollection, antes de "features"
+    """
+    colecao = _ColecaoEmBlocos(membros)
+    for feature in features:
+        bloco = colecao.adicionar(feature)
+        if bloco:
+            yield bloco
+    yield colecao.fechar()
+
+class _ColecaoEmBlocos:
+    """Serialização incremental de uma FeatureCollection em blocos de bytes"""
+    
+    def __init__(self, membros: Optional[Dict] = None):
+        extras = "".join(
+            f"{json.dumps(chave)}:{json.dumps(valor, ensure_ascii=False, separators=(',', ':'))},"
+            for chave, valor in (membros or {}).items()
+        )
+        self.bloco = ['{"type":"FeatureCollection",' + extras + '"features":[']
+        self.tamanho = 0
+        self.separador = ""
+    
+    def adicionar(self, feature: Dict) -> Optional[bytes]:
+        """Acrescenta uma feature; devolve o bloco quando ele atinge GEO_BYTES_POR_BLOCO"""
+        trecho = self.separador + json.dumps(feature, ensure_ascii=False, separators=(",", ":"))
+        self.bloco.append(trecho)
+        self.tamanho += len(trecho)
+        self.separador = ","
         
-        if motivos:
-            # Estimar economia (simplificado)
-            custo_manutencao_anual = veiculo.manutencoes_6m * 2 * 2000  # R$ 2.000 por manutenção
-            economia = min(custo_manutencao_anual, veiculo.valor_fipe * 0.3)
-            
-            recomendacoes.append(Recomendacao(
-                veiculo_id=veiculo.id,
-                prefixo=veiculo.prefixo,
-                placa=veiculo.placa,
-                categoria=veiculo.categoria,
-                organizacao_nome=veiculo.organizacao.nome,
-                motivo="; ".join(motivos),
-                impacto=f"Economia estimada: R$ {economia:,.2f}/ano",
-                nota_ocupacao=nota
-            ))
-    
-    # Ordenar por prioridade (nota mais baixa primeiro)
-    return sorted(recomendacoes, key=lambda x: x.nota_ocupacao)
-
-def get_geo_batalhoes(db: Session, municipio: Optional[str] = None) -> GeoJSONFeatureCollection:
-    """Retorna polígonos dos batalhões como GeoJSON"""
-    
-    query = db.query(GeoBatalhoes)
-    if municipio:
-        query = query.filter(GeoBatalhoes.municipio == municipio)
+        if self.tamanho < GEO_BYTES_POR_BLOCO:
+            return None
+        bloco = "".join(self.bloco).encode("utf-8")
+        self.bloco = []
+        self.tamanho = 0
+        return bloco
     
-    batalhoes = query.all()
-    features = []
+    def fechar(self) -> bytes:
+        """Último bloco, com o fechamento da coleção"""
+        self.bloco.append("]}")
+        return "".join(self.bloco).encode("utf-8")
+
+def stream_geo_batalhoes(db: Session, municipio: Optional[str] = None) -> Iterator[bytes]:
+    """Retorna polígonos dos batalhões como GeoJSON, em blocos"""
+    
+    consulta = select(GeoBatalhoes.municipio, GeoBatalhoes.batalhao_nome, GeoBatalhoes.geojson)
+    if municipio:
+        consulta = consulta.where(GeoBatalhoes.municipio == municipio)
     
-    for batalhao in batalhoes:
-        feature = {
+    linhas = db.execute(consulta.execution_options(yield_per=GEO_LINHAS_POR_LOTE))
+    return _stream_feature_collection(
+        {
             "type": "Feature",
             "geometry": batalhao.geojson["geometry"],
             "properties": {
@@ -281,22 +773,19 @@ def get_geo_batalhoes(db: Session, municipio: Optional[str] = None) -> GeoJSONFe
                 "batalhao_nome": batalhao.batalhao_nome
             }
         }
-        features.append(feature)
-    
-    return GeoJSONFeatureCollection(features=features)
+        for batalhao in linhas
+    )
 
-def get_geo_bases(db: Session, municipio: Optional[str] = None) -> GeoJSONFeatureCollection:
-    """Retorna pontos das bases como GeoJSON"""
+def stream_geo_bases(db: Session, municipio: Optional[str] = None) -> Iterator[bytes]:
+    """Retorna pontos das bases como GeoJSON, em blocos"""
     
-    query = db.query(GeoBases)
+    consulta = select(GeoBases.municipio, GeoBases.batalhao_nome, GeoBases.geojson)
     if municipio:
-        query = query.filter(GeoBases.municipio == municipio)
-    
-    bases = query.all()
-    features = []
+        consulta = consulta.where(GeoBases.municipio == municipio)
     
-    for base in bases:
-        feature = {
+    linhas = db.execute(consulta.execution_options(yield_per=GEO_LINHAS_POR_LOTE))
+    return _stream_feature_collection(
+        {
             "type": "Feature",
             "geometry": base.geojson["geometry"],
             "properties": {
@@ -305,108 +794,475 @@ def get_geo_bases(db: Session, municipio: Optional[str] = None) -> GeoJSONFeatur
                 "batalhao_nome": base.batalhao_nome
             }
         }
-        features.append(feature)
-    
-    return GeoJSONFeatureCollection(features=features)
-
-def get_geo_viaturas(db: Session, **filtros) -> GeoJSONFeatureCollection:
-    """Retorna pontos das viaturas como GeoJSON com filtros"""
-    
-    query = db.query(Veiculo).join(Organizacao)
-    
-    # Aplicar filtros
-    if filtros.get("comando"):
-        # Buscar comandos
-        comandos = db.query(Organizacao).filter(
-            Organizacao.tipo == "Comando",
-            Organizacao.nome.ilike(f"%{filtros['comando']}%")
-        ).all()
-        if comandos:
-            comando_ids = [c.id for c in comandos]
-            # Buscar todas as organizações filhas
-            filhos_ids = get_organizacao_filhos_ids(db, comando_ids)
-            query = query.filter(Veiculo.organizacao_id.in_(filhos_ids))
-    
-    if filtros.get("unidade"):
-        unidades = db.query(Organizacao).filter(
-            Organizacao.tipo == "Unidade",
-            Organizacao.nome.ilike(f"%{filtros['unidade']}%")
-        ).all()
-        if unidades:
-            unidade_ids = [u.id for u in unidades]
-            filhos_ids = get_organizacao_filhos_ids(db, unidade_ids)
-            query = query.filter(Veiculo.organizacao_id.in_(filhos_ids))
-    
-    if filtros.get("batalhao"):
-        batalhoes = db.query(Organizacao).filter(
-            Organizacao.tipo == "Batalhao",
-            Organizacao.nome.ilike(f"%{filtros['batalhao']}%")
-        ).all()
-        if batalhoes:
-            batalhao_ids = [b.id for b in batalhoes]
-            query = query.filter(Veiculo.organizacao_id.in_(batalhao_ids))
-    
-    if filtros.get("viatura"):
-        query = query.filter(
-            (Veiculo.prefixo.ilike(f"%{filtros['viatura']}%")) |
-            (Veiculo.placa.ilike(f"%{filtros['viatura']}%"))
+        for base in linhas
+    )
+
+# Colunas das features de viaturas
+COLUNAS_VIATURA = (
+    Veiculo.id, Veiculo.prefixo, Veiculo.placa, Veiculo.categoria,
+    Organizacao.nome.label("organizacao_nome"), Veiculo.municipio, Veiculo.bairro,
+    Veiculo.area_atuacao, Veiculo.odometro_km, Veiculo.horas_mes,
+    Veiculo.manutencoes_6m, Veiculo.nota_ocupacao, Veiculo.faixa_ocupacao,
+    Veiculo.ativo, Veiculo.latitude, Veiculo.longitude
+)
+
+def _preparar_viaturas(db: Session, filtros: Dict) -> Tuple[int, Select, Dict]:
+    """Versão de linha atual e consulta filtrada das viaturas"""
+    # Lida antes dos dados: o que for gravado depois volta no próximo delta
+    versao = versao_estavel(db)
+    consulta, parametros = consulta_veiculos(db, filtros, *COLUNAS_VIATURA)
+    return versao, consulta, parametros
+
+def stream_geo_viaturas(db: Session, **filtros) -> Iterator[bytes]:
+    """
+    Retorna pontos das viaturas como GeoJSON com filtros, em blocos
+    
+    A coleção traz "versao", a versão de linha dos dados entregues. Com o
+    filtro desde, apenas as viaturas alteradas depois daquela versão são
+    enviadas, e "removidos" lista os ids que deixaram a camada (removidos,
+    sem posição ou que não atendem mais aos filtros).
+    """
+    versao, consulta, parametros = _preparar_viaturas(db, filtros)
+    
+    if filtros.get("desde") is None:
+        linhas = db.execute(consulta.execution_options(yield_per=GEO_LINHAS_POR_LOTE), parametros)
+        return _stream_feature_collection(
+            (
+                feature_viatura(veiculo) for veiculo in linhas
+                if veiculo.latitude and veiculo.longitude
+            ),
+            {"versao": versao}
         )
     
-    if filtros.get("municipio"):
-        query = query.filter(Veiculo.municipio.ilike(f"%{filtros['municipio']}%"))
+    desde = filtros["desde"]
+    return _stream_delta_viaturas(
+        versao, desde, db.execute(consulta, parametros), db.execute(_consulta_alterados(desde)).scalars()
+    )
+
+def _consulta_alterados(desde: int):
+    """Ids de veículos alterados ou removidos depois da versão desde"""
+    return union(
+        select(Veiculo.id).where(Veiculo.versao > desde),
+        select(VeiculoRemovido.veiculo_id).where(VeiculoRemovido.versao > desde)
+    )
+
+def _stream_delta_viaturas(versao: int, desde: int, linhas: Iterable, alterados: Iterable[int]) -> Iterator[bytes]:
+    """Delta da camada: viaturas filtradas com posição e ids alterados que saíram dela"""
+    linhas = [veiculo for veiculo in linhas if veiculo.latitude and veiculo.longitude]
+    presentes = {veiculo.id for veiculo in linhas}
+    return _stream_feature_collection(
+        (feature_viatura(veiculo) for veiculo in linhas),
+        {"versao": versao, "desde": desde, "removidos": sorted(set(alterados) - presentes)}
+    )
+
+def feature_viatura(veiculo) -> Dict:
+    """Feature GeoJSON de uma viatura a partir de uma linha de veículo"""
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "Point",
+            "coordinates": [veiculo.longitude, veiculo.latitude]
+        },
+        "properties": {
+            "veiculo_id": veiculo.id,
+            "prefixo": veiculo.prefixo,
+            "placa": veiculo.placa,
+            "categoria": veiculo.categoria,
+            "organizacao": veiculo.organizacao_nome,
+            "municipio": veiculo.municipio,
+            "bairro": veiculo.bairro,
+            "area_atuacao": veiculo.area_atuacao,
+            "odometro_km": veiculo.odometro_km,
+            "horas_mes": veiculo.horas_mes,
+            "manutencoes_6m": veiculo.manutencoes_6m,
+            "nota_ocupacao": veiculo.nota_ocupacao,
+            "faixa_ocupacao": veiculo.faixa_ocupacao,
+            "ativo": veiculo.ativo
+        }
+    }
+
+# ====== AGRUPAMENTO DE VIATURAS POR ZOOM ======
+
+# Faixas da mais grave para a menos grave
+FAIXAS_GRAVIDADE = ("Crítico", "Atenção", "Adequado")
+
+@cache_resultado("veiculo", "organizacao", TABELA_POSICOES)
+def get_clusters_viaturas(db: Session, zoom: int, **filtros) -> Dict:
+    """
+    Agrupa as viaturas em clusters pela grade espacial, no nível do zoom
     
-    if filtros.get("bairro"):
-        query = query.filter(Veiculo.bairro.ilike(f"%{filtros['bairro']}%"))
+    Cada cluster traz a quantidade de viaturas, o centróide, a faixa mais
+    grave e a contagem por faixa. O agrupamento é feito no banco, pelo
+    prefixo do código de célula (geo_celula >> deslocamento).
     
-    if filtros.get("ativo") is not None:
-        query = query.filter(Veiculo.ativo == filtros["ativo"])
+    Returns:
+        Dict: FeatureCollection de pontos com "agrupado": true
+    """
+    consulta, parametros, nivel = _consulta_clusters(db, zoom, filtros)
+    return _colecao_clusters(nivel, db.execute(consulta, parametros))
+
+def _consulta_clusters(
+    db: Optional[Session],
+    zoom: int,
+    filtros: Dict,
+    indice: Optional[IndiceOrganizacoes] = None
+) -> Tuple[Select, Dict, int]:
+    """Consulta agrupada por célula, parâmetros e nível da grade do zoom"""
+    nivel = nivel_agrupamento(zoom)
+    celula = Veiculo.geo_celula.op(">>", return_type=Integer)(bindparam("deslocamento")).label("celula")
     
-    veiculos = query.all()
+    consulta, parametros = consulta_veiculos(
+        db, filtros,
+        celula,
+        func.count().label("quantidade"),
+        func.avg(Veiculo.latitude).label("latitude"),
+        func.avg(Veiculo.longitude).label("longitude"),
+        *(
+            func.sum(case((Veiculo.faixa_ocupacao == faixa, 1), else_=0)).label(f"faixa_{i}")
+            for i, faixa in enumerate(FAIXAS_GRAVIDADE)
+        ),
+        indice=indice
+    )
+    consulta = consulta.where(Veiculo.geo_celula.isnot(None)).group_by(celula)
+    parametros["deslocamento"] = 2 * (NIVEL_GRADE - nivel)
+    return consulta, parametros, nivel
+
+def _colecao_clusters(nivel: int, linhas: Iterable) -> Dict:
     features = []
-    
-    for veiculo in veiculos:
-        if veiculo.latitude and veiculo.longitude:
-            nota, faixa = calcular_nota_ocupacao(veiculo)
-            
-            feature = {
-                "type": "Feature",
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": [veiculo.longitude, veiculo.latitude]
-                },
-                "properties": {
-                    "veiculo_id": veiculo.id,
-                    "prefixo": veiculo.prefixo,
-                    "placa": veiculo.placa,
-                    "categoria": veiculo.categoria,
-                    "organizacao": veiculo.organizacao.nome,
-                    "municipio": veiculo.municipio,
-                    "bairro": veiculo.bairro,
-                    "area_atuacao": veiculo.area_atuacao,
-                    "odometro_km": veiculo.odometro_km,
-                    "horas_mes": veiculo.horas_mes,
-                    "manutencoes_6m": veiculo.manutencoes_6m,
-                    "nota_ocupacao": nota,
-                    "faixa_ocupacao": faixa,
-                    "ativo": veiculo.ativo
-                }
+    for linha in linhas:
+        faixas = {faixa: getattr(linha, f"faixa_{i}") for i, faixa in enumerate(FAIXAS_GRAVIDADE)}
+        features.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "Point",
+                "coordinates": [linha.longitude, linha.latitude]
+            },
+            "properties": {
+                "cluster": True,
+                "celula": linha.celula,
+                "quantidade": linha.quantidade,
+                "faixa": next((faixa for faixa in FAIXAS_GRAVIDADE if faixas[faixa]), None),
+                "faixas": faixas
             }
-            features.append(feature)
+        })
+    
+    return {
+        "type": "FeatureCollection",
+        "agrupado": True,
+        "nivel": nivel,
+        "features": features
+    }
+
+# ====== ÁREAS DOS BATALHÕES ======
+
+@cache_resultado("veiculo", "organizacao", "geo_batalhoes", TABELA_POSICOES)
+def get_resumo_areas(db: Session) -> ResumoAreas:
+    """Contagem de viaturas por área de batalhão, a partir de geo_batalhao_id"""
+    por_area, sem_area, fora_area = _consultas_areas()
+    return _montar_resumo_areas(
+        db.execute(por_area).all(), db.execute(sem_area).scalar(), db.execute(*fora_area).scalar()
+    )
+
+def _consultas_areas() -> Tuple[Select, Select, Tuple[Select, Dict]]:
+    """Contagens por área, sem área e fora da área do próprio batalhão"""
+    por_area = (
+        select(
+            GeoBatalhoes.id, GeoBatalhoes.batalhao_nome, GeoBatalhoes.municipio,
+            func.count(Veiculo.id).label("viaturas"),
+            func.sum(case((Veiculo.ativo == True, 1), else_=0)).label("ativas"),
+            func.sum(case((Organizacao.nome != GeoBatalhoes.batalhao_nome, 1), else_=0)).label("de_outros")
+        )
+        .select_from(GeoBatalhoes)
+        .outerjoin(Veiculo, Veiculo.geo_batalhao_id == GeoBatalhoes.id)
+        .outerjoin(Organizacao, Organizacao.id == Veiculo.organizacao_id)
+        .group_by(GeoBatalhoes.id)
+        .order_by(GeoBatalhoes.batalhao_nome, GeoBatalhoes.id)
+    )
+    sem_area = select(func.count(Veiculo.id)).where(
+        Veiculo.latitude.isnot(None),
+        Veiculo.longitude.isnot(None),
+        Veiculo.geo_batalhao_id.is_(None)
+    )
+    # O filtro fora_area não usa o índice de organizações
+    fora_area = consulta_veiculos(None, {"fora_area": True}, func.count(Veiculo.id))
+    return por_area, sem_area, fora_area
+
+def _montar_resumo_areas(linhas: Sequence, sem_area: int, fora: int) -> ResumoAreas:
+    return ResumoAreas(
+        areas=[
+            ContagemArea(
+                area_id=linha.id,
+                batalhao_nome=linha.batalhao_nome,
+                municipio=linha.municipio,
+                viaturas=linha.viaturas,
+                ativas=linha.ativas or 0,
+                de_outros_batalhoes=linha.de_outros or 0
+            )
+            for linha in linhas
+        ],
+        sem_area=sem_area,
+        fora_da_propria_area=fora
+    )
+
+# ====== LISTAGEM PAGINADA ======
+
+# Campos que podem ser projetados na listagem de veículos
+CAMPOS_VEICULO = (
+    "id", "prefixo", "placa", "categoria", "organizacao_id", "municipio", "bairro",
+    "area_atuacao", "ativo", "odometro_km", "horas_mes", "manutencoes_6m", "valor_fipe",
+    "latitude", "longitude", "created_at", "nota_ocupacao", "faixa_ocupacao", "organizacao"
+)
+
+# Colunas aceitas como chave de ordenação (desempate sempre por id; nulos
+# sempre ao final, nas duas ordens)
+ORDENACOES_VEICULO = (
+    "id", "prefixo", "placa", "odometro_km", "horas_mes",
+    "manutencoes_6m", "valor_fipe", "nota_ocupacao"
+)
+
+def _codificar_cursor(valor, veiculo_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([valor, veiculo_id]).encode()).decode()
+
+def _decodificar_cursor(cursor: str) -> Tuple:
+    try:
+        valor, veiculo_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return valor, int(veiculo_id)
+    except (ValueError, TypeError):
+        raise ValueError("Cursor inválido")
+
+def _depois_do_cursor(coluna, valor, ultimo_id: int, crescente: bool) -> ColumnElement:
+    """
+    Linhas posteriores a (valor, ultimo_id) na ordem (coluna NULLS LAST, id)
+    
+    A comparação de tuplas é falsa quando a coluna é nula, por isso as
+    linhas sem valor são tratadas à parte: vêm depois de todas as demais e,
+    entre elas, seguem a ordem do id.
+    """
+    depois_id = Veiculo.id > ultimo_id if crescente else Veiculo.id < ultimo_id
+    if valor is None:
+        return and_(coluna.is_(None), depois_id)
     
-    return GeoJSONFeatureCollection(features=features)
+    chave = tuple_(coluna, Veiculo.id)
+    depois = chave > tuple_(valor, ultimo_id) if crescente else chave < tuple_(valor, ultimo_id)
+    return or_(depois, coluna.is_(None)) if coluna.nullable else depois
+
+def get_pagina_veiculos(
+    db: Session,
+    filtros: Dict,
+    limite: int = 100,
+    cursor: Optional[str] = None,
+    ordenar_por: str = "id",
+    ordem: str = "asc",
+    campos: Optional[Sequence[str]] = None,
+    incluir_total: bool = False
+) -> PaginaVeiculos:
+    """
+    Lista veículos filtrados com paginação por chave (keyset)
+    
+    A página seguinte começa logo após a última linha devolvida, pela
+    ordenação (coluna, id), sem OFFSET: o custo de cada página não cresce
+    com a posição na listagem.
+    
+    Args:
+        db: Sessão do banco
+        filtros: Filtros de veículos (ver app.filtros.CAMPOS_FILTRO)
+        limite: Tamanho da página
+        cursor: proximo_cursor devolvido pela página anterior
+        ordenar_por: Coluna de ordenação (ver ORDENACOES_VEICULO)
+        ordem: asc ou desc
+        campos: Campos devolvidos (ver CAMPOS_VEICULO); None para todos
+        incluir_total: Contar o total de veículos que atendem aos filtros
+        
+    Returns:
+        PaginaVeiculos: itens, cursor da próxima página e total opcional
+    """
+    campos = list(campos or CAMPOS_VEICULO)
+    com_organizacao = "organizacao" in campos
+    
+    # id e a coluna de ordenação sempre são lidos, para montar o cursor
+    necessarias = [c for c in campos if c != "organizacao"]
+    necessarias = list(dict.fromkeys(
+        ["id", ordenar_por] + necessarias + (["organizacao_id"] if com_organizacao else [])
+    ))
+    consulta, parametros = consulta_veiculos(db, filtros, *[getattr(Veiculo, c) for c in necessarias])
+    
+    coluna = getattr(Veiculo, ordenar_por)
+    crescente = ordem == "asc"
+    pagina = consulta
+    
+    if cursor:
+        valor, ultimo_id = _decodificar_cursor(cursor)
+        if ordenar_por == "id":
+            pagina = pagina.where(Veiculo.id > ultimo_id if crescente else Veiculo.id < ultimo_id)
+        else:
+            pagina = pagina.where(_depois_do_cursor(coluna, valor, ultimo_id, crescente))
+    
+    if ordenar_por == "id":
+        pagina = pagina.order_by(Veiculo.id.asc() if crescente else Veiculo.id.desc())
+    elif crescente:
+        pagina = pagina.order_by(coluna.asc().nulls_last(), Veiculo.id.asc())
+    else:
+        pagina = pagina.order_by(coluna.desc().nulls_last(), Veiculo.id.desc())
+    
+    # Uma linha a mais indica se existe próxima página
+    linhas = db.execute(pagina.limit(limite + 1), parametros).all()
+    proximo_cursor = None
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        ultima = linhas[-1]
+        proximo_cursor = _codificar_cursor(getattr(ultima, ordenar_por), ultima.id)
+    
+    indice = obter_indice(db) if com_organizacao else None
+    organizacoes: Dict[int, Dict] = {}
+    itens = []
+    for linha in linhas:
+        item = {campo: getattr(linha, campo) for campo in campos if campo != "organizacao"}
+        if com_organizacao:
+            item["organizacao"] = _organizacao_dict(indice, linha.organizacao_id, organizacoes)
+        itens.append(item)
+    
+    total = None
+    if incluir_total:
+        total = db.execute(select(func.count()).select_from(consulta.subquery()), parametros).scalar()
+    
+    return PaginaVeiculos(itens=itens, proximo_cursor=proximo_cursor, total=total)
+
+def _organizacao_dict(indice, org_id: int, memo: Dict[int, Dict]) -> Optional[Dict]:
+    """Organização aninhada (com filhos) montada a partir do índice em memória"""
+    if org_id not in memo:
+        if org_id not in indice.por_id:
+            return None
+        nome, tipo, pai_id = indice.por_id[org_id]
+        memo[org_id] = {
+            "nome": nome,
+            "tipo": tipo,
+            "pai_id": pai_id,
+            "id": org_id,
+            "filhos": [_organizacao_dict(indice, filho, memo) for filho in indice.filhos[org_id]]
+        }
+    return memo[org_id]
 
 def get_organizacao_filhos_ids(db: Session, pais_ids: List[int]) -> List[int]:
     """Retorna todos os IDs de organizações filhas (recursivo)"""
+    return list(obter_indice(db).descendentes_de(pais_ids))
+
+# ====== LEITURAS ASSÍNCRONAS ======
+#
+# As mesmas consultas das versões síncronas, aguardadas no driver
+# assíncrono: nenhuma consulta bloqueia o laço de eventos. O cache de
+# resultados é o mesmo (com chaves próprias).
+
+async def _todas(db: AsyncSession, consulta, parametros: Optional[Dict] = None) -> List:
+    return (await db.execute(consulta, parametros)).all()
+
+@cache_resultado("veiculo", "organizacao", "custo_manutencao_mensal")
+async def get_dashboard_resumo_async(
+    db: AsyncSession,
+    campos: Optional[Sequence[str]] = None,
+    limit: int = 10
+) -> DashboardResumo:
+    """Versão assíncrona de get_dashboard_resumo: a mesma passada, lida pelo driver assíncrono"""
+    campos = set(campos or CAMPOS_DASHBOARD)
+    passada = _PassadaDashboard(campos, limit)
+    async for v in await db.stream(_consulta_dashboard(campos)):
+        passada.adicionar(v)
+    return passada.resumo()
+
+async def get_kpis_async(db: AsyncSession) -> KPIs:
+    return (await get_dashboard_resumo_async(db, ["kpis"])).kpis
+
+async def get_vida_util_por_categoria_async(db: AsyncSession) -> List[VidaUtilCategoria]:
+    return (await get_dashboard_resumo_async(db, ["vida_util_por_categoria"])).vida_util_por_categoria
+
+async def get_fipe_por_categoria_async(db: AsyncSession) -> List[FipeCategoria]:
+    return (await get_dashboard_resumo_async(db, ["fipe_por_categoria"])).fipe_por_categoria
+
+async def get_top_rodados_async(db: AsyncSession, limit: int = 10) -> List[TopVeiculo]:
+    return (await get_dashboard_resumo_async(db, ["top_rodados"], limit)).top_rodados
+
+async def get_top_horas_async(db: AsyncSession, limit: int = 10) -> List[TopVeiculo]:
+    return (await get_dashboard_resumo_async(db, ["top_horas"], limit)).top_horas
+
+async def get_top_manutencoes_async(db: AsyncSession, limit: int = 10) -> List[TopVeiculo]:
+    return (await get_dashboard_resumo_async(db, ["top_manutencoes"], limit)).top_manutencoes
+
+async def get_custo_por_categoria_async(db: AsyncSession) -> List[CustoCategoria]:
+    return (await get_dashboard_resumo_async(db, ["custo_por_categoria"])).custo_por_categoria
+
+async def get_top_custos_async(db: AsyncSession, limit: int = 10) -> List[TopVeiculo]:
+    return (await get_dashboard_resumo_async(db, ["top_custos"], limit)).top_custos
+
+async def get_recomendacoes_descarte_async(db: AsyncSession) -> List[Recomendacao]:
+    return (await get_dashboard_resumo_async(db, ["recomendacoes"])).recomendacoes
+
+@cache_resultado("uso_horas_mensal", "organizacao")
+async def get_serie_uso_horas_async(
+    db: AsyncSession,
+    inicio: Optional[str] = None,
+    fim: Optional[str] = None,
+    organizacao_id: Optional[int] = None,
+    categoria: Optional[str] = None,
+    por_categoria: bool = False
+) -> List[PontoUsoHoras]:
+    """Versão assíncrona de get_serie_uso_horas"""
+    organizacoes = None
+    if organizacao_id is not None:
+        organizacoes = (await obter_indice_async(db)).descendentes_de([organizacao_id])
+    consulta = _consulta_serie_uso_horas(inicio, fim, organizacoes, categoria, por_categoria)
+    return _pontos_uso_horas(await _todas(db, consulta), por_categoria)
+
+@cache_resultado("veiculo", "organizacao", TABELA_POSICOES)
+async def get_clusters_viaturas_async(db: AsyncSession, zoom: int, **filtros) -> Dict:
+    """Versão assíncrona de get_clusters_viaturas"""
+    indice = await obter_indice_async(db)
+    consulta, parametros, nivel = _consulta_clusters(None, zoom, filtros, indice)
+    return _colecao_clusters(nivel, await _todas(db, consulta, parametros))
+
+@cache_resultado("veiculo", "organizacao", "geo_batalhoes", TABELA_POSICOES)
+async def get_resumo_areas_async(db: AsyncSession) -> ResumoAreas:
+    """Versão assíncrona de get_resumo_areas"""
+    por_area, sem_area, fora_area = _consultas_areas()
+    return _montar_resumo_areas(
+        await _todas(db, por_area),
+        (await db.execute(sem_area)).scalar(),
+        (await db.execute(*fora_area)).scalar()
+    )
+
+async def _stream_feature_collection_async(
+    features: AsyncIterator[Dict], membros: Optional[Dict] = None
+) -> AsyncIterator[bytes]:
+    """Como _stream_feature_collection, consumindo features assíncronas"""
+    colecao = _ColecaoEmBlocos(membros)
+    async for feature in features:
+        bloco = colecao.adicionar(feature)
+        if bloco:
+            yield bloco
+    yield colecao.fechar()
+
+async def stream_geo_viaturas_async(db: AsyncSession, **filtros) -> AsyncIterator[bytes]:
+    """
+    Versão assíncrona de stream_geo_viaturas
     
-    todos_ids = set(pais_ids)
+    A camada completa é lida em lotes pelo driver assíncrono; o delta
+    (filtro desde), pequeno por natureza, é lido de uma vez.
+    """
+    # Lida antes dos dados: o que for gravado depois volta no próximo delta
+    versao = await versao_estavel_async(db)
+    indice = await obter_indice_async(db)
+    consulta, parametros = consulta_veiculos(None, filtros, *COLUNAS_VIATURA, indice=indice)
     
-    def buscar_filhos(ids_atuais):
-        filhos = db.query(Organizacao.id).filter(Organizacao.pai_id.in_(ids_atuais)).all()
-        filhos_ids = [f[0] for f in filhos]
-        
-        if filhos_ids:
-            todos_ids.update(filhos_ids)
-            buscar_filhos(filhos_ids)
+    if filtros.get("desde") is not None:
+        desde = filtros["desde"]
+        linhas = await _todas(db, consulta, parametros)
+        alterados = (await db.execute(_consulta_alterados(desde))).scalars().all()
+        for bloco in _stream_delta_viaturas(versao, desde, linhas, alterados):
+            yield bloco
+        return
     
-    buscar_filhos(pais_ids)
-    return list(todos_ids)
+    linhas = await db.stream(consulta.execution_options(yield_per=GEO_LINHAS_POR_LOTE), parametros)
+    features = (
+        feature_viatura(veiculo) async for veiculo in linhas
+        if veiculo.latitude and veiculo.longitude
+    )
+    async for bloco in _stream_feature_collection_async(features, {"versao": versao}):
+        yield bloco
@@ -0,0 +1,103 @@
+"""
+Versão de linha dos veículos, usada na sincronização incremental do mapa
+
+Cada transação que altera veículos (ou pontos de viaturas) recebe um número
+de versão crescente, gravado na coluna versao das linhas alteradas; remoções
+de veículos ficam registradas em veiculo_removido com a mesma versão. Um
+cliente que conhece a versão N pede apenas o que mudou depois dela.
+
+A versão é reservada no banco, na própria transação, incrementando o
+contador CHAVE_VERSAO de sistema_meta (UPDATE ... RETURNING). A linha do
+contador fica bloqueada até o fim da transação, de modo que as versões são
+confirmadas em ordem: o valor confirmado do contador é a versão estável,
+até a qual todas as escritas já são visíveis, em qualquer processo.
+"""
+from sqlalchemy import Integer, String, cast, event, func, insert, literal, select, union_all, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models import Veiculo, GeoViaturas, VeiculoRemovido, SistemaMeta
+
+# Chave do contador de versões em sistema_meta
+CHAVE_VERSAO = "versao_linha"
+
+_meta = SistemaMeta.__table__
+_contador = cast(_meta.c.valor, Integer)
+
+def maior_versao_gravada():
+    """Consulta da maior versão já gravada nas tabelas versionadas"""
+    maiores = union_all(
+        select(func.max(Veiculo.versao)),
+        select(func.max(GeoViaturas.versao)),
+        select(func.max(VeiculoRemovido.versao))
+    ).subquery()
+    return select(func.coalesce(func.max(maiores.c[0]), 0))
+
+def _reservar(session: Session) -> int:
+    """Incrementa o contador do banco e retorna o novo valor"""
+    incremento = (
+        update(_meta)
+        .where(_meta.c.chave == CHAVE_VERSAO)
+        .values(valor=cast(_contador + 1, String))
+        .returning(_contador)
+    )
+    versao = session.execute(incremento).scalar()
+    if versao is None:
+        # Banco sem o contador (criado fora das migrações): parte da maior versão gravada
+        session.execute(insert(_meta).from_select(
+            ["chave", "valor"], select(literal(CHAVE_VERSAO), cast(maior_versao_gravada().scalar_subquery(), String))
+        ))
+        versao = session.execute(incremento).scalar()
+    return versao
+
+def versao_sessao(session: Session) -> int:
+    """
+    Versão da transação corrente da sessão, reservada na primeira chamada
+    
+    Escritas em lote (fora da unidade de trabalho) devem gravar este valor
+    na coluna versao das linhas que alteram.
+    """
+    versao = session.info.get("versao_linha")
+    if versao is None:
+        with session.no_autoflush:
+            versao = session.info["versao_linha"] = _reservar(session)
+    return versao
+
+def _consulta_versao_estavel():
+    """Valor confirmado do contador; sem contador, a maior versão gravada"""
+    contador = select(_contador).where(_meta.c.chave == CHAVE_VERSAO).scalar_subquery()
+    return select(func.coalesce(contador, maior_versao_gravada().scalar_subquery()))
+
+def versao_estavel(db: Session) -> int:
+    """Versão até a qual todas as transações já terminaram (valor confirmado do contador)"""
+    with db.no_autoflush:
+        return db.execute(_consulta_versao_estavel()).scalar()
+
+async def versao_estavel_async(db: AsyncSession) -> int:
+    """Como versao_estavel, numa sessão assíncrona"""
+    return (await db.execute(_consulta_versao_estavel())).scalar()
+
+@event.listens_for(Session, "before_flush")
+def _versionar_alteracoes(session, flush_context, instances):
+    """Grava a versão nas linhas novas ou alteradas e registra remoções de veículos"""
+    versionadas = (Veiculo, GeoViaturas)
+    alterados = [obj for obj in session.new if isinstance(obj, versionadas)]
+    alterados += [
+        obj for obj in session.dirty
+        if isinstance(obj, versionadas) and session.is_modified(obj)
+    ]
+    removidos = [obj for obj in session.deleted if isinstance(obj, Veiculo)]
+    if not alterados and not removidos:
+        return
+    
+    versao = versao_sessao(session)
+    for obj in alterados:
+        obj.versao = versao
+    for veiculo in removidos:
+        session.add(VeiculoRemovido(veiculo_id=veiculo.id, versao=versao))
+
+@event.listens_for(Session, "after_transaction_end")
+def _liberar_versao(session, transaction):
+    """Esquece a versão reservada ao fim da transação (commit, rollback ou close)"""
+    if transaction.parent is None:
+        session.info.pop("versao_linha", None)
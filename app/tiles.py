@@ -0,0 +1,382 @@
+"""
+Tiles das geometrias de batalhões e bases, recortadas e simplificadas por zoom
+
+As geometrias são projetadas em pixels do mundo (Web Mercator, tiles de
+256px) no zoom pedido, simplificadas por Douglas-Peucker com tolerância
+de meio pixel e recortadas nos limites de cada tile (com uma pequena
+borda, para que o contorno não apareça na emenda entre tiles). As
+coordenadas voltam em lon/lat, arredondadas à precisão útil do zoom.
+
+Camadas simplificadas (uma árvore de caixas por zoom) e tiles prontos
+ficam em memória, em LRUs limitadas, até a próxima escrita em
+geo_batalhoes ou geo_bases. A geração acontece fora do lock global: cada
+zoom tem o seu lock de construção, de modo que tiles em cache e camadas de
+outros zooms continuam sendo servidos enquanto uma camada é montada.
+"""
+import json
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.cache import ao_escrever
+from app.config import TILES_MAX_ITENS, TILES_MAX_CAMADAS
+from app.models import GeoBatalhoes, GeoBases
+
+TAMANHO_TILE = 256
+ZOOM_MAXIMO = 22
+TOLERANCIA_PIXELS = 0.5
+BORDA_PIXELS = 8
+
+# Itens por folha da árvore de caixas de cada camada
+ITENS_POR_FOLHA = 8
+
+# Tabelas cujas escritas descartam camadas e tiles
+TABELAS_TILES = ("geo_batalhoes", "geo_bases")
+
+Ponto = Tuple[float, float]
+Caixa = Tuple[float, float, float, float]
+
+# ====== PROJEÇÃO ======
+
+def _projetar(lon: float, lat: float, escala: float) -> Ponto:
+    """lon/lat -> pixels do mundo no zoom cuja largura total é escala"""
+    lat = max(min(lat, 85.05112878), -85.05112878)
+    seno = math.sin(math.radians(lat))
+    x = (lon + 180.0) / 360.0 * escala
+    y = (0.5 - math.log((1 + seno) / (1 - seno)) / (4 * math.pi)) * escala
+    return x, y
+
+def _desprojetar(x: float, y: float, escala: float) -> Ponto:
+    """Pixels do mundo -> lon/lat"""
+    lon = x / escala * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / escala))))
+    return lon, lat
+
+def tile_valido(z: int, x: int, y: int) -> bool:
+    """Verifica se (z, x, y) é um tile existente"""
+    return 0 <= z <= ZOOM_MAXIMO and 0 <= x < (1 << z) and 0 <= y < (1 << z)
+
+# ====== SIMPLIFICAÇÃO E RECORTE ======
+
+def simplificar(pontos: Sequence[Ponto], tolerancia: float) -> List[Ponto]:
+    """
+    Douglas-Peucker iterativo
+    
+    Mantém o primeiro e o último ponto e todo ponto cuja distância ao
+    segmento que o cobre seja maior que a tolerância.
+    """
+    if len(pontos) <= 2:
+        return list(pontos)
+    
+    manter = [False] * len(pontos)
+    manter[0] = manter[-1] = True
+    tolerancia2 = tolerancia * tolerancia
+    pilha = [(0, len(pontos) - 1)]
+    
+    while pilha:
+        inicio, fim = pilha.pop()
+        ax, ay = pontos[inicio]
+        bx, by = pontos[fim]
+        dx, dy = bx - ax, by - ay
+        comprimento2 = dx * dx + dy * dy
+        
+        maior, indice = -1.0, -1
+        for i in range(inicio + 1, fim):
+            px, py = pontos[i]
+            if comprimento2 == 0:
+                distancia2 = (px - ax) ** 2 + (py - ay) ** 2
+            else:
+                t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / comprimento2))
+                distancia2 = (px - ax - t * dx) ** 2 + (py - ay - t * dy) ** 2
+            if distancia2 > maior:
+                maior, indice = distancia2, i
+        
+        if maior > tolerancia2:
+            manter[indice] = True
+            pilha.append((inicio, indice))
+            pilha.append((indice, fim))
+    
+    return [ponto for ponto, mantido in zip(pontos, manter) if mantido]
+
+def _recortar_anel(anel: Sequence[Ponto], caixa: Caixa) -> List[Ponto]:
+    """Recorta um anel pela caixa (Sutherland-Hodgman), devolvendo-o fechado"""
+    min_x, min_y, max_x, max_y = caixa
+    arestas = (
+        (lambda p: p[0] >= min_x, lambda a, b: _cruzar_x(a, b, min_x)),
+        (lambda p: p[0] <= max_x, lambda a, b: _cruzar_x(a, b, max_x)),
+        (lambda p: p[1] >= min_y, lambda a, b: _cruzar_y(a, b, min_y)),
+        (lambda p: p[1] <= max_y, lambda a, b: _cruzar_y(a, b, max_y)),
+    )
+    
+    pontos = list(anel[:-1]) if anel and anel[0] == anel[-1] else list(anel)
+    for dentro, cruzar in arestas:
+        if not pontos:
+            break
+        entrada, pontos = pontos, []
+        anterior = entrada[-1]
+        for atual in entrada:
+            if dentro(atual):
+                if not dentro(anterior):
+                    pontos.append(cruzar(anterior, atual))
+                pontos.append(atual)
+            elif dentro(anterior):
+                pontos.append(cruzar(anterior, atual))
+            anterior = atual
+    
+    if len(pontos) < 3:
+        return []
+    return pontos + [pontos[0]]
+
+def _cruzar_x(a: Ponto, b: Ponto, x: float) -> Ponto:
+    t = (x - a[0]) / (b[0] - a[0])
+    return x, a[1] + t * (b[1] - a[1])
+
+def _cruzar_y(a: Ponto, b: Ponto, y: float) -> Ponto:
+    t = (y - a[1]) / (b[1] - a[1])
+    return a[0] + t * (b[0] - a[0]), y
+
+def _caixa(pontos: Sequence[Ponto]) -> Caixa:
+    xs = [p[0] for p in pontos]
+    ys = [p[1] for p in pontos]
+    return min(xs), min(ys), max(xs), max(ys)
+
+def _intersecta(a: Caixa, b: Caixa) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+def _uniao(caixas: Sequence[Caixa]) -> Caixa:
+    return (
+        min(c[0] for c in caixas), min(c[1] for c in caixas),
+        max(c[2] for c in caixas), max(c[3] for c in caixas)
+    )
+
+def _montar_arvore(itens: List[Tuple[Caixa, int]]) -> Tuple[Caixa, List, List]:
+    """Nó (caixa, filhos, itens): divide pelo eixo mais longo até ITENS_POR_FOLHA itens"""
+    caixa = _uniao([item[0] for item in itens])
+    if len(itens) <= ITENS_POR_FOLHA:
+        return caixa, [], itens
+    
+    eixo = 0 if caixa[2] - caixa[0] >= caixa[3] - caixa[1] else 1
+    itens = sorted(itens, key=lambda item: item[0][eixo] + item[0][eixo + 2])
+    meio = len(itens) // 2
+    return caixa, [_montar_arvore(itens[:meio]), _montar_arvore(itens[meio:])], []
+
+# ====== CAMADAS SIMPLIFICADAS POR ZOOM ======
+
+def _poligonos(geometria: Dict) -> List[List[List[Tuple[float, float]]]]:
+    """Polígonos (listas de anéis lon/lat) de um Polygon ou MultiPolygon"""
+    if geometria["type"] == "Polygon":
+        return [geometria["coordinates"]]
+    if geometria["type"] == "MultiPolygon":
+        return geometria["coordinates"]
+    return []
+
+def _pontos(geometria: Dict) -> List[Tuple[float, float]]:
+    """Pontos lon/lat de um Point ou MultiPoint"""
+    if geometria["type"] == "Point":
+        return [geometria["coordinates"]]
+    if geometria["type"] == "MultiPoint":
+        return geometria["coordinates"]
+    return []
+
+class CamadaZoom:
+    """Geometrias de batalhões e bases projetadas e simplificadas para um zoom"""
+    
+    def __init__(self, feicoes: Sequence[Tuple[str, Dict, Dict]], z: int):
+        """
+        Args:
+            feicoes: Tuplas (camada, propriedades, geometria GeoJSON)
+            z: Zoom
+        """
+        self.escala = float(TAMANHO_TILE << z)
+        self.itens: List[Tuple[Caixa, str, Dict, str, list]] = []
+        
+        for camada, propriedades, geometria in feicoes:
+            poligonos = []
+            for poligono in _poligonos(geometria):
+                aneis = [
+                    simplificar([_projetar(lon, lat, self.escala) for lon, lat, *_ in anel], TOLERANCIA_PIXELS)
+                    for anel in poligono
+                ]
+                # Anéis que colapsaram na simplificação são descartados
+                if len(aneis[0]) >= 4:
+                    poligonos.append([aneis[0]] + [anel for anel in aneis[1:] if len(anel) >= 4])
+            if poligonos:
+                caixa = _caixa([p for poligono in poligonos for p in poligono[0]])
+                self.itens.append((caixa, camada, propriedades, "Polygon", poligonos))
+            
+            for lon, lat, *_ in _pontos(geometria):
+                x, y = _projetar(lon, lat, self.escala)
+                self.itens.append(((x, y, x, y), camada, propriedades, "Point", [(x, y)]))
+        
+        self.raiz = _montar_arvore([(item[0], i) for i, item in enumerate(self.itens)]) if self.itens else None
+    
+    def _na_caixa(self, caixa: Caixa) -> List[int]:
+        """Índices (na ordem original) dos itens cuja caixa intersecta a informada"""
+        encontrados = []
+        pilha = [self.raiz] if self.raiz else []
+        while pilha:
+            caixa_no, filhos, itens = pilha.pop()
+            if not _intersecta(caixa_no, caixa):
+                continue
+            pilha.extend(filhos)
+            encontrados.extend(i for caixa_item, i in itens if _intersecta(caixa_item, caixa))
+        return sorted(encontrados)
+    
+    def tile(self, z: int, x: int, y: int) -> Dict:
+        """FeatureCollection com as geometrias recortadas no tile (x, y)"""
+        x0, y0 = x * TAMANHO_TILE, y * TAMANHO_TILE
+        limites = (x0, y0, x0 + TAMANHO_TILE, y0 + TAMANHO_TILE)
+        caixa = (
+            x0 - BORDA_PIXELS, y0 - BORDA_PIXELS,
+            x0 + TAMANHO_TILE + BORDA_PIXELS, y0 + TAMANHO_TILE + BORDA_PIXELS
+        )
+        # Precisão suficiente para um décimo de pixel neste zoom
+        casas = max(0, math.ceil(math.log10(self.escala / 36.0)))
+        
+        def lonlat(ponto: Ponto) -> List[float]:
+            lon, lat = _desprojetar(ponto[0], ponto[1], self.escala)
+            return [round(lon, casas), round(lat, casas)]
+        
+        features = []
+        for indice in self._na_caixa(caixa):
+            caixa_item, camada, propriedades, tipo, partes = self.itens[indice]
+            if tipo == "Point":
+                px, py = partes[0]
+                # Cada ponto pertence a um único tile
+                if not (limites[0] <= px < limites[2] and limites[1] <= py < limites[3]):
+                    continue
+                geometria = {"type": "Point", "coordinates": lonlat(partes[0])}
+            else:
+                poligonos = []
+                for aneis in partes:
+                    externo = _recortar_anel(aneis[0], caixa)
+                    if not externo:
+                        continue
+                    internos = [_recortar_anel(anel, caixa) for anel in aneis[1:]]
+                    poligonos.append([
+                        [lonlat(p) for p in anel] for anel in [externo] + internos if anel
+                    ])
+                if not poligonos:
+                    continue
+                geometria = (
+                    {"type": "Polygon", "coordinates": poligonos[0]} if len(poligonos) == 1
+                    else {"type": "MultiPolygon", "coordinates": poligonos}
+                )
+            
+            features.append({
+                "type": "Feature",
+                "geometry": geometria,
+                "properties": {**propriedades, "camada": camada}
+            })
+        
+        return {"type": "FeatureCollection", "features": features}
+
+# ====== CACHE EM MEMÓRIA ======
+
+_feicoes: Optional[List[Tuple[str, Dict, Dict]]] = None
+_camadas: "OrderedDict[int, CamadaZoom]" = OrderedDict()
+_tiles: "OrderedDict[Tuple[int, int, int], bytes]" = OrderedDict()
+# Incrementada a cada invalidação: o que foi montado antes dela é descartado
+_geracao = 0
+# Protege apenas as estruturas acima; a construção usa os locks abaixo
+_lock = threading.Lock()
+_lock_feicoes = threading.Lock()
+_locks_zoom: Dict[int, threading.Lock] = {}
+
+def _carregar_feicoes(db: Session) -> List[Tuple[str, Dict, Dict]]:
+    """Lê todas as geometrias de batalhões e bases"""
+    feicoes = []
+    for camada, modelo in (("batalhoes", GeoBatalhoes), ("bases", GeoBases)):
+        for municipio, batalhao_nome, geojson in db.execute(
+            select(modelo.municipio, modelo.batalhao_nome, modelo.geojson)
+        ):
+            propriedades = {
+                **geojson.get("properties", {}),
+                "municipio": municipio,
+                "batalhao_nome": batalhao_nome
+            }
+            feicoes.append((camada, propriedades, geojson["geometry"]))
+    return feicoes
+
+def _obter_feicoes(db: Session) -> Tuple[List[Tuple[str, Dict, Dict]], int]:
+    """Geometrias carregadas (uma leitura por geração) e a geração a que pertencem"""
+    global _feicoes
+    with _lock:
+        if _feicoes is not None:
+            return _feicoes, _geracao
+    
+    with _lock_feicoes:
+        with _lock:
+            if _feicoes is not None:
+                return _feicoes, _geracao
+            geracao = _geracao
+        feicoes = _carregar_feicoes(db)
+        with _lock:
+            if geracao == _geracao:
+                _feicoes = feicoes
+        return feicoes, geracao
+
+def _obter_camada(db: Session, z: int) -> Tuple[CamadaZoom, int]:
+    """Camada simplificada do zoom, montada por uma única thread de cada vez"""
+    with _lock:
+        camada = _camadas.get(z)
+        if camada is not None:
+            _camadas.move_to_end(z)
+            return camada, _geracao
+        lock_zoom = _locks_zoom.setdefault(z, threading.Lock())
+    
+    with lock_zoom:
+        with _lock:
+            camada = _camadas.get(z)
+            if camada is not None:
+                return camada, _geracao
+        
+        feicoes, geracao = _obter_feicoes(db)
+        camada = CamadaZoom(feicoes, z)
+        with _lock:
+            if geracao == _geracao:
+                _camadas[z] = camada
+                if len(_camadas) > TILES_MAX_CAMADAS:
+                    _camadas.popitem(last=False)
+        return camada, geracao
+
+def obter_tile(db: Session, z: int, x: int, y: int) -> bytes:
+    """
+    Retorna o tile (z, x, y) serializado em JSON
+    
+    Gera a camada simplificada do zoom e o tile apenas na primeira vez
+    após a última alteração das geometrias (ou depois de saírem das LRUs).
+    """
+    chave = (z, x, y)
+    with _lock:
+        conteudo = _tiles.get(chave)
+        if conteudo is not None:
+            _tiles.move_to_end(chave)
+            return conteudo
+    
+    camada, geracao = _obter_camada(db, z)
+    conteudo = json.dumps(
+        camada.tile(z, x, y), ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+    
+    with _lock:
+        if geracao == _geracao:
+            _tiles[chave] = conteudo
+            if len(_tiles) > TILES_MAX_ITENS:
+                _tiles.popitem(last=False)
+    return conteudo
+
+@ao_escrever
+def _invalidar_tiles(tabelas):
+    """Descarta camadas e tiles quando batalhões ou bases são alterados"""
+    global _feicoes, _geracao
+    if tabelas.intersection(TABELAS_TILES):
+        with _lock:
+            _geracao += 1
+            _feicoes = None
+            _camadas.clear()
+            _tiles.clear()
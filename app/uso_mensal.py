@@ -0,0 +1,159 @@
+"""
+Série mensal de horas de uso agregada por organização e categoria
+
+uso_horas_mensal guarda, para cada (ano_mes, organizacao_id, categoria), a
+soma das horas e a quantidade de linhas de uso_horas dos veículos daquele
+grupo, de modo que as séries do dashboard leem poucas linhas por mês em vez
+de percorrer todo o histórico.
+
+A tabela é mantida pelo flush: gravar, alterar ou remover UsoHoras, ou mudar
+a organização ou a categoria de um veículo com histórico, recalcula apenas os
+grupos afetados. reconstruir_uso_mensal refaz a tabela inteira numa única
+passada (usada no primeiro startup e após cargas em lote).
+"""
+from typing import Iterable, Set, Tuple
+
+from sqlalchemy import delete, event, func, inspect, insert, select, tuple_
+from sqlalchemy.orm import Session
+
+from app.cache import anotar_escrita
+from app.models import Veiculo, UsoHoras, UsoHorasMensal, SistemaMeta
+
+# Grupos recalculados por instrução
+LOTE_GRUPOS = 500
+
+# Chave em SistemaMeta que indica que a tabela já foi construída
+CHAVE_CONSTRUIDA = "uso_horas_mensal"
+
+Grupo = Tuple[str, int, str]  # (ano_mes, organizacao_id, categoria)
+
+def _agregacao():
+    """SELECT que agrega uso_horas por grupo, na ordem das colunas da tabela"""
+    return (
+        select(
+            UsoHoras.ano_mes, Veiculo.organizacao_id, Veiculo.categoria,
+            func.coalesce(func.sum(UsoHoras.horas), 0), func.count(UsoHoras.id)
+        )
+        .join(Veiculo, Veiculo.id == UsoHoras.veiculo_id)
+        .group_by(UsoHoras.ano_mes, Veiculo.organizacao_id, Veiculo.categoria)
+    )
+
+_COLUNAS = ("ano_mes", "organizacao_id", "categoria", "horas", "registros")
+
+def recalcular_grupos(db: Session, grupos: Iterable[Grupo]) -> int:
+    """
+    Recalcula os grupos informados a partir de uso_horas
+    
+    Grupos que ficaram sem linhas são removidos.
+    
+    Returns:
+        int: Quantidade de grupos gravados
+    """
+    grupos = sorted(grupos)
+    gravados = 0
+    for i in range(0, len(grupos), LOTE_GRUPOS):
+        lote = grupos[i:i + LOTE_GRUPOS]
+        chave = tuple_(UsoHorasMensal.ano_mes, UsoHorasMensal.organizacao_id, UsoHorasMensal.categoria)
+        db.execute(delete(UsoHorasMensal).where(chave.in_(lote)))
+        gravados += db.execute(
+            insert(UsoHorasMensal).from_select(
+                _COLUNAS,
+                _agregacao().where(
+                    tuple_(UsoHoras.ano_mes, Veiculo.organizacao_id, Veiculo.categoria).in_(lote)
+                )
+            )
+        ).rowcount
+    anotar_escrita(db, UsoHorasMensal.__tablename__)
+    return gravados
+
+def grupos_dos_usos(db: Session, usos: Iterable[Tuple[str, int]]) -> Set[Grupo]:
+    """Grupos atuais dos pares (ano_mes, veiculo_id) de uso_horas"""
+    usos = {(ano_mes, veiculo_id) for ano_mes, veiculo_id in usos if ano_mes and veiculo_id is not None}
+    if not usos:
+        return set()
+    veiculos = dict(
+        (veiculo_id, (organizacao_id, categoria))
+        for veiculo_id, organizacao_id, categoria in db.execute(
+            select(Veiculo.id, Veiculo.organizacao_id, Veiculo.categoria)
+            .where(Veiculo.id.in_({veiculo_id for _, veiculo_id in usos}))
+        )
+    )
+    return {
+        (ano_mes, *veiculos[veiculo_id])
+        for ano_mes, veiculo_id in usos if veiculo_id in veiculos
+    }
+
+def grupos_dos_veiculos(db: Session, veiculos: Iterable[Tuple[int, int, str]]) -> Set[Grupo]:
+    """Grupos de todo o histórico de cada (veiculo_id, organizacao_id, categoria)"""
+    grupos: Set[Grupo] = set()
+    for veiculo_id, organizacao_id, categoria in veiculos:
+        meses = db.execute(
+            select(UsoHoras.ano_mes).where(UsoHoras.veiculo_id == veiculo_id).distinct()
+        ).scalars()
+        grupos.update((ano_mes, organizacao_id, categoria) for ano_mes in meses)
+    return grupos
+
+def reconstruir_uso_mensal(db: Session) -> int:
+    """
+    Refaz a tabela agregada inteira a partir de uso_horas
+    
+    Returns:
+        int: Quantidade de grupos gravados
+    """
+    db.execute(delete(UsoHorasMensal))
+    gravados = db.execute(insert(UsoHorasMensal).from_select(_COLUNAS, _agregacao())).rowcount
+    anotar_escrita(db, UsoHorasMensal.__tablename__)
+    db.merge(SistemaMeta(chave=CHAVE_CONSTRUIDA, valor="1"))
+    db.commit()
+    return gravados
+
+def sincronizar_uso_mensal(db: Session) -> int:
+    """Constrói a tabela agregada se ela ainda não foi construída neste banco"""
+    if db.get(SistemaMeta, CHAVE_CONSTRUIDA) is not None:
+        return 0
+    return reconstruir_uso_mensal(db)
+
+# ====== EVENTOS DO ORM ======
+
+def _pendentes(session: Session) -> dict:
+    return session.info.setdefault("uso_mensal_pendentes", {"usos": set(), "veiculos": set()})
+
+def _anteriores(obj, campo: str) -> list:
+    """Valores atual e anteriores de um atributo no flush corrente"""
+    historico = inspect(obj).attrs[campo].history
+    return [getattr(obj, campo), *historico.deleted]
+
+@event.listens_for(Session, "after_flush")
+def _registrar_alteracoes(session, flush_context):
+    """Anota os usos gravados e os veículos que mudaram de organização ou categoria"""
+    pendentes = None
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, UsoHoras):
+            pendentes = pendentes or _pendentes(session)
+            for ano_mes in _anteriores(obj, "ano_mes"):
+                for veiculo_id in _anteriores(obj, "veiculo_id"):
+                    pendentes["usos"].add((ano_mes, veiculo_id))
+        elif isinstance(obj, Veiculo) and obj in session.dirty:
+            estado = inspect(obj)
+            if estado.attrs.organizacao_id.history.deleted or estado.attrs.categoria.history.deleted:
+                pendentes = pendentes or _pendentes(session)
+                for organizacao_id in _anteriores(obj, "organizacao_id"):
+                    for categoria in _anteriores(obj, "categoria"):
+                        pendentes["veiculos"].add((obj.id, organizacao_id, categoria))
+
+@event.listens_for(Session, "after_flush_postexec")
+def _atualizar_grupos(session, flush_context):
+    """Recalcula os grupos afetados pelas alterações anotadas"""
+    pendentes = session.info.pop("uso_mensal_pendentes", None)
+    if not pendentes:
+        return
+    
+    with session.no_autoflush:
+        grupos = grupos_dos_usos(session, pendentes["usos"])
+        grupos |= grupos_dos_veiculos(session, pendentes["veiculos"])
+        if grupos:
+            recalcular_grupos(session, grupos)
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_pendentes(session):
+    session.info.pop("uso_mensal_pendentes", None)
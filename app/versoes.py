@@ -0,0 +1,90 @@
+"""
+Versões de conteúdo por tabela, usadas como validadores HTTP (ETag/Last-Modified)
+
+As versões ficam no banco (versao_tabela): o commit que altera uma tabela
+incrementa a versão dela na mesma transação (chamado por app.cache antes do
+commit). Assim os validadores são os mesmos em todos os processos e
+sobrevivem a reinícios; cada requisição condicional custa uma leitura por
+chave primária.
+"""
+import time
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+
+from app.models import VersaoTabela
+
+# Versão e instante (epoch) da última escrita de cada tabela
+Estado = Dict[str, Tuple[int, float]]
+
+_tabela = VersaoTabela.__table__
+
+# Tabelas nunca versionadas contam como modificadas no início do processo
+_inicio = time.time()
+
+def incrementar_versoes(session: Session, tabelas: Iterable[str]):
+    """Incrementa, na transação da sessão, a versão de cada tabela alterada"""
+    tabelas = set(tabelas)
+    agora = datetime.utcnow()
+    atualizadas = set(session.execute(
+        update(_tabela)
+        .where(_tabela.c.tabela.in_(sorted(tabelas)))
+        .values(versao=_tabela.c.versao + 1, modificado_em=agora)
+        .returning(_tabela.c.tabela)
+    ).scalars())
+    novas = tabelas - atualizadas
+    if novas:
+        session.execute(insert(_tabela), [
+            {"tabela": tabela, "versao": 1, "modificado_em": agora} for tabela in sorted(novas)
+        ])
+
+def ler_estado(db: Session, tabelas: Iterable[str]) -> Estado:
+    """Versão e instante da última escrita das tabelas informadas, lidos do banco"""
+    linhas = db.execute(
+        select(_tabela.c.tabela, _tabela.c.versao, _tabela.c.modificado_em)
+        .where(_tabela.c.tabela.in_(sorted(set(tabelas))))
+    ).all()
+    return {
+        tabela: (versao, modificado_em.replace(tzinfo=timezone.utc).timestamp())
+        for tabela, versao, modificado_em in linhas
+    }
+
+def versao(estado: Estado, tabelas: Iterable[str]) -> str:
+    """Versão combinada de um recurso que depende das tabelas informadas"""
+    return "-".join(f"{estado.get(t, (0,))[0]}" for t in sorted(tabelas))
+
+def etag(recurso: str, estado: Estado, tabelas: Iterable[str]) -> str:
+    """ETag fraca do recurso na versão atual"""
+    return f'W/"{recurso}-{versao(estado, tabelas)}"'
+
+def modificado_em(estado: Estado, tabelas: Iterable[str]) -> float:
+    """Instante (epoch) da última escrita em alguma das tabelas"""
+    return max([_inicio if t not in estado else estado[t][1] for t in tabelas], default=_inicio)
+
+def last_modified(estado: Estado, tabelas: Iterable[str]) -> str:
+    """Valor do cabeçalho Last-Modified"""
+    return formatdate(modificado_em(estado, tabelas), usegmt=True)
+
+def nao_modificado(
+    estado: Estado,
+    tabelas: Iterable[str],
+    etag_atual: str,
+    if_none_match: Optional[str],
+    if_modified_since: Optional[str]
+) -> bool:
+    """Avalia os cabeçalhos condicionais da requisição (RFC 7232)"""
+    if if_none_match:
+        candidatas = {c.strip() for c in if_none_match.split(",")}
+        return "*" in candidatas or etag_atual in candidatas
+    
+    if if_modified_since:
+        try:
+            desde = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(modificado_em(estado, tabelas)) <= int(desde)
+    
+    return False
@@ -0,0 +1,57 @@
+"""
+Fixtures compartilhadas pelos testes: banco SQLite temporário com organizações e veículos
+
+Os módulos ajustam os dados redefinindo as fixtures organizacoes e veiculos
+(listas de dicionários; veiculo() preenche os campos obrigatórios) ou
+estendem o banco redefinindo db sobre a fixture compartilhada.
+"""
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from app.db import Base
+from app.models import Organizacao, Veiculo
+
+def veiculo(veiculo_id: int, **campos) -> dict:
+    """Campos de um veículo de teste, com os obrigatórios preenchidos"""
+    return {
+        "id": veiculo_id,
+        "prefixo": f"PM-{veiculo_id:03d}",
+        "placa": f"ABC{veiculo_id:04d}",
+        "categoria": "SUV",
+        "organizacao_id": 1,
+        "municipio": "São Paulo",
+        "bairro": "Centro",
+        "area_atuacao": "Urbana",
+        **campos
+    }
+
+@pytest.fixture
+def organizacoes():
+    return [{"id": 1, "nome": "1º Batalhão", "tipo": "Batalhao"}]
+
+@pytest.fixture
+def veiculos():
+    return [veiculo(1), veiculo(2)]
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'sgv.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def db(engine, organizacoes, veiculos):
+    with Session(engine) as session:
+        session.add_all([Organizacao(**campos) for campos in organizacoes])
+        session.add_all([Veiculo(**campos) for campos in veiculos])
+        session.commit()
+        yield session
+
+@pytest.fixture
+def tabela(db):
+    """Linhas das colunas informadas, ordenadas"""
+    def ler(*colunas):
+        return sorted(db.execute(select(*colunas)).all())
+    return ler
@@ -8,6 +8,33 @@ class APIClient {
         this.defaultHeaders = {
             'Content-Type': 'application/json',
         };
+        // Validadores (ETag/Last-Modified) e última resposta de cada GET,
+        // limitados às URLs usadas mais recentemente (LRU)
+        this.validators = new Map();
+        this.maxValidators = 100;
+    }
+
+    /**
+     * Lê os validadores de uma URL, marcando-a como a mais recente
+     */
+    getValidator(url) {
+        const cached = this.validators.get(url);
+        if (cached) {
+            this.validators.delete(url);
+            this.validators.set(url, cached);
+        }
+        return cached;
+    }
+
+    /**
+     * Guarda os validadores de uma URL, descartando as menos usadas
+     */
+    setValidator(url, validator) {
+        this.validators.delete(url);
+        this.validators.set(url, validator);
+        while (this.validators.size > this.maxValidators) {
+            this.validators.delete(this.validators.keys().next().value);
+        }
     }
 
     /**
@@ -20,20 +47,39 @@ class APIClient {
             ...options
         };
 
+        const method = (config.method || 'GET').toUpperCase();
+        const cached = method === 'GET' ? this.getValidator(url) : null;
+        if (cached) {
+            config.headers = { ...config.headers };
+            if (cached.etag) config.headers['If-None-Match'] = cached.etag;
+            if (cached.lastModified) config.headers['If-Modified-Since'] = cached.lastModified;
+        }
+
         try {
             const response = await fetch(url, config);
 
+            // Conteúdo inalterado: reaproveitar a última resposta
+            if (response.status === 304 && cached) {
+                return cached.data;
+            }
+
             if (!response.ok) {
                 const errorData = await response.json().catch(() => ({}));
                 throw new Error(errorData.detail || `HTTP ${response.status}: ${response.statusText}`);
             }
 
             const contentType = response.headers.get('content-type');
-            if (contentType && contentType.includes('application/json')) {
-                return await response.json();
+            const data = contentType && contentType.includes('application/json')
+                ? await response.json()
+                : await response.text();
+
+            const etag = response.headers.get('ETag');
+            const lastModified = response.headers.get('Last-Modified');
+            if (method === 'GET' && (etag || lastModified)) {
+                this.setValidator(url, { etag, lastModified, data });
             }
 
-            return await response.text();
+            return data;
         } catch (error) {
             console.error(`Erro na requisição para ${endpoint}:`, error);
             throw error;
@@ -104,6 +150,10 @@ class APIClient {
         return this.get('/api/geo/bases', params);
     }
 
+    async getGeoTile(z, x, y) {
+        return this.get(`/api/geo/tiles/${z}/${x}/${y}`);
+    }
+
     async getGeoViaturas(filtros = {}) {
         return this.get('/api/geo/viaturas', filtros);
     }
@@ -112,7 +162,25 @@ class APIClient {
         return this.upload('/api/geo/upload', file, { tipo });
     }
 
+    /**
+     * Assina o stream de posições (Server-Sent Events)
+     * @param {Object} handlers - Funções por evento ("posicoes", "resync")
+     * @returns {EventSource}
+     */
+    streamPosicoes(handlers = {}) {
+        const source = new EventSource(`${this.baseURL}/api/posicoes/stream`);
+        Object.entries(handlers).forEach(([evento, handler]) => {
+            source.addEventListener(evento, (e) => handler(JSON.parse(e.data)));
+        });
+        return source;
+    }
+
     // ====== ENDPOINTS DASHBOARD ======
+    async getDashboardResumo(campos = null, limit = 10) {
+        const params = campos ? { campos: campos.join(','), limit } : { limit };
+        return this.get('/api/dashboard/summary', params);
+    }
+
     async getKPIs() {
         return this.get('/api/dashboard/kpis');
     }
@@ -137,6 +205,14 @@ class APIClient {
         return this.get('/api/dashboard/top_manutencoes', { limit });
     }
 
+    async getCustoPorCategoria() {
+        return this.get('/api/dashboard/custo_por_categoria');
+    }
+
+    async getTopCustos(limit = 10) {
+        return this.get('/api/dashboard/top_custos', { limit });
+    }
+
     async getRecomendacoes() {
         return this.get('/api/recomendacoes');
     }
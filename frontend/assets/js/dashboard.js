@@ -113,38 +113,30 @@ class SGVDashboard {
             console.log('🔄 Iniciando carregamento de dados...');
             SGVUtils.showLoading();
 
-            console.log('📡 Testando endpoint individual...');
-            // Testar um endpoint primeiro
-            const testKpis = await SGVApi.api.getKPIs();
-            console.log('✅ Teste KPIs:', testKpis);
-
-            console.log('📊 Carregando todos os dados em paralelo...');
-            // Carregar todos os dados em paralelo
-            const [
+            console.log('📊 Carregando resumo do dashboard...');
+            // Todos os painéis em uma única requisição
+            const resumo = await SGVApi.api.getDashboardResumo(null, 10);
+            const {
                 kpis,
-                vidaUtilCategoria,
-                fipeCategoria,
-                topRodados,
-                topHoras,
-                topManutencoes,
+                vida_util_por_categoria: vidaUtilCategoria,
+                fipe_por_categoria: fipeCategoria,
+                top_rodados: topRodados,
+                top_horas: topHoras,
+                top_manutencoes: topManutencoes,
+                custo_por_categoria: custoCategoria,
+                top_custos: topCustos,
                 recomendacoes
-            ] = await Promise.all([
-                SGVApi.api.getKPIs(),
-                SGVApi.api.getVidaUtilPorCategoria(),
-                SGVApi.api.getFipePorCategoria(),
-                SGVApi.api.getTopRodados(10),
-                SGVApi.api.getTopHoras(10),
-                SGVApi.api.getTopManutencoes(10),
-                SGVApi.api.getRecomendacoes()
-            ]);
-
-            console.log('📦 Dados individuais carregados:');
+            } = resumo;
+
+            console.log('📦 Dados carregados:');
             console.log('  KPIs:', kpis);
             console.log('  Vida Útil:', vidaUtilCategoria?.length, 'categorias');
             console.log('  FIPE:', fipeCategoria?.length, 'categorias');
             console.log('  Top Rodados:', topRodados?.length, 'veículos');
             console.log('  Top Horas:', topHoras?.length, 'veículos');
             console.log('  Top Manutenções:', topManutencoes?.length, 'veículos');
+            console.log('  Custos:', custoCategoria?.length, 'categorias');
+            console.log('  Top Custos:', topCustos?.length, 'veículos');
             console.log('  Recomendações:', recomendacoes?.length, 'itens');
 
             // Armazenar dados
@@ -155,6 +147,8 @@ class SGVDashboard {
                 topRodados,
                 topHoras,
                 topManutencoes,
+                custoCategoria,
+                topCustos,
                 recomendacoes
             };
 
@@ -465,6 +459,8 @@ class SGVDashboard {
             this.renderTopRodadosTable();
             this.renderTopHorasTable();
             this.renderTopManutencoesTable();
+            this.renderCustosTable();
+            this.renderTopCustosTable();
         } catch (error) {
             console.error('❌ Erro ao renderizar tabelas:', error);
             throw error;
@@ -641,6 +637,53 @@ class SGVDashboard {
         });
     }
 
+    /**
+     * Tabela de Custos de Manutenção por Categoria
+     */
+    renderCustosTable() {
+        const tbody = document.querySelector('#table-custos tbody');
+        const { custoCategoria } = this.data;
+
+        if (!tbody || !custoCategoria) return;
+        tbody.innerHTML = '';
+
+        custoCategoria.forEach(item => {
+            const row = document.createElement('tr');
+            row.innerHTML = `
+                <td><strong>${item.categoria}</strong></td>
+                <td><strong>${SGVUtils.formatCurrency(item.custo_12m)}</strong></td>
+                <td>${SGVUtils.formatCurrency(item.custo_12m_medio)}</td>
+                <td>${SGVUtils.formatCurrency(item.custo_total)}</td>
+                <td>${SGVUtils.formatCurrency(item.custo_por_km)}/km</td>
+            `;
+            tbody.appendChild(row);
+        });
+    }
+
+    /**
+     * Tabela TOP Maior Custo de Manutenção
+     */
+    renderTopCustosTable() {
+        const tbody = document.querySelector('#table-top-custos tbody');
+        const { topCustos } = this.data;
+
+        if (!tbody || !topCustos) return;
+        tbody.innerHTML = '';
+
+        topCustos.forEach((item, index) => {
+            const row = document.createElement('tr');
+            row.innerHTML = `
+                <td>
+                    <span class="ranking-position">${index + 1}º</span>
+                    <strong>${item.prefixo}</strong>
+                </td>
+                <td>${item.categoria}</td>
+                <td><strong>${SGVUtils.formatCurrency(item.valor)}</strong></td>
+            `;
+            tbody.appendChild(row);
+        });
+    }
+
     /**
      * Renderiza recomendações de descarte
      */
@@ -673,7 +716,7 @@ class SGVDashboard {
                         <span class="vehicle-category">(${rec.categoria})</span>
                     </div>
                     <span class="recommendation-nota ${notaClass}">
-                        Nota: ${rec.nota_ocupacao}
+                        Nota: ${rec.nota_ocupacao ?? '-'}
                     </span>
                 </div>
                 <div class="recommendation-org">
@@ -15,6 +15,23 @@ class SGVMap {
         this.currentFilters = {};
         this.initialized = false;
 
+        // Área coberta pela camada de viaturas (null = todas as viaturas do filtro)
+        this.viaturasBounds = null;
+        this.viaturasZoom = null;
+        this.viaturasAgrupadas = false;
+        this.viewportPadding = 0.5;
+
+        // Versão de linha das viaturas carregadas, para atualizações incrementais
+        this.viaturasVersao = null;
+        this.refreshInterval = 60000;
+        this.refreshTimer = null;
+
+        // Features dos tiles de batalhões carregados, por "z:x:y"
+        this.batalhoesTiles = new Map();
+
+        // Stream de posições das viaturas
+        this.posicoesSource = null;
+
         // Configurações padrão
         this.defaultCenter = [-23.550520, -46.633308]; // Centro de SP
         this.defaultZoom = 10;
@@ -96,6 +113,12 @@ class SGVMap {
             // Carregar dados iniciais
             await this.loadInitialData();
 
+            // Receber posições em tempo real
+            this.connectPosicoes();
+
+            // Buscar periodicamente apenas as viaturas alteradas
+            this.refreshTimer = setInterval(() => this.refreshViaturas(), this.refreshInterval);
+
             this.initialized = true;
             console.log('✅ Mapa inicializado com sucesso');
 
@@ -110,6 +133,7 @@ class SGVMap {
      */
     initLayers() {
         // Criar grupos de camadas
+        this.map.createPane('batalhoesPane').style.zIndex = 350;
         this.layers.batalhoes = L.layerGroup().addTo(this.map);
         this.layers.bases = L.layerGroup().addTo(this.map);
         this.layers.viaturas = L.layerGroup().addTo(this.map);
@@ -140,10 +164,15 @@ class SGVMap {
             this.updateMarkersVisibility();
         });
 
-        // Evento de movimento
-        this.map.on('moveend', () => {
-            // Pode ser usado para carregar dados por região
+        // Clique nos polígonos dos batalhões (desenhados em tiles)
+        this.map.on('click', (e) => {
+            this.openBatalhaoPopup(e);
         });
+
+        // Evento de movimento: carregar viaturas da área visível
+        this.map.on('moveend', SGVUtils.debounce(() => {
+            this.loadViaturasViewport();
+        }, 300));
     }
 
     /**
@@ -153,15 +182,17 @@ class SGVMap {
         try {
             SGVUtils.showLoading();
 
-            // Carregar em paralelo
-            const [batalhoes, bases, viaturas] = await Promise.all([
-                SGVApi.api.getGeoBatalhoes(),
+            // Carregar em paralelo (viaturas apenas da área visível)
+            const viewport = this.getViewportBounds();
+            const zoom = this.map.getZoom();
+            const [bases, viaturas] = await Promise.all([
                 SGVApi.api.getGeoBases(),
-                SGVApi.api.getGeoViaturas()
+                SGVApi.api.getGeoViaturas({ bbox: this.toBBox(viewport), zoom })
             ]);
+            this.setViaturasCarregadas(viaturas, viewport, zoom);
 
             // Adicionar às camadas
-            this.addBatalhoesLayer(batalhoes);
+            this.addBatalhoesLayer();
             this.addBasesLayer(bases);
             this.addViaturasLayer(viaturas);
 
@@ -178,29 +209,255 @@ class SGVMap {
     }
 
     /**
- * Adiciona camada de batalhões (polígonos)
+     * Área visível do mapa, com margem para evitar recargas em pequenos movimentos
+     */
+    getViewportBounds() {
+        return this.map.getBounds().pad(this.viewportPadding);
+    }
+
+    /**
+     * Converte bounds do Leaflet em bbox minLon,minLat,maxLon,maxLat
+     */
+    toBBox(bounds) {
+        const clamp = (valor, limite) => Math.max(-limite, Math.min(limite, valor));
+        return [
+            clamp(bounds.getWest(), 180),
+            clamp(bounds.getSouth(), 90),
+            clamp(bounds.getEast(), 180),
+            clamp(bounds.getNorth(), 90)
+        ].map(v => v.toFixed(6)).join(',');
+    }
+
+    /**
+     * Registra a área, o zoom e o modo (clusters ou pontos) da camada de viaturas
+     */
+    setViaturasCarregadas(geojson, bounds, zoom) {
+        this.viaturasBounds = bounds;
+        this.viaturasZoom = zoom;
+        this.viaturasAgrupadas = Boolean(geojson && geojson.agrupado);
+        this.viaturasVersao = geojson && geojson.versao !== undefined ? geojson.versao : null;
+    }
+
+    /**
+     * Atualiza a camada de viaturas apenas com o que mudou desde a versão carregada
+     */
+    async refreshViaturas() {
+        // Clusters são sempre recarregados por inteiro
+        if (this.viaturasAgrupadas || this.viaturasVersao === null) {
+            return this.loadViaturasViewport(true);
+        }
+
+        try {
+            const params = { ...this.currentFilters, since: this.viaturasVersao };
+            if (this.viaturasBounds) {
+                params.bbox = this.toBBox(this.viaturasBounds);
+            }
+            const delta = await SGVApi.api.getGeoViaturas(params);
+            this.applyViaturasDelta(delta);
+        } catch (error) {
+            console.error('Erro ao atualizar viaturas:', error);
+        }
+    }
+
+    /**
+     * Aplica uma resposta incremental: substitui as alteradas e remove as que saíram
+     * @param {Object} delta - FeatureCollection com versao e removidos
+     */
+    applyViaturasDelta(delta) {
+        if (!delta || !delta.features) return;
+
+        const substituidos = new Set(delta.removidos || []);
+        delta.features.forEach(feature => substituidos.add(feature.properties.veiculo_id));
+
+        this.layers.viaturas.eachLayer(layer => {
+            if (layer.properties && substituidos.has(layer.properties.veiculo_id)) {
+                this.layers.viaturas.removeLayer(layer);
+            }
+        });
+        this.addViaturasLayer(delta);
+        this.viaturasVersao = delta.versao;
+
+        if (substituidos.size > 0) {
+            this.updateLegendStats();
+        }
+    }
+
+    /**
+     * Recarrega as viaturas quando a área visível sai da área já carregada
+     * ou quando o zoom muda o nível de agrupamento
+     */
+    async loadViaturasViewport(force = false) {
+        // Camada com todas as viaturas do filtro
+        if (!this.viaturasBounds) return;
+
+        const zoom = this.map.getZoom();
+        const mudouNivel = this.viaturasAgrupadas ? zoom !== this.viaturasZoom : zoom < this.viaturasZoom;
+        if (!force && !mudouNivel && this.viaturasBounds.contains(this.map.getBounds())) {
+            return;
+        }
+
+        try {
+            const viewport = this.getViewportBounds();
+            const viaturas = await SGVApi.api.getGeoViaturas({
+                ...this.currentFilters,
+                bbox: this.toBBox(viewport),
+                zoom
+            });
+
+            this.layers.viaturas.clearLayers();
+            this.addViaturasLayer(viaturas);
+            this.setViaturasCarregadas(viaturas, viewport, zoom);
+            this.updateLegendStats();
+        } catch (error) {
+            console.error('Erro ao carregar viaturas da área visível:', error);
+        }
+    }
+
+    /**
+     * Conecta ao stream de posições das viaturas
+     */
+    connectPosicoes() {
+        if (this.posicoesSource || typeof EventSource === 'undefined') return;
+
+        this.posicoesSource = SGVApi.api.streamPosicoes({
+            posicoes: (delta) => this.applyPosicoes(delta),
+            // Mensagens perdidas: buscar as alterações desde a versão carregada
+            resync: () => this.refreshViaturas()
+        });
+    }
+
+    /**
+     * Move os marcadores das viaturas com posição alterada
+     * @param {Object} delta - { t, v: [[veiculo_id, lon, lat], ...] }
+     */
+    applyPosicoes(delta) {
+        // Clusters são recalculados apenas ao recarregar a área
+        if (!delta || !delta.v || this.viaturasAgrupadas) return;
+
+        const posicoes = new Map(delta.v.map(([id, lon, lat]) => [id, [lat, lon]]));
+        this.layers.viaturas.eachLayer(layer => {
+            const posicao = layer.properties && posicoes.get(layer.properties.veiculo_id);
+            if (posicao) {
+                layer.setLatLng(posicao);
+            }
+        });
+    }
+
+    /**
+ * Adiciona camada de batalhões (polígonos em tiles recortados e simplificados)
  */
-    addBatalhoesLayer(geojson) {
-        if (!geojson || !geojson.features) return;
+    addBatalhoesLayer() {
+        const sgvMap = this;
+        const TileLayer = L.GridLayer.extend({
+            createTile(coords, done) {
+                const tile = L.DomUtil.create('canvas', 'leaflet-tile');
+                const size = this.getTileSize();
+                tile.width = size.x;
+                tile.height = size.y;
+
+                SGVApi.api.getGeoTile(coords.z, coords.x, coords.y)
+                    .then(geojson => {
+                        sgvMap.drawBatalhoesTile(tile, coords, geojson);
+                        done(null, tile);
+                    })
+                    .catch(error => done(error, tile));
+
+                return tile;
+            }
+        });
 
-        geojson.features.forEach(feature => {
-            const layer = L.geoJSON(feature, {
-                style: this.styles.batalhao,
-                onEachFeature: (feature, layer) => {
-                    const props = feature.properties;
-                    const popupContent = `
-                        <div class="popup-content">
-                            <h4>🏛️ ${props.batalhao_nome}</h4>
-                            <p><strong>📍 Município:</strong> ${props.municipio}</p>
-                            <p><strong>📊 Tipo:</strong> Área de Atuação</p>
-                        </div>
-                    `;
-                    layer.bindPopup(popupContent, { maxWidth: 300 });
-                }
+        const layer = new TileLayer({ pane: 'batalhoesPane' });
+        layer.on('tileunload', (e) => {
+            this.batalhoesTiles.delete(`${e.coords.z}:${e.coords.x}:${e.coords.y}`);
+        });
+
+        this.layers.batalhoes.clearLayers();
+        this.layers.batalhoes.addLayer(layer);
+    }
+
+    /**
+     * Desenha os polígonos de um tile de batalhões no canvas
+     */
+    drawBatalhoesTile(canvas, coords, geojson) {
+        const ctx = canvas.getContext('2d');
+        const origem = coords.scaleBy(L.point(canvas.width, canvas.height));
+        const style = this.styles.batalhao;
+        const features = (geojson.features || []).filter(feature =>
+            feature.properties.camada === 'batalhoes' &&
+            ['Polygon', 'MultiPolygon'].includes(feature.geometry.type)
+        );
+
+        ctx.lineWidth = style.weight;
+        ctx.strokeStyle = style.color;
+        ctx.fillStyle = style.fillColor;
+
+        features.forEach(feature => {
+            ctx.beginPath();
+            this.getPolygonRings(feature.geometry).forEach(ring => {
+                ring.forEach(([lon, lat], i) => {
+                    const p = this.map.project([lat, lon], coords.z).subtract(origem);
+                    if (i === 0) ctx.moveTo(p.x, p.y);
+                    else ctx.lineTo(p.x, p.y);
+                });
+                ctx.closePath();
             });
+            ctx.globalAlpha = style.fillOpacity;
+            ctx.fill('evenodd');
+            ctx.globalAlpha = 1;
+            ctx.stroke();
+        });
 
-            this.layers.batalhoes.addLayer(layer);
+        this.batalhoesTiles.set(`${coords.z}:${coords.x}:${coords.y}`, features);
+    }
+
+    /**
+     * Anéis de um Polygon ou MultiPolygon
+     */
+    getPolygonRings(geometry) {
+        return geometry.type === 'Polygon' ? geometry.coordinates : geometry.coordinates.flat();
+    }
+
+    /**
+     * Abre o popup do batalhão sob o clique, a partir das features do tile
+     */
+    openBatalhaoPopup(e) {
+        // Cliques em marcadores têm popup próprio
+        const target = e.originalEvent && e.originalEvent.target;
+        if (target && target.classList && target.classList.contains('leaflet-interactive')) return;
+        if (!this.map.hasLayer(this.layers.batalhoes)) return;
+
+        const z = Math.round(this.map.getZoom());
+        const tile = this.map.project(e.latlng, z).divideBy(256).floor();
+        const features = this.batalhoesTiles.get(`${z}:${tile.x}:${tile.y}`) || [];
+        const { lat, lng } = e.latlng;
+
+        const feature = features.find(f => {
+            // Par-ímpar: dentro se cruzar um número ímpar de arestas
+            let dentro = false;
+            this.getPolygonRings(f.geometry).forEach(ring => {
+                for (let i = 0, j = ring.length - 1; i < ring.length; j = i++) {
+                    const [xi, yi] = ring[i];
+                    const [xj, yj] = ring[j];
+                    if ((yi > lat) !== (yj > lat) && lng < (xj - xi) * (lat - yi) / (yj - yi) + xi) {
+                        dentro = !dentro;
+                    }
+                }
+            });
+            return dentro;
         });
+        if (!feature) return;
+
+        const props = feature.properties;
+        L.popup({ maxWidth: 300 })
+            .setLatLng(e.latlng)
+            .setContent(`
+                <div class="popup-content">
+                    <h4>🏛️ ${props.batalhao_nome}</h4>
+                    <p><strong>📍 Município:</strong> ${props.municipio}</p>
+                    <p><strong>📊 Tipo:</strong> Área de Atuação</p>
+                </div>
+            `)
+            .openOn(this.map);
     }
 
     /**
@@ -242,6 +499,11 @@ class SGVMap {
             const props = feature.properties;
             const coords = feature.geometry.coordinates;
 
+            if (props.cluster) {
+                this.addClusterMarker(feature);
+                return;
+            }
+
             // Determinar estilo baseado na nota de ocupação
             const nota = props.nota_ocupacao || 0;
             const faixaKey = this.getNotaFaixaKey(nota);
@@ -262,6 +524,45 @@ class SGVMap {
         });
     }
 
+    /**
+     * Adiciona um cluster de viaturas (zoom baixo)
+     */
+    addClusterMarker(feature) {
+        const props = feature.properties;
+        const coords = feature.geometry.coordinates;
+        const latLng = [coords[1], coords[0]];
+
+        // Cor pela faixa mais grave do cluster, tamanho pela quantidade
+        const style = this.styles.viatura[this.getFaixaKey(props.faixa)];
+        const marker = L.circleMarker(latLng, {
+            ...style,
+            radius: Math.min(30, 10 + 2 * Math.sqrt(props.quantidade))
+        });
+
+        marker.bindTooltip(String(props.quantidade), {
+            permanent: true,
+            direction: 'center',
+            className: 'cluster-label'
+        });
+
+        // Aproximar ao clicar
+        marker.on('click', () => {
+            this.map.setView(latLng, this.map.getZoom() + 2);
+        });
+
+        marker.properties = props;
+        this.layers.viaturas.addLayer(marker);
+    }
+
+    /**
+     * Chave de estilo a partir do nome da faixa
+     */
+    getFaixaKey(faixa) {
+        if (faixa === 'Adequado') return 'good';
+        if (faixa === 'Atenção') return 'warning';
+        return 'critical';
+    }
+
     /**
      * Determina a chave da faixa baseada na nota de ocupação
      */
@@ -361,9 +662,10 @@ class SGVMap {
             // Limpar camada de viaturas
             this.layers.viaturas.clearLayers();
 
-            // Carregar viaturas filtradas
+            // Carregar viaturas filtradas (todas, para ajustar a visualização)
             const viaturas = await SGVApi.api.getGeoViaturas(filters);
             this.addViaturasLayer(viaturas);
+            this.setViaturasCarregadas(viaturas, null, this.map.getZoom());
 
             // Atualizar estatísticas da legenda
             this.updateLegendStats();
@@ -453,9 +755,10 @@ class SGVMap {
         // Ajustar opacidade baseado no zoom, mas manter as cores
         this.layers.viaturas.eachLayer(layer => {
             const props = layer.properties;
-            const nota = props.nota_ocupacao || 0;
-            const faixaKey = this.getNotaFaixaKey(nota);
-            const baseStyle = this.styles.viatura[faixaKey];
+            const faixaKey = props.cluster
+                ? this.getFaixaKey(props.faixa)
+                : this.getNotaFaixaKey(props.nota_ocupacao || 0);
+            const baseStyle = { ...this.styles.viatura[faixaKey], radius: layer.getRadius() };
 
             if (zoom < 8) {
                 // Zoom baixo: reduzir opacidade mas manter cores
@@ -598,6 +901,16 @@ class SGVMap {
 
         this.layers.viaturas.eachLayer(layer => {
             const props = layer.properties;
+
+            // Clusters trazem a contagem por faixa
+            if (props.cluster) {
+                Object.entries(props.faixas).forEach(([faixa, quantidade]) => {
+                    stats[this.getFaixaKey(faixa)] += quantidade;
+                });
+                stats.total += props.quantidade;
+                return;
+            }
+
             const nota = props.nota_ocupacao || 0;
             const faixaKey = this.getNotaFaixaKey(nota);
 
@@ -642,6 +955,14 @@ class SGVMap {
      * Destroi o mapa
      */
     destroy() {
+        if (this.refreshTimer) {
+            clearInterval(this.refreshTimer);
+            this.refreshTimer = null;
+        }
+        if (this.posicoesSource) {
+            this.posicoesSource.close();
+            this.posicoesSource = null;
+        }
         if (this.map) {
             this.map.remove();
             this.map = null;
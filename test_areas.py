@@ -0,0 +1,85 @@
+"""
+Testes da atribuição de áreas dos batalhões mantida pelas gravações dos polígonos
+"""
+import io
+import json
+
+import pytest
+from sqlalchemy import update
+
+from conftest import veiculo
+from app import geo
+from app.importacao import importar_geojson
+from app.models import Veiculo, GeoBatalhoes
+
+def _quadrado(lon: float, lat: float, lado: float = 0.1) -> dict:
+    anel = [[lon, lat], [lon + lado, lat], [lon + lado, lat + lado], [lon, lat + lado], [lon, lat]]
+    return {"type": "Feature", "geometry": {"type": "Polygon", "coordinates": [anel]}, "properties": {}}
+
+@pytest.fixture
+def veiculos():
+    return [
+        veiculo(1, latitude=-23.55, longitude=-46.65),
+        veiculo(2, latitude=-10.0, longitude=-40.0)
+    ]
+
+@pytest.fixture
+def db(db, monkeypatch):
+    monkeypatch.setattr(geo, "_indice_areas", None)
+    # Fora de qualquer polígono alterado: o valor não pode ser recalculado
+    db.execute(update(Veiculo).where(Veiculo.id == 2).values(geo_batalhao_id=99))
+    db.commit()
+    return db
+
+def _areas(db):
+    db.expire_all()
+    return db.get(Veiculo, 1).geo_batalhao_id, db.get(Veiculo, 2).geo_batalhao_id
+
+def test_gravacao_orm_recalcula_so_dentro_das_caixas(db):
+    area = GeoBatalhoes(municipio="São Paulo", batalhao_nome="1º Batalhão", geojson=_quadrado(-46.7, -23.6))
+    db.add(area)
+    db.commit()
+    assert _areas(db) == (area.id, 99)
+    
+    # Polígono movido: a caixa anterior também é recalculada
+    area.geojson = _quadrado(-45.0, -22.0)
+    db.commit()
+    assert _areas(db) == (None, 99)
+    
+    db.add(GeoBatalhoes(municipio="São Paulo", batalhao_nome="2º Batalhão", geojson=_quadrado(-46.7, -23.6)))
+    db.flush()
+    db.rollback()
+    assert _areas(db) == (None, 99)
+
+def test_importacao_de_batalhoes_recalcula_areas(db):
+    def importar(feature):
+        feature["properties"] = {"municipio": "São Paulo", "batalhao_nome": "1º Batalhão"}
+        arquivo = io.BytesIO(json.dumps({"type": "FeatureCollection", "features": [feature]}).encode())
+        assert importar_geojson(db, "batalhoes", arquivo)["importadas"] == 1
+        return db.query(GeoBatalhoes.id).scalar()
+    
+    area_id = importar(_quadrado(-46.7, -23.6))
+    assert _areas(db) == (area_id, 99)
+    
+    # Substituição por um polígono que não contém mais o veículo
+    importar(_quadrado(-45.0, -22.0))
+    assert _areas(db) == (None, 99)
+
+def test_sincronizacao_inicial_desmarca_so_apos_commit(db, monkeypatch):
+    monkeypatch.setattr(geo, "_areas_pendentes", True)
+    commit = db.commit
+    
+    def falhar():
+        raise RuntimeError("falha no commit")
+    monkeypatch.setattr(db, "commit", falhar)
+    with pytest.raises(RuntimeError):
+        geo.sincronizar_areas(db)
+    assert geo._areas_pendentes
+    
+    db.rollback()
+    monkeypatch.setattr(db, "commit", commit)
+    # Sem polígonos, a frota inteira fica sem área
+    assert geo.sincronizar_areas(db) == 1
+    assert _areas(db) == (None, None)
+    assert not geo._areas_pendentes
+    assert geo.sincronizar_areas(db) == 0
@@ -0,0 +1,83 @@
+"""
+Testes do cache de resultados dos serviços (chaves, cópias, invalidação, LRU e TTL)
+"""
+from typing import List, Optional
+
+import pytest
+
+from app.cache import CacheResultados, cache_resultado, cache_servicos, registrar_escrita
+from app.schemas import PontoUsoHoras
+
+chamadas = []
+
+@cache_resultado("tabela_teste")
+def _servico(db, campos: Optional[List[str]] = None, limit: int = 10, **filtros) -> List[PontoUsoHoras]:
+    chamadas.append((campos, limit, filtros))
+    return [PontoUsoHoras(ano_mes="2024-01", horas=limit, registros=1, media_horas=limit)]
+
+@cache_resultado("tabela_teste")
+def _servico_nulo(db, veiculo_id: int) -> None:
+    chamadas.append(veiculo_id)
+    return None
+
+@pytest.fixture(autouse=True)
+def limpar():
+    cache_servicos.invalidar()
+    chamadas.clear()
+    yield
+    cache_servicos.invalidar()
+
+def test_chave_com_padroes_e_argumentos_nomeados():
+    _servico(None)
+    _servico(None, None, 10)
+    _servico(None, limit=10)
+    assert len(chamadas) == 1
+    
+    _servico(None, limit=5)
+    _servico(None, None, 5)
+    assert len(chamadas) == 2
+
+def test_chave_independe_da_ordem_de_conjuntos_e_filtros():
+    _servico(None, {"kpis", "top_rodados", "top_horas"}, comando="Metropolitano", ativo=True)
+    _servico(None, {"top_horas", "kpis", "top_rodados"}, ativo=True, comando="Metropolitano")
+    assert len(chamadas) == 1
+
+def test_resultado_copiado():
+    primeiro = _servico(None)
+    primeiro[0].horas = -1
+    primeiro.append(None)
+    
+    segundo = _servico(None)
+    assert [p.horas for p in segundo] == [10]
+    segundo[0].horas = -2
+    assert _servico(None)[0].horas == 10
+    assert len(chamadas) == 1
+
+def test_resultado_nulo_em_cache():
+    assert _servico_nulo(None, 1) is None
+    assert _servico_nulo(None, veiculo_id=1) is None
+    assert chamadas == [1]
+
+def test_invalidacao_por_tabela():
+    _servico(None)
+    registrar_escrita({"outra_tabela"})
+    _servico(None)
+    assert len(chamadas) == 1
+    
+    registrar_escrita({"tabela_teste"})
+    _servico(None)
+    assert len(chamadas) == 2
+
+def test_lru_e_ttl():
+    cache = CacheResultados(ttl=60, max_itens=2)
+    cache.guardar(("a",), 1, ["t"])
+    cache.guardar(("b",), 2, ["t"])
+    assert cache.obter(("a",)) == 1
+    cache.guardar(("c",), 3, ["t"])
+    assert (cache.obter(("b",)), cache.obter(("a",)), cache.obter(("c",))) == (None, 1, 3)
+    assert cache.estatisticas()["despejados"] == 1
+    
+    expirado = CacheResultados(ttl=-1)
+    expirado.guardar(("a",), 1, ["t"])
+    assert expirado.obter(("a",), "ausente") == "ausente"
+    assert expirado.estatisticas()["expirados"] == 1
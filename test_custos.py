@@ -0,0 +1,89 @@
+"""
+Testes dos custos de manutenção acumulados (custo_manutencao_mensal)
+"""
+import random
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+from app.custos import custo_janela, deslocar_mes, reconstruir_custos
+from app.models import Veiculo, Manutencao, CustoManutencaoMensal
+from app.services import get_custos_veiculo
+from conftest import veiculo
+
+@pytest.fixture
+def veiculos():
+    return [veiculo(i, odometro_km=50_000) for i in (1, 2, 3)]
+
+def _manutencoes(rnd, quantidade):
+    return [
+        Manutencao(
+            veiculo_id=rnd.choice((1, 2)),
+            data=datetime(rnd.randint(2021, 2024), rnd.randint(1, 12), rnd.randint(1, 28)),
+            tipo="Revisão geral",
+            custo=round(rnd.uniform(100, 5000), 2)
+        )
+        for _ in range(quantidade)
+    ]
+
+def _tabela(db):
+    c = CustoManutencaoMensal
+    return [
+        (veiculo_id, ano_mes, round(custo, 6), quantidade, round(acumulado, 6), quantidade_acumulada)
+        for veiculo_id, ano_mes, custo, quantidade, acumulado, quantidade_acumulada in db.execute(
+            select(c.veiculo_id, c.ano_mes, c.custo, c.quantidade, c.custo_acumulado, c.quantidade_acumulada)
+            .order_by(c.veiculo_id, c.ano_mes)
+        )
+    ]
+
+def test_deslocar_mes():
+    assert deslocar_mes("2024-01", -1) == "2023-12"
+    assert deslocar_mes("2024-12", 1) == "2025-01"
+    assert deslocar_mes("2024-06", -29) == "2022-01"
+
+def test_incremental_igual_a_reconstrucao(db):
+    rnd = random.Random(7)
+    db.add_all(_manutencoes(rnd, 60))
+    db.commit()
+    
+    manutencoes = db.query(Manutencao).order_by(Manutencao.id).all()
+    manutencoes[0].custo = 0.0
+    manutencoes[1].veiculo_id = 3
+    manutencoes[2].data = datetime(2020, 1, 1)
+    db.delete(manutencoes[3])
+    db.commit()
+    
+    incremental = _tabela(db)
+    assert reconstruir_custos(db) == len(incremental)
+    assert _tabela(db) == incremental
+
+def test_janela_igual_a_soma_direta(db):
+    rnd = random.Random(11)
+    db.add_all(_manutencoes(rnd, 80))
+    db.commit()
+    
+    for ate, meses in (("2024-12", 12), ("2023-06", 6), ("2022-01", 1), ("2024-12", 60)):
+        inicio = deslocar_mes(ate, -(meses - 1))
+        for veiculo_id in (1, 2, 3):
+            esperado = sum(
+                m.custo for m in db.query(Manutencao).filter_by(veiculo_id=veiculo_id)
+                if inicio <= m.data.strftime("%Y-%m") <= ate
+            )
+            obtido = db.execute(select(custo_janela(meses, ate)).where(Veiculo.id == veiculo_id)).scalar()
+            assert obtido == pytest.approx(esperado)
+
+def test_custos_do_veiculo(db):
+    agora = datetime.now()
+    db.add_all([
+        Manutencao(veiculo_id=1, data=agora, tipo="Troca de óleo", custo=300.0),
+        Manutencao(veiculo_id=1, data=datetime(2000, 1, 1), tipo="Pintura", custo=1700.0)
+    ])
+    db.commit()
+    
+    custos = get_custos_veiculo(db, 1, meses=12)
+    assert (custos.custo_total, custos.manutencoes_total) == (2000.0, 2)
+    assert (custos.custo_janela, custos.manutencoes_janela) == (300.0, 1)
+    assert custos.custo_por_km == 0.04
+    assert [p.ano_mes for p in custos.serie] == [agora.strftime("%Y-%m")]
+    assert get_custos_veiculo(db, 99) is None
@@ -0,0 +1,95 @@
+"""
+Testes dos painéis do dashboard (uma única leitura da frota), comparados a um cálculo direto
+"""
+import random
+from collections import defaultdict
+
+import pytest
+from sqlalchemy import event, update
+
+from conftest import veiculo
+from app.services import KM_REFERENCIA_CATEGORIA, get_dashboard_resumo
+from app.cache import cache_servicos
+from app.models import Veiculo
+
+CATEGORIAS = ["SUV", "Moto", "Van", "Sedan", "Outra"]
+
+def _talvez(sorteio, valor):
+    return None if sorteio.random() < 0.1 else valor
+
+@pytest.fixture
+def organizacoes():
+    return [{"id": 1, "nome": "1º Batalhão", "tipo": "Batalhao"}, {"id": 2, "nome": "2º Batalhão", "tipo": "Batalhao"}]
+
+@pytest.fixture
+def veiculos():
+    sorteio = random.Random(3)
+    return [
+        veiculo(
+            i,
+            categoria=sorteio.choice(CATEGORIAS),
+            organizacao_id=sorteio.choice([1, 2]),
+            ativo=sorteio.random() < 0.8,
+            # Poucos valores distintos, para haver empates nas listas TOP
+            odometro_km=_talvez(sorteio, sorteio.choice([0, 50_000, 200_000, 330_000])),
+            horas_mes=_talvez(sorteio, sorteio.randint(0, 20) * 10),
+            manutencoes_6m=_talvez(sorteio, sorteio.randint(0, 7)),
+            valor_fipe=_talvez(sorteio, round(sorteio.uniform(20_000, 200_000), 2))
+        )
+        for i in range(1, 301)
+    ]
+
+@pytest.fixture
+def db(db):
+    # Algumas notas nulas (veículos ainda não calculados)
+    db.execute(update(Veiculo).where(Veiculo.id % 11 == 0).values(nota_ocupacao=None, faixa_ocupacao=None))
+    db.commit()
+    cache_servicos.invalidar()
+    return db
+
+def test_paineis_iguais_a_calculo_direto(db, engine):
+    comandos = []
+    
+    def registrar(conexao, cursor, comando, *args):
+        comandos.append(comando)
+    event.listen(engine, "before_cursor_execute", registrar)
+    resumo = get_dashboard_resumo(db, None, 15)
+    event.remove(engine, "before_cursor_execute", registrar)
+    # Uma única leitura da frota para todos os painéis
+    assert len(comandos) == 1
+    frota = db.query(Veiculo).order_by(Veiculo.id).all()
+    
+    assert resumo.kpis.frota_total == len(frota)
+    assert resumo.kpis.horas_mes_total == sum(v.horas_mes or 0 for v in frota)
+    
+    por_categoria = defaultdict(list)
+    for v in frota:
+        por_categoria[v.categoria].append(v)
+    vida_util = {c.categoria: c for c in resumo.vida_util_por_categoria}
+    assert set(vida_util) == set(por_categoria)
+    for categoria, veiculos in por_categoria.items():
+        notas = [v.nota_ocupacao for v in veiculos if v.nota_ocupacao is not None]
+        assert vida_util[categoria].nota_media == round(sum(notas) / len(notas), 1)
+        assert vida_util[categoria].veiculos_criticos == sum(v.faixa_ocupacao == "Crítico" for v in veiculos)
+        assert vida_util[categoria].km_media == round(sum(v.odometro_km or 0 for v in veiculos) / len(veiculos), 0)
+    fipe = {c.categoria: c.valor_fipe_total for c in resumo.fipe_por_categoria}
+    assert fipe == {c: round(sum(v.valor_fipe or 0.0 for v in vs), 2) for c, vs in por_categoria.items()}
+    
+    for campo, coluna in (("top_rodados", "odometro_km"), ("top_horas", "horas_mes"), ("top_manutencoes", "manutencoes_6m")):
+        esperado = sorted(frota, key=lambda v: (-(getattr(v, coluna) or 0), v.id))[:15]
+        assert [t.id for t in getattr(resumo, campo)] == [v.id for v in esperado]
+    
+    candidatos = [
+        v for v in frota
+        if (v.nota_ocupacao is not None and v.nota_ocupacao < 50)
+        or (v.manutencoes_6m or 0) >= 5
+        or (v.odometro_km or 0) >= 0.9 * KM_REFERENCIA_CATEGORIA.get(v.categoria, 250_000)
+    ]
+    candidatos.sort(key=lambda v: (v.nota_ocupacao is None, v.nota_ocupacao or 0))
+    assert [r.veiculo_id for r in resumo.recomendacoes] == [v.id for v in candidatos]
+    assert any(r.nota_ocupacao is None for r in resumo.recomendacoes)
+
+def test_paineis_solicitados(db):
+    resumo = get_dashboard_resumo(db, ["top_custos"], 3)
+    assert resumo.kpis is None and resumo.recomendacoes is None
+    assert [t.valor for t in resumo.top_custos] == [0, 0, 0]
@@ -0,0 +1,79 @@
+"""
+Testes da exportação em streaming (CSV e NDJSON)
+"""
+import csv
+import gzip
+import io
+import json
+from datetime import date, datetime
+
+import pytest
+
+from app import exportacao
+from app.exportacao import stream_exportacao
+from app.importacao_csv import importar_csv
+from app.models import Veiculo, Manutencao
+from conftest import veiculo
+
+@pytest.fixture
+def organizacoes():
+    return [
+        {"id": 1, "nome": "Comando Metropolitano", "tipo": "Comando"},
+        {"id": 2, "nome": "1º Batalhão", "tipo": "Batalhao", "pai_id": 1},
+        {"id": 3, "nome": "Comando Interior", "tipo": "Comando"}
+    ]
+
+@pytest.fixture
+def veiculos():
+    return [
+        veiculo(1, organizacao_id=2, odometro_km=10_000, latitude=-23.5, longitude=-46.6),
+        veiculo(2, organizacao_id=2, odometro_km=290_000),
+        veiculo(3, organizacao_id=3, odometro_km=50_000)
+    ]
+
+@pytest.fixture
+def db(db):
+    db.add_all([
+        Manutencao(veiculo_id=v, data=datetime(2024, mes, 10), tipo="Revisão geral", custo=100.0 * mes)
+        for v in (1, 2, 3) for mes in (1, 6, 12)
+    ])
+    db.commit()
+    return db
+
+def _texto(blocos, compactado=False):
+    dados = b"".join(blocos)
+    return (gzip.decompress(dados) if compactado else dados).decode("utf-8-sig")
+
+def test_csv_em_blocos_e_reimportavel(db, monkeypatch):
+    monkeypatch.setattr(exportacao, "EXPORTACAO_BYTES_POR_BLOCO", 64)
+    blocos = list(stream_exportacao(db, "veiculos", "csv"))
+    assert len(blocos) > 2
+    
+    linhas = list(csv.DictReader(io.StringIO(_texto(blocos))))
+    assert [linha["prefixo"] for linha in linhas] == ["PM-001", "PM-002", "PM-003"]
+    assert (linhas[0]["ativo"], linhas[0]["organizacao"], linhas[1]["latitude"]) == ("true", "1º Batalhão", "")
+    assert linhas[1]["nota_ocupacao"] == str(db.get(Veiculo, 2).nota_ocupacao)
+    
+    resultado = importar_csv(db, "veiculos", io.BytesIO(b"".join(blocos)))
+    assert (resultado["atualizadas"], resultado["rejeitadas"]) == (3, 0)
+
+def test_ndjson_com_filtros_do_mapa(db):
+    linhas = [json.loads(linha) for linha in _texto(stream_exportacao(
+        db, "veiculos", "ndjson", {"comando": "Metropolitano", "faixa": "Adequado"}
+    )).splitlines()]
+    assert [(linha["id"], linha["faixa_ocupacao"]) for linha in linhas] == [(1, "Adequado")]
+    assert linhas[0]["latitude"] == -23.5
+
+def test_manutencoes_por_periodo_com_gzip(db):
+    filtros = {"viatura": "PM-00"}
+    texto = _texto(
+        stream_exportacao(db, "manutencoes", "csv", filtros, date(2024, 6, 1), date(2024, 6, 10), gzip=True),
+        compactado=True
+    )
+    linhas = list(csv.DictReader(io.StringIO(texto)))
+    assert [(linha["prefixo"], linha["data"]) for linha in linhas] == [
+        ("PM-001", "2024-06-10T00:00:00"), ("PM-002", "2024-06-10T00:00:00"), ("PM-003", "2024-06-10T00:00:00")
+    ]
+    
+    with pytest.raises(ValueError):
+        stream_exportacao(db, "manutencoes", "xml")
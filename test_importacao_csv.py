@@ -0,0 +1,88 @@
+"""
+Testes da importação de CSV (veículos, manutenções e uso de horas)
+"""
+import io
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.custos import reconstruir_custos
+from app.importacao_csv import importar_csv
+from app.models import Veiculo, Manutencao, UsoHoras, UsoHorasMensal, CustoManutencaoMensal
+from app.uso_mensal import reconstruir_uso_mensal
+from conftest import veiculo
+
+@pytest.fixture
+def veiculos():
+    return [veiculo(i, odometro_km=50_000) for i in (1, 2)]
+
+def _csv(*linhas):
+    return io.BytesIO("\n".join(linhas).encode("utf-8"))
+
+def test_veiculos_inseridos_ou_atualizados_por_prefixo_ou_placa(db):
+    resultado = importar_csv(db, "veiculos", _csv(
+        "prefixo,placa,categoria,organizacao_id,municipio,bairro,area_atuacao,odometro_km,horas_mes",
+        "PM-900,NEW0900,Moto,1,Osasco,Centro,Rural,1000,500",
+        "pm-001,ABC0001,Van,1,São Paulo,Centro,Urbana,250000,",
+        "PM-777,ABC0002,SUV,1,São Paulo,Centro,Urbana,60000,",
+        "PM-001,ABC0002,SUV,1,São Paulo,Centro,Urbana,0,",
+        "PM-902,NEW0902,SUV,7,São Paulo,Centro,Urbana,0,",
+        "PM-903,NEW0903,SUV,1,São Paulo,Centro"
+    ), lote=2)
+    
+    assert (resultado["inseridas"], resultado["atualizadas"], resultado["rejeitadas"]) == (1, 2, 3)
+    assert [erro["linha"] for erro in resultado["erros"]] == [5, 6, 7]
+    assert "quantidade de colunas" in resultado["erros"][2]["erro"]
+    
+    novo = db.query(Veiculo).filter_by(prefixo="PM-900").one()
+    assert (novo.categoria, novo.horas_mes, novo.nota_ocupacao is not None) == ("Moto", 0, True)
+    assert (db.get(Veiculo, 1).categoria, db.get(Veiculo, 1).odometro_km) == ("Van", 250000)
+    assert db.get(Veiculo, 2).prefixo == "PM-777"
+
+def test_manutencoes_mantem_custos_e_indicadores(db, tabela):
+    hoje = datetime.now().strftime("%d/%m/%Y")
+    recente = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
+    resultado = importar_csv(db, "manutencoes", _csv(
+        "veiculo_id,prefixo,placa,data,tipo,custo",
+        f",PM-001,,{hoje},Troca de óleo,300",
+        f",,abc0002,{recente},Revisão geral,1200.50",
+        "1,,,2020-03-10,Pintura,1700",
+        f",PM-001,,{hoje},Troca de óleo,350",
+        ",PM-999,,2020-03-10,Pintura,1",
+        "x,,,2020-03-10,Pintura,1",
+        ",PM-001,,ontem,Pintura,1"
+    ), lote=2)
+    
+    assert (resultado["importadas"], resultado["rejeitadas"]) == (4, 3)
+    assert [erro["linha"] for erro in resultado["erros"]] == [6, 7, 8]
+    # A segunda troca de óleo de hoje substituiu a primeira (outro lote)
+    assert (resultado["inseridas"], resultado["atualizadas"]) == (3, 1)
+    assert db.query(Manutencao).filter_by(veiculo_id=1).count() == 2
+    
+    db.expire_all()
+    assert (db.get(Veiculo, 1).manutencoes_6m, db.get(Veiculo, 2).manutencoes_6m) == (1, 1)
+    colunas = (CustoManutencaoMensal.veiculo_id, CustoManutencaoMensal.ano_mes, CustoManutencaoMensal.custo_acumulado)
+    importados = tabela(*colunas)
+    reconstruir_custos(db)
+    assert tabela(*colunas) == importados
+    assert importados[1][2] == 2050.0
+
+def test_uso_horas_substitui_competencia(db, tabela):
+    cabecalho = "placa;ano_mes;horas"
+    importar_csv(db, "uso_horas", _csv(cabecalho, "ABC0001;2024-01;100", "ABC0002;2024-01;80", "ABC0001;2024-02;90"))
+    resultado = importar_csv(db, "uso_horas", _csv(cabecalho, "ABC0001;2024-01;120", "ABC0001;2024-13;1"))
+    
+    assert (resultado["inseridas"], resultado["atualizadas"], resultado["rejeitadas"]) == (0, 1, 1)
+    assert "ano_mes" in resultado["erros"][0]["erro"]
+    assert db.query(UsoHoras).count() == 3
+    
+    colunas = (UsoHorasMensal.ano_mes, UsoHorasMensal.horas, UsoHorasMensal.registros)
+    importados = tabela(*colunas)
+    reconstruir_uso_mensal(db)
+    assert tabela(*colunas) == importados == [("2024-01", 200, 2), ("2024-02", 90, 1)]
+
+def test_arquivo_invalido(db):
+    with pytest.raises(ValueError):
+        importar_csv(db, "veiculos", _csv(""))
+    with pytest.raises(ValueError):
+        importar_csv(db, "abastecimentos", _csv("a,b"))
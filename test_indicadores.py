@@ -0,0 +1,83 @@
+"""
+Testes dos indicadores derivados dos eventos (manutencoes_6m e horas_mes)
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from app.indicadores import reconstruir_indicadores, sincronizar_indicadores
+from app.models import Veiculo, Manutencao, UsoHoras
+from app.config import MANUTENCOES_JANELA_DIAS
+from conftest import veiculo
+
+AGORA = datetime.now()
+MES_ATUAL = AGORA.strftime("%Y-%m")
+MES_ANTERIOR = (AGORA.replace(day=1) - timedelta(days=1)).strftime("%Y-%m")
+
+@pytest.fixture
+def veiculos():
+    # Valores gravados à parte, que a reconstrução deve corrigir
+    return [veiculo(i, odometro_km=100_000, horas_mes=999, manutencoes_6m=99) for i in (1, 2)]
+
+@pytest.fixture
+def db(db):
+    reconstruir_indicadores(db, AGORA)
+    return db
+
+def _indicadores(db, veiculo_id):
+    veiculo = db.get(Veiculo, veiculo_id)
+    return veiculo.manutencoes_6m, veiculo.horas_mes
+
+def _manutencao(veiculo_id, dias_atras):
+    return Manutencao(veiculo_id=veiculo_id, data=AGORA - timedelta(days=dias_atras), tipo="Revisão geral")
+
+def test_reconstrucao_corrige_valores_gravados_a_parte(db):
+    assert _indicadores(db, 1) == (0, 0)
+    assert db.get(Veiculo, 1).nota_ocupacao is not None
+
+def test_eventos_atualizam_apenas_o_veiculo_afetado(db):
+    db.add_all([_manutencao(1, 10), _manutencao(1, 30), _manutencao(1, MANUTENCOES_JANELA_DIAS + 10)])
+    db.add_all([
+        UsoHoras(veiculo_id=1, ano_mes=MES_ANTERIOR, horas=150),
+        UsoHoras(veiculo_id=1, ano_mes=MES_ATUAL, horas=40),
+        UsoHoras(veiculo_id=1, ano_mes=MES_ATUAL, horas=2)
+    ])
+    db.commit()
+    assert _indicadores(db, 1) == (2, 42)
+    assert _indicadores(db, 2) == (0, 0)
+    
+    nota_antes = db.get(Veiculo, 1).nota_ocupacao
+    db.add_all([_manutencao(1, 1) for _ in range(4)])
+    db.commit()
+    assert _indicadores(db, 1) == (6, 42)
+    assert db.get(Veiculo, 1).nota_ocupacao < nota_antes
+    
+    db.delete(db.query(Manutencao).filter_by(veiculo_id=1).order_by(Manutencao.data.desc()).first())
+    db.query(UsoHoras).filter_by(veiculo_id=1, ano_mes=MES_ATUAL, horas=2).one().veiculo_id = 2
+    db.commit()
+    assert _indicadores(db, 1) == (5, 40)
+    assert _indicadores(db, 2) == (0, 2)
+
+def test_janela_expira_com_o_tempo(db):
+    db.add_all([_manutencao(1, 10), _manutencao(1, 100), _manutencao(2, 100)])
+    db.commit()
+    assert _indicadores(db, 1) == (2, 0)
+    
+    # 100 dias depois, as manutenções de 100 dias atrás saíram da janela
+    depois = AGORA + timedelta(days=MANUTENCOES_JANELA_DIAS - 50)
+    assert sincronizar_indicadores(db, depois) == 2
+    assert _indicadores(db, 1) == (1, 0)
+    assert _indicadores(db, 2) == (0, 0)
+    assert sincronizar_indicadores(db, depois) == 0
+
+def test_reconstrucao_igual_ao_incremental(db):
+    db.add_all([_manutencao(v, d) for v in (1, 2) for d in (5, 50, 150, 250)])
+    db.add(UsoHoras(veiculo_id=2, ano_mes=MES_ANTERIOR, horas=120))
+    db.commit()
+    incremental = [_indicadores(db, v) for v in (1, 2)]
+    
+    db.execute(update(Veiculo).values(manutencoes_6m=0, horas_mes=0))
+    db.commit()
+    assert reconstruir_indicadores(db) == 2
+    assert [_indicadores(db, v) for v in (1, 2)] == incremental == [(3, 0), (3, 120)]
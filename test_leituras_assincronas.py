@@ -0,0 +1,96 @@
+"""
+Testes das leituras assíncronas: mesmas respostas das versões síncronas, sem run_sync
+"""
+import asyncio
+import json
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from conftest import veiculo
+from app import organizacoes as indice_organizacoes, services
+from app.cache import cache_servicos, registrar_escrita
+
+@pytest.fixture
+def organizacoes():
+    return [
+        {"id": 1, "nome": "Metropolitano", "tipo": "Comando"},
+        {"id": 2, "nome": "1º Batalhão", "tipo": "Batalhao", "pai_id": 1},
+        {"id": 3, "nome": "2º Batalhão", "tipo": "Batalhao"}
+    ]
+
+@pytest.fixture
+def veiculos():
+    return [
+        veiculo(
+            i, organizacao_id=2 if i % 2 else 3, odometro_km=i * 10_000, manutencoes_6m=i % 7,
+            latitude=-23.5 + i / 100, longitude=-46.6 - i / 100
+        )
+        for i in range(1, 21)
+    ]
+
+@pytest.fixture
+def leitura(db, engine, monkeypatch):
+    """Executa uma corrotina com uma AsyncSession sobre o mesmo banco"""
+    async def falhar(*args, **kwargs):
+        raise AssertionError("leitura assíncrona não deve usar run_sync")
+    monkeypatch.setattr(AsyncSession, "run_sync", falhar)
+    
+    def executar(corrotina):
+        async def principal():
+            motor = create_async_engine(engine.url.set(drivername="sqlite+aiosqlite"))
+            try:
+                async with async_sessionmaker(motor)() as sessao:
+                    return await corrotina(sessao)
+            finally:
+                await motor.dispose()
+        cache_servicos.invalidar()
+        return asyncio.run(principal())
+    return executar
+
+def _juntar(blocos) -> dict:
+    return json.loads(b"".join(blocos))
+
+async def _juntar_async(blocos) -> dict:
+    return json.loads(b"".join([bloco async for bloco in blocos]))
+
+def test_servicos_iguais_aos_sincronos(db, leitura):
+    casos = [
+        (services.get_dashboard_resumo, services.get_dashboard_resumo_async, (None, 5)),
+        (services.get_recomendacoes_descarte, services.get_recomendacoes_descarte_async, ()),
+        (services.get_serie_uso_horas, services.get_serie_uso_horas_async, (None, None, 1)),
+        (services.get_resumo_areas, services.get_resumo_areas_async, ())
+    ]
+    for sincrono, assincrono, argumentos in casos:
+        cache_servicos.invalidar()
+        esperado = sincrono(db, *argumentos)
+        assert leitura(lambda sessao: assincrono(sessao, *argumentos)) == esperado
+    
+    cache_servicos.invalidar()
+    esperado = services.get_clusters_viaturas(db, 3, comando="Metro")
+    assert leitura(lambda sessao: services.get_clusters_viaturas_async(sessao, 3, comando="Metro")) == esperado
+    assert sum(f["properties"]["quantidade"] for f in esperado["features"]) == 10
+
+def test_indice_lido_antes_de_escrita_nao_fica_em_cache(db, leitura, monkeypatch):
+    registrar_escrita({"organizacao"})
+    montar = indice_organizacoes.IndiceOrganizacoes
+    
+    def montar_com_escrita(linhas):
+        # Organização alterada enquanto a consulta do índice estava em andamento
+        registrar_escrita({"organizacao"})
+        return montar(linhas)
+    monkeypatch.setattr(indice_organizacoes, "IndiceOrganizacoes", montar_com_escrita)
+    
+    assert leitura(indice_organizacoes.obter_indice_async).descendentes_de({1}) == {1, 2}
+    assert indice_organizacoes._indice is None
+    assert indice_organizacoes.obter_indice(db).descendentes_de({1}) == {1, 2}
+    assert indice_organizacoes._indice is None
+    
+    monkeypatch.setattr(indice_organizacoes, "IndiceOrganizacoes", montar)
+    assert leitura(indice_organizacoes.obter_indice_async) is indice_organizacoes._indice is not None
+
+def test_stream_de_viaturas_e_delta(db, leitura):
+    for filtros in ({"batalhao": "2º"}, {"desde": 0}, {"desde": 10 ** 9}):
+        esperado = _juntar(services.stream_geo_viaturas(db, **filtros))
+        assert leitura(lambda sessao: _juntar_async(services.stream_geo_viaturas_async(sessao, **filtros))) == esperado
+    assert len(esperado["features"]) == 0 and esperado["removidos"] == []
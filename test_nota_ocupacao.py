@@ -0,0 +1,116 @@
+"""
+Testes da Nota de Ocupação calculada em lote
+"""
+import itertools
+import random
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.db import Base
+from app.models import Organizacao, Veiculo
+from app.services import (
+    KM_REFERENCIA_CATEGORIA, AREA_FATOR, MNT_MAX_6M, W_KM, W_MNT,
+    calcular_nota_ocupacao, calcular_notas_ocupacao, faixa_ocupacao, nota_ocupacao_expr, recalcular_notas,
+    _avaliar_descarte
+)
+
+CATEGORIAS = list(KM_REFERENCIA_CATEGORIA) + ["Desconhecida"]
+AREAS = list(AREA_FATOR) + ["Desconhecida"]
+
+def _nota_referencia(veiculo):
+    """Fórmula escrita passo a passo, veículo a veículo, usada como referência"""
+    km_norm = min(veiculo.odometro_km / KM_REFERENCIA_CATEGORIA.get(veiculo.categoria, 250_000), 1.0)
+    mnt_norm = min(veiculo.manutencoes_6m / MNT_MAX_6M, 1.0)
+    desgaste = (W_KM * km_norm + W_MNT * mnt_norm) * AREA_FATOR.get(veiculo.area_atuacao, 1.0)
+    nota = round(max(0, min(100, 100 * (1 - desgaste))))
+    return nota, faixa_ocupacao(nota)
+
+def _comparar(veiculos):
+    notas, faixas = calcular_notas_ocupacao(
+        [v.categoria for v in veiculos],
+        [v.odometro_km for v in veiculos],
+        [v.manutencoes_6m for v in veiculos],
+        [v.area_atuacao for v in veiculos]
+    )
+    esperado = [_nota_referencia(v) for v in veiculos]
+    assert list(zip(notas, faixas)) == esperado
+    assert [calcular_nota_ocupacao(v) for v in veiculos[:1000]] == esperado[:1000]
+
+def test_lote_igual_escalar_em_grade():
+    """Grade com km múltiplos de 1.000, onde empates de arredondamento aparecem"""
+    veiculos = [
+        SimpleNamespace(categoria=c, area_atuacao=a, odometro_km=km, manutencoes_6m=m)
+        for c, a, km, m in itertools.product(
+            CATEGORIAS, AREAS, range(0, 400_001, 1_000), range(0, MNT_MAX_6M + 3)
+        )
+    ]
+    _comparar(veiculos)
+
+def test_lote_igual_escalar_aleatorio():
+    rnd = random.Random(42)
+    veiculos = [
+        SimpleNamespace(
+            categoria=rnd.choice(CATEGORIAS),
+            area_atuacao=rnd.choice(AREAS),
+            odometro_km=rnd.randint(0, 500_000),
+            manutencoes_6m=rnd.randint(0, 12)
+        )
+        for _ in range(50_000)
+    ]
+    _comparar(veiculos)
+
+def test_sql_igual_python():
+    """A nota calculada pelo banco (recalcular_notas) é a mesma do Python"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    # Amostra da grade de test_lote_igual_escalar_em_grade, com os empates de arredondamento
+    combinacoes = random.Random(42).sample(list(itertools.product(
+        CATEGORIAS, AREAS, range(0, 400_001, 1_000), range(0, MNT_MAX_6M + 3)
+    )), 30_000)
+    with Session(engine) as db:
+        db.add(Organizacao(id=1, nome="1º Batalhão", tipo="Batalhao"))
+        db.execute(insert(Veiculo.__table__), [
+            {
+                "prefixo": f"PM-{i}", "placa": f"P{i}", "categoria": c, "organizacao_id": 1, "municipio": "São Paulo",
+                "bairro": "Centro", "area_atuacao": a, "odometro_km": km, "manutencoes_6m": m
+            }
+            for i, (c, a, km, m) in enumerate(combinacoes)
+        ])
+        recalcular_notas(db)
+        linhas = db.execute(
+            select(Veiculo.categoria, Veiculo.odometro_km, Veiculo.manutencoes_6m, Veiculo.area_atuacao,
+                   Veiculo.nota_ocupacao, Veiculo.faixa_ocupacao).order_by(Veiculo.id)
+        ).all()
+    engine.dispose()
+    
+    notas, faixas = calcular_notas_ocupacao(*zip(*[linha[:4] for linha in linhas]))
+    assert [tuple(linha[4:]) for linha in linhas] == list(zip(notas, faixas))
+
+def test_sql_sem_funcoes_exclusivas_do_sqlite():
+    sql = str(nota_ocupacao_expr().compile(dialect=postgresql.dialect()))
+    assert "least(" in sql and "greatest(" in sql and "floor(" in sql
+    assert "min(" not in sql and "max(" not in sql
+
+def test_sql_postgresql_arredonda_com_inteiro():
+    # floor() devolve double precision no PostgreSQL: o módulo do desempate precisa de inteiro
+    sql = str(nota_ocupacao_expr().compile(dialect=postgresql.dialect()))
+    assert "CAST(floor(" in sql
+    assert "AS INTEGER) %% " in sql and ") %% " not in sql.replace("AS INTEGER) %% ", "")
+    assert "floor(" not in str(nota_ocupacao_expr().compile(dialect=sqlite.dialect()))
+
+def test_lote_vazio():
+    assert calcular_notas_ocupacao([], [], [], []) == ([], [])
+
+def test_descarte_com_campos_nulos():
+    veiculo = SimpleNamespace(
+        id=1, prefixo="PM-001", placa="ABC0001", categoria="SUV", organizacao_nome="1º Batalhão",
+        nota_ocupacao=None, manutencoes_6m=None, odometro_km=None, valor_fipe=None, custo_12m=0.0
+    )
+    assert _avaliar_descarte(veiculo) is None
+    
+    veiculo.manutencoes_6m = 7
+    recomendacao = _avaliar_descarte(veiculo)
+    assert (recomendacao.motivo, recomendacao.nota_ocupacao) == ("Excesso de manutenções (7 em 6 meses)", None)
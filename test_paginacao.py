@@ -0,0 +1,46 @@
+"""
+Testes da listagem paginada de veículos (keyset) com colunas de ordenação nulas
+"""
+import pytest
+from sqlalchemy import update
+
+from app.models import Veiculo
+from app.services import get_pagina_veiculos
+from conftest import veiculo
+
+FIPE = {1: 3.0, 2: None, 3: 1.0, 4: None, 5: 3.0, 6: 2.0, 7: None}
+
+@pytest.fixture
+def veiculos():
+    return [veiculo(i) for i in FIPE]
+
+@pytest.fixture
+def db(db):
+    # O valor padrão da coluna é aplicado no INSERT; os nulos são gravados depois
+    for veiculo_id, valor in FIPE.items():
+        db.execute(update(Veiculo).where(Veiculo.id == veiculo_id).values(valor_fipe=valor))
+    db.commit()
+    return db
+
+def _percorrer(db, ordem, limite):
+    ids, cursor = [], None
+    while True:
+        pagina = get_pagina_veiculos(
+            db, {}, limite=limite, cursor=cursor, ordenar_por="valor_fipe", ordem=ordem, campos=["id", "valor_fipe"]
+        )
+        ids += [item["id"] for item in pagina.itens]
+        cursor = pagina.proximo_cursor
+        if cursor is None:
+            return ids
+
+@pytest.mark.parametrize("limite", [1, 2, 3, 10])
+def test_nulos_ao_final_nas_duas_ordens(db, limite):
+    assert _percorrer(db, "asc", limite) == [3, 6, 1, 5, 2, 4, 7]
+    assert _percorrer(db, "desc", limite) == [5, 1, 6, 3, 7, 4, 2]
+
+def test_ordenacao_por_coluna_obrigatoria(db):
+    pagina = get_pagina_veiculos(db, {}, limite=3, ordenar_por="prefixo", ordem="desc", campos=["prefixo"])
+    seguinte = get_pagina_veiculos(
+        db, {}, limite=3, cursor=pagina.proximo_cursor, ordenar_por="prefixo", ordem="desc", campos=["prefixo"]
+    )
+    assert [item["prefixo"] for item in pagina.itens + seguinte.itens] == [f"PM-{i:03d}" for i in range(7, 1, -1)]
@@ -0,0 +1,105 @@
+"""
+Testes das migrações de esquema e dos planos de consulta dos endpoints principais
+"""
+import pytest
+from sqlalchemy import create_engine, inspect, select, text
+from sqlalchemy.dialects import postgresql
+
+from conftest import veiculo
+from app.db import Base
+from app.geo import celula_grade
+from app.migracoes import MIGRACOES, aplicar_migracoes
+from app.models import Organizacao, Veiculo, Manutencao, CustoManutencaoMensal, UsoHoras, UsoHorasMensal, GeoViaturas
+
+# Índices criados pelas migrações, removidos para simular um banco antigo
+INDICES_MIGRADOS = (
+    "ix_organizacao_pai_id", "ix_veiculo_categoria", "ix_veiculo_municipio_bairro",
+    "ix_manutencao_veiculo_data", "ix_uso_horas_veiculo_ano_mes", "ix_geo_viaturas_veiculo_id",
+    "ix_veiculo_organizacao_faixa", "ix_veiculo_versao", "ix_manutencao_data", "ix_uso_horas_ano_mes"
+)
+
+# Consultas equivalentes às dos filtros, da hierarquia e do detalhe do veículo
+CONSULTAS = {
+    "filhos da organização": select(Organizacao).where(Organizacao.pai_id == 1),
+    "veículos das organizações": select(Veiculo.id).where(Veiculo.organizacao_id.in_([1, 2, 3])),
+    "veículos por categoria": select(Veiculo.id).where(Veiculo.categoria == "SUV"),
+    "bairros do município": select(Veiculo.bairro).where(Veiculo.municipio == "São Paulo").distinct(),
+    "manutenções do veículo": (
+        select(Manutencao).where(Manutencao.veiculo_id == 1).order_by(Manutencao.data.desc())
+    ),
+    "uso do veículo no mês": select(UsoHoras).where(UsoHoras.veiculo_id == 1, UsoHoras.ano_mes == "2024-01"),
+    "pontos da viatura": select(GeoViaturas.id).where(GeoViaturas.veiculo_id.in_([1, 2])),
+    "alterações desde a versão": select(Veiculo.id).where(Veiculo.versao > 10),
+    "manutenções que saíram da janela": (
+        select(Manutencao.veiculo_id).where(Manutencao.data >= "2024-01-01", Manutencao.data < "2024-01-02")
+    ),
+    "série mensal de uso": (
+        select(UsoHorasMensal.ano_mes, UsoHorasMensal.horas)
+        .where(UsoHorasMensal.ano_mes >= "2020-01", UsoHorasMensal.ano_mes <= "2024-12")
+        .where(UsoHorasMensal.organizacao_id.in_([1, 2]))
+    ),
+    "custo acumulado até o mês": (
+        select(CustoManutencaoMensal.custo_acumulado)
+        .where(CustoManutencaoMensal.veiculo_id == 1, CustoManutencaoMensal.ano_mes <= "2024-06")
+        .order_by(CustoManutencaoMensal.ano_mes.desc()).limit(1)
+    ),
+    "competências que chegaram ao mês": (
+        select(UsoHoras.veiculo_id).where(UsoHoras.ano_mes > "2024-01", UsoHoras.ano_mes <= "2024-02")
+    ),
+    "manutenção substituída na importação": (
+        select(Manutencao.id)
+        .where(Manutencao.veiculo_id == 1, Manutencao.data == "2024-01-01 00:00:00.000000", Manutencao.tipo == "Pintura")
+    ),
+}
+
+@pytest.fixture
+def engine_antigo(tmp_path):
+    """Banco com as tabelas atuais, mas sem os índices das migrações"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'sgv.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for indice in INDICES_MIGRADOS:
+            conn.execute(text(f"DROP INDEX {indice}"))
+    yield engine
+    engine.dispose()
+
+def _plano(engine, consulta) -> list:
+    sql = str(consulta.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+    with engine.connect() as conn:
+        return [linha[-1] for linha in conn.execute(text("EXPLAIN QUERY PLAN " + sql))]
+
+def test_migracoes_aplicadas_uma_vez(engine_antigo):
+    assert aplicar_migracoes(engine_antigo, Base.metadata) == [m.versao for m in MIGRACOES]
+    assert aplicar_migracoes(engine_antigo, Base.metadata) == []
+    
+    existentes = {
+        indice["name"]
+        for tabela in inspect(engine_antigo).get_table_names()
+        for indice in inspect(engine_antigo).get_indexes(tabela)
+    }
+    assert set(INDICES_MIGRADOS) <= existentes
+
+def test_celula_da_grade_cabe_na_coluna(engine_antigo):
+    # Códigos Morton passam do int4 do PostgreSQL
+    celula = celula_grade(45, 10)
+    assert celula > 2 ** 31
+    assert Veiculo.__table__.c.geo_celula.type.compile(dialect=postgresql.dialect()) == "BIGINT"
+    
+    aplicar_migracoes(engine_antigo, Base.metadata)
+    with engine_antigo.begin() as conn:
+        conn.execute(Organizacao.__table__.insert().values(id=1, nome="1º Batalhão", tipo="Batalhao"))
+        conn.execute(Veiculo.__table__.insert().values(veiculo(1, geo_celula=celula)))
+        assert conn.execute(select(Veiculo.geo_celula)).scalar() == celula
+
+def test_consultas_principais_sem_varredura(engine_antigo):
+    aplicar_migracoes(engine_antigo, Base.metadata)
+    
+    for nome, consulta in CONSULTAS.items():
+        plano = _plano(engine_antigo, consulta)
+        varreduras = [passo for passo in plano if passo.startswith("SCAN")]
+        assert not varreduras, f"{nome}: {plano}"
+
+def test_sem_indices_ha_varredura(engine_antigo):
+    """Garante que a verificação do plano detecta a varredura completa"""
+    plano = _plano(engine_antigo, CONSULTAS["veículos por categoria"])
+    assert any(passo.startswith("SCAN") for passo in plano)
@@ -0,0 +1,62 @@
+"""
+Testes do buffer de posições: coalescência por veículo, gravação em lote e falhas
+"""
+from datetime import datetime
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from app import geo, posicoes
+from app.models import Veiculo
+from app.posicoes import BufferPosicoes
+from app.schemas import PosicaoPing
+
+@pytest.fixture
+def buffer(db, engine, monkeypatch):
+    sessoes = sessionmaker(bind=engine)
+    monkeypatch.setattr(posicoes, "SessionLocal", sessoes)
+    monkeypatch.setattr(posicoes, "SessionLeitura", sessoes)
+    monkeypatch.setattr(geo, "_indice_areas", None)
+    return BufferPosicoes(intervalo=60, lote=100)
+
+def _ping(veiculo_id, latitude, minuto):
+    return PosicaoPing(veiculo_id=veiculo_id, latitude=latitude, longitude=-46.6, instante=datetime(2024, 1, 1, 12, minuto))
+
+def _posicao(db, veiculo_id):
+    db.expire_all()
+    veiculo = db.get(Veiculo, veiculo_id)
+    return veiculo.latitude, veiculo.posicao_em
+
+def test_mantem_apenas_o_ping_mais_recente(buffer, db):
+    assert buffer.registrar([_ping(1, -23.1, 5), _ping(1, -23.3, 1), _ping(1, -23.2, 7), _ping(9, -23.0, 1)]) == (3, 1)
+    assert buffer.pendentes == 1
+    
+    assert buffer.gravar() == 1
+    assert _posicao(db, 1) == (-23.2, datetime(2024, 1, 1, 12, 7))
+    assert buffer.pendentes == 0
+    
+    # Ping anterior à posição gravada é descartado na gravação
+    buffer.registrar([_ping(1, -23.9, 6), _ping(2, -23.4, 6)])
+    assert buffer.gravar() == 1
+    assert (_posicao(db, 1)[0], _posicao(db, 2)[0]) == (-23.2, -23.4)
+    assert (buffer.gravadas, buffer.descartadas, buffer.gravacoes) == (2, 1, 2)
+
+def test_falha_devolve_o_lote_ao_buffer(buffer, db, monkeypatch):
+    buffer.registrar([_ping(1, -23.1, 5), _ping(2, -23.2, 5)])
+    
+    def falhar(latitude, longitude):
+        # Chega um ping mais novo do veículo 1 durante a gravação que falha
+        buffer.registrar([_ping(1, -23.5, 9)])
+        raise RuntimeError("banco indisponível")
+    
+    with monkeypatch.context() as m:
+        m.setattr(posicoes, "celula_grade", falhar)
+        with pytest.raises(RuntimeError):
+            buffer.gravar()
+    
+    assert buffer.pendentes == 2
+    assert _posicao(db, 1) == (None, None)
+    
+    assert buffer.gravar() == 2
+    assert (_posicao(db, 1)[0], _posicao(db, 2)[0]) == (-23.5, -23.2)
+    assert buffer.gravacoes == 1
@@ -0,0 +1,44 @@
+"""
+Testes das versões de linha reservadas no banco (sincronização incremental do mapa)
+"""
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from app.migracoes import aplicar_migracoes
+from app.db import Base
+from app.models import Veiculo, SistemaMeta
+from app.sincronizacao import CHAVE_VERSAO, versao_estavel, versao_sessao
+
+def test_versao_reservada_na_transacao(db, engine):
+    # Sem o contador (banco criado sem migrações), parte da maior versão gravada
+    assert versao_estavel(db) == db.get(Veiculo, 2).versao
+    inicial = versao_estavel(db)
+    
+    with Session(engine) as outro_processo:
+        versao = versao_sessao(outro_processo)
+        assert versao == inicial + 1 and versao_sessao(outro_processo) == versao
+        outro_processo.execute(update(Veiculo).where(Veiculo.id == 1).values(odometro_km=1, versao=versao))
+        # Ainda não confirmada: não é estável para os demais
+        assert versao_estavel(db) == inicial
+        outro_processo.commit()
+        
+        db.rollback()
+        assert versao_estavel(db) == versao
+        
+        # Transação desfeita devolve a versão
+        assert versao_sessao(outro_processo) == versao + 1
+        outro_processo.rollback()
+        assert versao_sessao(outro_processo) == versao + 1
+    
+    db.get(Veiculo, 2).ativo = False
+    db.commit()
+    assert db.get(Veiculo, 2).versao == versao + 1
+
+def test_migracao_cria_contador(db, engine):
+    maior = max(v.versao for v in db.query(Veiculo))
+    db.close()
+    
+    aplicar_migracoes(engine, Base.metadata)
+    with Session(engine) as sessao:
+        assert int(sessao.get(SistemaMeta, CHAVE_VERSAO).valor) == maior
+        assert versao_sessao(sessao) == maior + 1
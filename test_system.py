@@ -88,7 +88,7 @@ def main():
                 print(f"   📊 % Ativos: {data.get('pct_ativos', 'N/A')}%")
                 print(f"   📊 Vida útil média: {data.get('vida_util_media', 'N/A')}")
             elif endpoint == "/api/veiculos" and data:
-                print(f"   🚗 Veículos encontrados: {len(data)}")
+                print(f"   🚗 Veículos encontrados: {len(data.get('itens', []))}")
             elif endpoint == "/api/geo/viaturas" and data:
                 print(f"   🗺️ Pontos GeoJSON: {len(data.get('features', []))}")
     
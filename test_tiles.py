@@ -0,0 +1,73 @@
+"""
+Testes dos tiles de batalhões e bases (árvore de caixas, LRU de camadas e invalidação)
+"""
+import json
+import random
+
+import pytest
+
+from app import tiles
+from app.cache import registrar_escrita
+from app.models import GeoBatalhoes, GeoBases
+
+def _quadrado(lon: float, lat: float, lado: float) -> dict:
+    anel = [[lon, lat], [lon + lado, lat], [lon + lado, lat + lado], [lon, lat + lado], [lon, lat]]
+    return {"type": "Polygon", "coordinates": [anel]}
+
+@pytest.fixture
+def db(db, monkeypatch):
+    sorteio = random.Random(7)
+    for i in range(300):
+        lon, lat = sorteio.uniform(-48, -45), sorteio.uniform(-25, -22)
+        db.add(GeoBatalhoes(
+            municipio="São Paulo", batalhao_nome=f"{i}º Batalhão",
+            geojson={"type": "Feature", "geometry": _quadrado(lon, lat, sorteio.uniform(0.01, 0.3)), "properties": {}}
+        ))
+        db.add(GeoBases(
+            municipio="São Paulo", batalhao_nome=f"{i}º Batalhão",
+            geojson={"type": "Feature", "geometry": {"type": "Point", "coordinates": [lon, lat]}, "properties": {}}
+        ))
+    db.commit()
+    registrar_escrita(tiles.TABELAS_TILES)
+    monkeypatch.setattr(tiles, "TILES_MAX_CAMADAS", 2)
+    yield db
+    registrar_escrita(tiles.TABELAS_TILES)
+
+def _varredura(camada: tiles.CamadaZoom, z: int, x: int, y: int) -> dict:
+    """Tile montado com todos os itens, como antes da árvore de caixas"""
+    itens = [(item[0], i) for i, item in enumerate(camada.itens)]
+    raiz, camada.raiz = camada.raiz, (tiles._uniao([caixa for caixa, _ in itens]), [], itens)
+    try:
+        return camada.tile(z, x, y)
+    finally:
+        camada.raiz = raiz
+
+def _tile(lon: float, lat: float, z: int):
+    return tuple(int(v // tiles.TAMANHO_TILE) for v in tiles._projetar(lon, lat, float(tiles.TAMANHO_TILE << z)))
+
+def test_arvore_igual_a_varredura(db):
+    for z in (6, 9, 11):
+        camada = tiles.CamadaZoom(tiles._carregar_feicoes(db), z)
+        x0, y0 = _tile(-48, -22, z)
+        x1, y1 = _tile(-45, -25, z)
+        for x in range(x0, min(x1, x0 + 8) + 1):
+            for y in range(y0, min(y1, y0 + 8) + 1):
+                assert camada.tile(z, x, y) == _varredura(camada, z, x, y)
+
+def test_camadas_limitadas_e_invalidadas(db, monkeypatch):
+    primeiro = tiles.obter_tile(db, 8, *_tile(-46.5, -23.5, 8))
+    assert json.loads(primeiro)["features"]
+    for z in (9, 10):
+        tiles.obter_tile(db, z, 0, 0)
+    assert list(tiles._camadas) == [9, 10]
+    assert tiles.obter_tile(db, 8, *_tile(-46.5, -23.5, 8)) == primeiro
+    
+    # Invalidação durante a montagem: o resultado não entra no cache
+    camada = tiles.CamadaZoom
+    
+    def montar(feicoes, z):
+        registrar_escrita({"geo_bases"})
+        return camada(feicoes, z)
+    monkeypatch.setattr(tiles, "CamadaZoom", montar)
+    assert json.loads(tiles.obter_tile(db, 12, 0, 0)) == {"type": "FeatureCollection", "features": []}
+    assert not tiles._camadas and not tiles._tiles
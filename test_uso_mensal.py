@@ -0,0 +1,69 @@
+"""
+Testes da série mensal de uso agregada (uso_horas_mensal)
+"""
+import pytest
+
+from app.models import Veiculo, UsoHoras, UsoHorasMensal
+from app.services import get_serie_uso_horas
+from app.uso_mensal import reconstruir_uso_mensal
+from conftest import veiculo
+
+@pytest.fixture
+def organizacoes():
+    return [
+        {"id": 1, "nome": "Comando", "tipo": "Comando"},
+        {"id": 2, "nome": "1º Batalhão", "tipo": "Batalhao", "pai_id": 1},
+        {"id": 3, "nome": "2º Batalhão", "tipo": "Batalhao", "pai_id": 1}
+    ]
+
+@pytest.fixture
+def veiculos():
+    return [
+        veiculo(i, categoria=categoria, organizacao_id=org)
+        for i, org, categoria in ((1, 2, "SUV"), (2, 2, "Moto"), (3, 3, "SUV"))
+    ]
+
+@pytest.fixture
+def serie_mensal(tabela):
+    return lambda: tabela(
+        UsoHorasMensal.ano_mes, UsoHorasMensal.organizacao_id, UsoHorasMensal.categoria,
+        UsoHorasMensal.horas, UsoHorasMensal.registros
+    )
+
+def test_incremental_igual_a_reconstrucao(db, serie_mensal):
+    db.add_all([
+        UsoHoras(veiculo_id=v, ano_mes=f"2023-{m:02d}", horas=100 + 10 * v + m)
+        for v in (1, 2, 3) for m in range(1, 13)
+    ])
+    db.commit()
+    
+    uso = db.query(UsoHoras).filter_by(veiculo_id=1, ano_mes="2023-03").one()
+    uso.horas = 0
+    uso.ano_mes = "2023-04"
+    db.delete(db.query(UsoHoras).filter_by(veiculo_id=2, ano_mes="2023-05").one())
+    db.get(Veiculo, 3).organizacao_id = 2
+    db.get(Veiculo, 2).categoria = "SUV"
+    db.commit()
+    
+    incremental = serie_mensal()
+    assert reconstruir_uso_mensal(db) == len(incremental)
+    assert serie_mensal() == incremental
+    assert ("2023-03", 2, "SUV", 123 + 133, 2) in incremental
+
+def test_serie_filtra_periodo_e_subarvore(db):
+    db.add_all([
+        UsoHoras(veiculo_id=v, ano_mes=ano_mes, horas=horas)
+        for v, ano_mes, horas in (
+            (1, "2022-12", 50), (1, "2023-01", 100), (2, "2023-01", 40), (3, "2023-01", 60), (3, "2023-02", 80)
+        )
+    ])
+    db.commit()
+    
+    serie = get_serie_uso_horas.sem_cache(db, "2023-01", "2023-12", 1)
+    assert [(p.ano_mes, p.horas, p.registros) for p in serie] == [("2023-01", 200, 3), ("2023-02", 80, 1)]
+    
+    serie = get_serie_uso_horas.sem_cache(db, organizacao_id=2, por_categoria=True)
+    assert [(p.ano_mes, p.categoria, p.horas) for p in serie] == [
+        ("2022-12", "SUV", 50), ("2023-01", "Moto", 40), ("2023-01", "SUV", 100)
+    ]
+    assert serie[-1].media_horas == 100.0
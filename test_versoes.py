@@ -0,0 +1,46 @@
+"""
+Testes das versões de conteúdo persistidas (ETag/Last-Modified)
+"""
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from app import versoes
+from app.cache import anotar_escrita
+from app.models import Organizacao, Veiculo, GeoBases
+
+TABELAS = ["organizacao", "geo_bases"]
+
+def _etag(engine):
+    # Sessão nova a cada leitura, como outro processo
+    with Session(engine) as sessao:
+        return versoes.etag("recurso", versoes.ler_estado(sessao, TABELAS), TABELAS)
+
+def test_versao_gravada_no_commit(db, engine):
+    inicial = _etag(engine)
+    assert inicial == 'W/"recurso-0-1"'  # organizacao gravada pela fixture
+    
+    db.add(Organizacao(id=9, nome="9º Batalhão", tipo="Batalhao"))
+    db.flush()
+    assert _etag(engine) == inicial
+    db.rollback()
+    assert _etag(engine) == inicial
+    
+    db.get(Veiculo, 1).ativo = False
+    db.commit()
+    assert _etag(engine) == inicial
+    
+    # Escrita em lote anotada explicitamente
+    db.execute(insert(GeoBases.__table__).values(batalhao_nome="Base Centro", municipio="São Paulo", geojson={}))
+    anotar_escrita(db, "geo_bases")
+    db.commit()
+    assert _etag(engine) == 'W/"recurso-1-1"'
+
+def test_requisicao_condicional(db):
+    estado = versoes.ler_estado(db, TABELAS)
+    etag = versoes.etag("recurso", estado, TABELAS)
+    ultima = versoes.last_modified(estado, TABELAS)
+    
+    assert versoes.nao_modificado(estado, TABELAS, etag, etag, None)
+    assert not versoes.nao_modificado(estado, TABELAS, etag, 'W/"recurso-0-0"', None)
+    assert versoes.nao_modificado(estado, TABELAS, etag, None, ultima)
+    assert not versoes.nao_modificado(estado, TABELAS, etag, None, "Mon, 01 Jan 2001 00:00:00 GMT")